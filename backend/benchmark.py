@@ -0,0 +1,372 @@
+"""
+予約APIの負荷テスト・ベンチマーク
+
+ローカルの SQLite データベースに指定した件数の予約を投入し、
+フロントエンドと同じ間隔のポーリング（トップ画面・管理画面 10秒、待ち状況画面 30秒）と
+体験開始・完了・新規予約・自動完了を API に対して再現して、
+エンドポイントごとのレイテンシ（p50/p95/p99）・スループット・
+1リクエストあたりのデータベース呼び出し回数を表示する
+
+アプリはプロセス内で直接呼び出すため（ネットワークを経由しない）、
+計測値は API とデータベース処理の時間になる
+
+使い方:
+    python benchmark.py --waiting 500 --top-clients 200 --wait-clients 300 --duration 60
+    python benchmark.py --time-scale 0.1 --json   # ポーリング間隔を 1/10 にして短時間で計測
+"""
+import argparse
+import asyncio
+import contextlib
+import contextvars
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+# 計測中のリクエスト（データベース呼び出しをリクエストごとに集計するため）
+current_endpoint: contextvars.ContextVar[str] = contextvars.ContextVar("current_endpoint", default="background")
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """
+    ソート済みの値から p パーセンタイル（最近傍順位法）を返す
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(-(-p * len(sorted_values) // 100)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class Recorder:
+    """
+    エンドポイントごとのレイテンシ・ステータス・データベース呼び出し回数
+    """
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        self.db_calls: Dict[str, int] = defaultdict(int)
+        self.db_calls_by_operation: Dict[str, int] = defaultdict(int)
+
+    def record(self, endpoint: str, seconds: float, status_code: int) -> None:
+        self.latencies[endpoint].append(seconds)
+        self.statuses[endpoint][status_code] += 1
+
+    def record_db_call(self, operation: str) -> None:
+        self.db_calls[current_endpoint.get()] += 1
+        self.db_calls_by_operation[operation] += 1
+
+    def summary(self, elapsed_seconds: float) -> dict:
+        endpoints = {}
+        for endpoint, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            endpoints[endpoint] = {
+                "requests": len(values),
+                "p50_ms": round(percentile(values, 50) * 1000, 2),
+                "p95_ms": round(percentile(values, 95) * 1000, 2),
+                "p99_ms": round(percentile(values, 99) * 1000, 2),
+                "max_ms": round(values[-1] * 1000, 2),
+                "statuses": dict(sorted(self.statuses[endpoint].items())),
+                "db_calls_per_request": round(self.db_calls.get(endpoint, 0) / len(values), 3),
+            }
+
+        total_requests = sum(len(v) for v in self.latencies.values())
+        total_db_calls = sum(n for endpoint, n in self.db_calls.items() if endpoint != "background")
+        return {
+            "elapsed_seconds": round(elapsed_seconds, 2),
+            "requests": total_requests,
+            "throughput_rps": round(total_requests / elapsed_seconds, 2) if elapsed_seconds else 0.0,
+            "db_calls_per_request": round(total_db_calls / total_requests, 3) if total_requests else 0.0,
+            "background_db_calls": self.db_calls.get("background", 0),
+            "db_calls_by_operation": dict(sorted(self.db_calls_by_operation.items())),
+            "endpoints": endpoints,
+        }
+
+
+class CountingRepository:
+    """
+    リポジトリの呼び出し（＝データベースへの往復）を数えるラッパー
+    """
+
+    def __init__(self, inner, recorder: Recorder):
+        self._inner = inner
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        attr = getattr(self._inner, name)
+        if name in ("connect", "close") or not asyncio.iscoroutinefunction(attr):
+            return attr
+
+        async def counted(*args, **kwargs):
+            self._recorder.record_db_call(name)
+            return await attr(*args, **kwargs)
+
+        return counted
+
+
+def seed_database(path: str, args, schema_path: str) -> List[int]:
+    """
+    予約を投入し、待機中の予約番号を返す
+
+    体験中の予約は、計測中に順に体験時間が終わる（自動完了される）ように開始時刻をずらす
+    """
+    rng = random.Random(args.seed)
+    now = datetime.now(timezone.utc)
+
+    def iso(value: datetime) -> str:
+        return value.isoformat(timespec="microseconds")
+
+    rows = []
+    for i in range(args.completed):
+        created_at = now - timedelta(hours=rng.uniform(1, 24 * args.history_days))
+        completed_at = created_at + timedelta(minutes=rng.uniform(5, 60))
+        rows.append((str(uuid.uuid4()), f"完了{i}", "completed", iso(created_at),
+                     iso(completed_at - timedelta(minutes=args.duration_minutes)), iso(completed_at), iso(completed_at), None))
+
+    for seat_number in range(1, args.seats + 1):
+        # 計測時間内のどこかで体験時間が終わる
+        started_at = now - timedelta(minutes=args.duration_minutes) + timedelta(seconds=rng.uniform(1, args.duration))
+        rows.append((str(uuid.uuid4()), f"体験中{seat_number}", "in_progress", iso(started_at - timedelta(minutes=30)),
+                     iso(started_at), None, iso(started_at), seat_number))
+
+    for i in range(args.waiting):
+        created_at = now - timedelta(seconds=args.waiting - i)
+        rows.append((str(uuid.uuid4()), f"待機{i}", "waiting", iso(created_at), None, None, iso(created_at), None))
+
+    conn = sqlite3.connect(path)
+    with open(schema_path, encoding="utf-8") as f:
+        conn.executescript(f.read())
+    conn.executemany(
+        "INSERT INTO reservations (id, name, status, created_at, started_at, completed_at, updated_at, seat_number)"
+        " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        rows,
+    )
+    conn.commit()
+    waiting = [r[0] for r in conn.execute("SELECT queue_number FROM reservations WHERE status = 'waiting' ORDER BY queue_number")]
+    conn.close()
+    return waiting
+
+
+class Browser:
+    """
+    1つのブラウザ（タブ）。ETag を覚えて If-None-Match で再検証する
+    """
+
+    def __init__(self, client, recorder: Recorder):
+        self.client = client
+        self.recorder = recorder
+        self.etags: Dict[str, str] = {}
+
+    async def request(self, endpoint: str, method: str, url: str, json_body: Optional[dict] = None):
+        headers = {}
+        if method == "GET" and url in self.etags:
+            headers["If-None-Match"] = self.etags[url]
+
+        token = current_endpoint.set(endpoint)
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, json=json_body, headers=headers)
+        finally:
+            elapsed = time.perf_counter() - started
+            current_endpoint.reset(token)
+
+        self.recorder.record(endpoint, elapsed, response.status_code)
+        etag = response.headers.get("etag")
+        if etag:
+            self.etags[url] = etag
+        return response
+
+
+async def poll(rng: random.Random, interval: float, deadline: float, action):
+    """
+    interval 秒ごとに action を呼ぶ（開始時刻はブラウザごとにずらす）
+    """
+    next_at = time.monotonic() + rng.uniform(0, interval)
+    while next_at < deadline:
+        await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+        await action()
+        next_at += interval
+
+
+async def run(args) -> dict:
+    import main
+
+    recorder = Recorder()
+    main.repository = CountingRepository(main.repository, recorder)
+    main.queues.repository = main.repository
+    main.change_feed.repository = main.repository
+    main.auto_complete_lease.repository = main.repository
+
+    import httpx
+
+    rng = random.Random(args.seed)
+    transport = httpx.ASGITransport(app=main.app)
+    await main.startup_event()
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            waiting_numbers = list(args.waiting_numbers)
+            deadline = time.monotonic() + args.duration
+            tasks = []
+
+            # トップ画面
+            for _ in range(args.top_clients):
+                browser = Browser(client, recorder)
+                if args.dashboard:
+                    async def top(browser=browser):
+                        await browser.request("GET /dashboard", "GET", "/dashboard")
+                else:
+                    async def top(browser=browser):
+                        await browser.request("GET /stats", "GET", "/stats")
+                        await browser.request("GET /reservations/waiting/with-wait-times", "GET", "/reservations/waiting/with-wait-times")
+                tasks.append(poll(random.Random(rng.random()), 10 * args.time_scale, deadline, top))
+
+            # 待ち状況画面（自分の予約番号の wait-info を取得）
+            for i in range(args.wait_clients):
+                browser = Browser(client, recorder)
+                queue_number = waiting_numbers[i % len(waiting_numbers)] if waiting_numbers else 1
+
+                async def wait_page(browser=browser, queue_number=queue_number):
+                    await browser.request(
+                        "GET /reservations/{queue_number}/wait-info", "GET", f"/reservations/{queue_number}/wait-info"
+                    )
+                tasks.append(poll(random.Random(rng.random()), 30 * args.time_scale, deadline, wait_page))
+
+            # 管理画面
+            for _ in range(args.admin_clients):
+                browser = Browser(client, recorder)
+
+                async def admin(browser=browser):
+                    await browser.request("GET /reservations", "GET", "/reservations")
+                    await browser.request("GET /reservations/waiting/with-wait-times", "GET", "/reservations/waiting/with-wait-times")
+                tasks.append(poll(random.Random(rng.random()), 10 * args.time_scale, deadline, admin))
+
+            # 受付（新規予約）
+            if args.arrival_interval > 0:
+                browser = Browser(client, recorder)
+
+                async def arrive(browser=browser):
+                    response = await browser.request("POST /reservations", "POST", "/reservations", {"name": "来場者"})
+                    if response.status_code == 200:
+                        waiting_numbers.append(response.json()["queue_number"])
+                tasks.append(poll(random.Random(rng.random()), args.arrival_interval, deadline, arrive))
+
+            # 係員の操作（空席があれば次の人の体験を開始、なければ体験中の1人を完了）
+            if args.transition_interval > 0:
+                browser = Browser(client, recorder)
+
+                async def transition(browser=browser):
+                    context = await main.queues.get(main.DEFAULT_QUEUE_ID)
+                    state = context.state
+                    if len(state.in_progress) < context.capacity and state.waiting:
+                        queue_number = min(state.waiting)
+                        await browser.request("PATCH /reservations/{queue_number}", "PATCH",
+                                              f"/reservations/{queue_number}", {"status": "in_progress"})
+                    elif state.in_progress:
+                        queue_number = min(state.in_progress)
+                        await browser.request("PATCH /reservations/{queue_number}", "PATCH",
+                                              f"/reservations/{queue_number}", {"status": "completed"})
+                tasks.append(poll(random.Random(rng.random()), args.transition_interval, deadline, transition))
+
+            started = time.monotonic()
+            await asyncio.gather(*tasks)
+            elapsed = time.monotonic() - started
+    finally:
+        await main.shutdown_event()
+
+    result = recorder.summary(elapsed)
+    result["config"] = {
+        "waiting": args.waiting,
+        "completed": args.completed,
+        "seats": args.seats,
+        "top_clients": args.top_clients,
+        "wait_clients": args.wait_clients,
+        "admin_clients": args.admin_clients,
+        "duration": args.duration,
+        "time_scale": args.time_scale,
+        "dashboard": args.dashboard,
+        "seed": args.seed,
+    }
+    return result
+
+
+def print_report(result: dict) -> None:
+    print(f"計測時間: {result['elapsed_seconds']}秒  リクエスト数: {result['requests']}  "
+          f"スループット: {result['throughput_rps']} req/s  "
+          f"DB呼び出し/リクエスト: {result['db_calls_per_request']}  "
+          f"バックグラウンドのDB呼び出し: {result['background_db_calls']}")
+    print()
+    header = f"{'エンドポイント':<44}{'件数':>8}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}{'DB/req':>8}  ステータス"
+    print(header)
+    for endpoint, s in result["endpoints"].items():
+        statuses = " ".join(f"{code}:{n}" for code, n in s["statuses"].items())
+        print(f"{endpoint:<44}{s['requests']:>8}{s['p50_ms']:>10}{s['p95_ms']:>10}{s['p99_ms']:>10}"
+              f"{s['max_ms']:>10}{s['db_calls_per_request']:>8}  {statuses}")
+    print()
+    print("DB呼び出し（操作別）: " + ", ".join(f"{op}={n}" for op, n in result["db_calls_by_operation"].items()))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="予約APIの負荷テスト・ベンチマーク")
+    parser.add_argument("--waiting", type=int, default=500, help="待機中の予約数")
+    parser.add_argument("--completed", type=int, default=2000, help="完了済みの予約数（履歴）")
+    parser.add_argument("--history-days", type=float, default=1, help="完了済みの予約を分布させる日数")
+    parser.add_argument("--seats", type=int, default=3, help="席数（MAX_CONCURRENT_EXPERIENCES）")
+    parser.add_argument("--top-clients", type=int, default=100, help="トップ画面を開いているブラウザ数（10秒ごと）")
+    parser.add_argument("--wait-clients", type=int, default=300, help="待ち状況画面を開いているブラウザ数（30秒ごと）")
+    parser.add_argument("--admin-clients", type=int, default=2, help="管理画面を開いているブラウザ数（10秒ごと）")
+    parser.add_argument("--arrival-interval", type=float, default=5, help="新規予約の間隔（秒、0で無効）")
+    parser.add_argument("--transition-interval", type=float, default=5, help="体験開始・完了の操作間隔（秒、0で無効）")
+    parser.add_argument("--duration", type=float, default=60, help="計測時間（秒）")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="ポーリング間隔の倍率（0.1 で 10倍の頻度）")
+    parser.add_argument("--dashboard", action="store_true", help="トップ画面で /stats と待機一覧の代わりに /dashboard を使う")
+    parser.add_argument("--seed", type=int, default=0, help="乱数のシード")
+    parser.add_argument("--db", help="SQLite のファイル（省略時は一時ファイル）")
+    parser.add_argument("--json", action="store_true", help="結果を JSON で出力する")
+    return parser.parse_args(argv)
+
+
+def main_cli(argv=None) -> None:
+    args = parse_args(argv)
+
+    db_dir = None
+    if args.db:
+        db_path = args.db
+    else:
+        db_dir = tempfile.TemporaryDirectory()
+        db_path = os.path.join(db_dir.name, "benchmark.db")
+
+    # main の読み込み前に設定する（設定はインポート時に読まれる）
+    os.environ["STORAGE_BACKEND"] = "sqlite"
+    os.environ["SQLITE_PATH"] = db_path
+    os.environ["MAX_CONCURRENT_EXPERIENCES"] = str(args.seats)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    from main import EXPERIENCE_DURATION_MINUTES
+    from sqlite_repository import SCHEMA_PATH
+
+    args.duration_minutes = EXPERIENCE_DURATION_MINUTES
+    args.waiting_numbers = seed_database(db_path, args, str(SCHEMA_PATH))
+
+    try:
+        # JSON 出力時はアプリのログを標準エラー出力に回す
+        with contextlib.redirect_stdout(sys.stderr if args.json else sys.stdout):
+            result = asyncio.run(run(args))
+    finally:
+        if db_dir:
+            db_dir.cleanup()
+
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        print_report(result)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,100 @@
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from queue_state import parse_timestamp
+
+
+def worker_id() -> str:
+    """
+    このプロセスを識別する名前（ホスト名・プロセスID・乱数）
+    """
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+class Lease:
+    """
+    データベース上のリース（worker_leases）で、複数のワーカーのうち1つだけを担当にする
+
+    担当は ttl_seconds 以内に acquire() を呼び続けて更新する。
+    担当のプロセスが止まると、期限切れの後に他のワーカーが引き継ぐ
+    """
+
+    def __init__(self, repository, name: str, holder: str, ttl_seconds: int):
+        self.repository = repository
+        self.name = name
+        self.holder = holder
+        self.ttl_seconds = ttl_seconds
+        self.is_leader = False
+
+    async def acquire(self) -> bool:
+        """
+        リースを取得・更新し、担当かどうかを返す
+        """
+        try:
+            acquired = await self.repository.acquire_lease(self.name, self.holder, self.ttl_seconds)
+        except Exception:
+            # 更新できなければ担当を降りる（期限切れ後は他のワーカーが引き継ぐ）
+            self.is_leader = False
+            raise
+        if acquired != self.is_leader:
+            print(f"{self.name} の担当を{'開始' if acquired else '終了'}しました（{self.holder}）")
+        self.is_leader = acquired
+        return acquired
+
+    async def release(self) -> None:
+        if self.is_leader:
+            self.is_leader = False
+            await self.repository.release_lease(self.name, self.holder)
+
+
+class ChangeFeed:
+    """
+    他のワーカー（や Supabase 上での直接編集）による予約の変更を updated_at で取得し、
+    各キューのスナップショット（QueueRegistry）に反映する
+
+    PostgREST 経由では LISTEN/NOTIFY を受け取れないため、updated_at のインデックスで
+    前回以降に変更された行だけを取得する。書き込みトランザクションのコミットは
+    updated_at の時刻より遅れることがあるため、overlap_seconds だけ遡って取得し、
+    既に反映した行は除く
+    """
+
+    def __init__(self, repository, queues, overlap_seconds: float, limit: int):
+        self.repository = repository
+        self.queues = queues
+        self.overlap = timedelta(seconds=overlap_seconds)
+        self.limit = limit
+        self._cursor: Optional[datetime] = None
+        self._token: Optional[int] = None
+
+    async def poll(self) -> List[dict]:
+        """
+        前回以降に変更された予約をスナップショットに反映し、反映した行を返す
+        """
+        if self._cursor is None:
+            self._cursor = datetime.now(timezone.utc)
+
+        # 変更の有無が安く分かる保存先（SQLite）では、変更がなければ問い合わせない
+        token = await self.repository.change_token()
+        if token is not None and token == self._token:
+            return []
+
+        rows = await self.repository.list(updated_since=self._cursor - self.overlap, limit=self.limit)
+        self._token = token
+
+        if len(rows) >= self.limit:
+            # 変更が多すぎる場合はスナップショットごと読み直す
+            self.queues.invalidate()
+            self._cursor = datetime.now(timezone.utc)
+            return []
+
+        applied = []
+        for row in rows:
+            updated_at = parse_timestamp(row.get("updated_at"))
+            if updated_at and updated_at > self._cursor:
+                self._cursor = updated_at
+            if self.queues.apply(row):
+                applied.append(row)
+        return applied
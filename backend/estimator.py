@@ -0,0 +1,115 @@
+import statistics
+from bisect import bisect_right, insort
+from collections import deque
+from typing import List, Optional
+
+from queue_state import parse_timestamp
+
+# 体験時間の設定に対して、これより長いセッションは記録の誤り（完了の押し忘れなど）として使わない
+MAX_DURATION_RATIO = 3.0
+
+
+def quantile(sorted_values: List[float], q: float) -> float:
+    """
+    昇順に並んだ値の分位点（線形補間）
+    """
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    position = (len(sorted_values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+class DurationEstimator:
+    """
+    実際の体験時間（started_at 〜 completed_at）から、1人あたりの体験時間を推定する
+
+    直近 window 件の体験時間を到着順と昇順の両方で持ち、完了のたびに1件ずつ入れ替える
+    （過去の予約を読み直さない）。min_samples 件に満たない間は設定の体験時間を使う
+    """
+
+    def __init__(self, default_minutes: float, window: int, min_samples: int):
+        self.default_minutes = default_minutes
+        self.min_samples = max(1, min_samples)
+        self._samples: deque = deque(maxlen=window)
+        self._sorted: List[float] = []
+        self._sum = 0.0
+        # 推定値が変わるたびに進める（待ち時間表の作り直しに使う）
+        self.version = 0
+
+    @property
+    def ready(self) -> bool:
+        return len(self._samples) >= self.min_samples
+
+    def samples(self) -> List[float]:
+        """
+        記録している体験時間（分、古い順）
+        """
+        return list(self._samples)
+
+    def observe(self, row: dict) -> bool:
+        """
+        完了した予約の体験時間を記録する（記録した場合は True）
+        """
+        if row.get("status") != "completed":
+            return False
+        started_at = parse_timestamp(row.get("started_at"))
+        completed_at = parse_timestamp(row.get("completed_at"))
+        if started_at is None or completed_at is None:
+            return False
+
+        minutes = (completed_at - started_at).total_seconds() / 60
+        if minutes <= 0 or minutes > self.default_minutes * MAX_DURATION_RATIO:
+            return False
+
+        if len(self._samples) == self._samples.maxlen:
+            # 一番古い値を外す
+            oldest = self._samples[0]
+            del self._sorted[bisect_right(self._sorted, oldest) - 1]
+            self._sum -= oldest
+        self._samples.append(minutes)
+        insort(self._sorted, minutes)
+        self._sum += minutes
+        self.version += 1
+        return True
+
+    def expected(self, q: Optional[float] = None) -> float:
+        """
+        1人あたりの体験時間（分）。q を省略すると平均、指定するとその分位点
+        """
+        if not self.ready:
+            return self.default_minutes
+        if q is None:
+            return self._sum / len(self._sorted)
+        return quantile(self._sorted, q)
+
+    def remaining(self, elapsed: float, q: Optional[float] = None) -> float:
+        """
+        elapsed 分経過している体験中の人が、あと何分で終わるか
+
+        elapsed 分より長かったセッションだけから求める（既に長引いている人は、
+        同じように長引いた人と同じくらいで終わるとみなす）
+        """
+        if not self.ready:
+            return max(0.0, self.default_minutes - elapsed)
+        longer = self._sorted[bisect_right(self._sorted, elapsed):]
+        if not longer:
+            return 0.0
+        if q is None:
+            return sum(longer) / len(longer) - elapsed
+        return quantile(longer, q) - elapsed
+
+    def variance(self, elapsed: float = 0.0) -> float:
+        """
+        体験時間の分散（分²）。elapsed を指定すると、elapsed 分より長かったセッションだけから求める
+        （体験中の人の残り時間の分散）
+
+        実績が足りない間は 0（設定の体験時間どおりに終わるとみなす）
+        """
+        if not self.ready:
+            return 0.0
+        longer = self._sorted[bisect_right(self._sorted, elapsed):]
+        if len(longer) < 2:
+            return 0.0
+        return statistics.variance(longer)
@@ -0,0 +1,143 @@
+import asyncio
+from typing import Dict, Optional, Set, Tuple
+
+from responses import dumps
+
+# 1接続あたりに溜めておける未送信メッセージ数
+SUBSCRIPTION_QUEUE_SIZE = 64
+
+# キープアライブ用のコメント行（プロキシによる切断を防ぐ）
+KEEPALIVE_MESSAGE = ": keepalive\n\n"
+
+
+def format_sse(event: str, data) -> str:
+    """
+    Server-Sent Events 形式のメッセージを作る
+    """
+    payload = dumps(data).decode()
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+class Subscription:
+    """
+    1つの SSE 接続に対応する購読
+    """
+
+    def __init__(self, queue_number: Optional[int] = None, queue_id: Optional[str] = None):
+        # None の場合はキュー queue_id 全体（トップ画面・管理画面）、
+        # 予約番号を指定した場合はその予約の待ち状況だけを受け取る
+        self.queue_number = queue_number
+        self.queue_id = queue_id
+        self._messages: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIPTION_QUEUE_SIZE)
+
+    def send(self, message: str) -> None:
+        """
+        メッセージを送信待ちに追加する
+        """
+        try:
+            self._messages.put_nowait(message)
+        except asyncio.QueueFull:
+            # 受信が追いつかないクライアントには、溜まった差分を捨てて再取得を促す
+            while not self._messages.empty():
+                self._messages.get_nowait()
+            self._messages.put_nowait(format_sse("resync", {}))
+
+    async def next_message(self) -> str:
+        """
+        次に送るメッセージを待つ
+        """
+        return await self._messages.get()
+
+
+class EventBroker:
+    """
+    キューの変更を SSE の購読者に配信する
+
+    同じメッセージは一度だけシリアライズし、全購読者で共有する
+    """
+
+    def __init__(self):
+        # キュー（ブース）ごとの、キュー全体の購読者
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._by_queue_number: Dict[int, Set[Subscription]] = {}
+        # 直前に送った内容（変化がなければ送らない）
+        self._last_sent: Dict[Tuple[str, str], str] = {}
+        self._last_sent_to: Dict[int, str] = {}
+
+    def subscribe(self, queue_number: Optional[int] = None, queue_id: Optional[str] = None) -> Subscription:
+        subscription = Subscription(queue_number, queue_id)
+        if queue_number is None:
+            self._subscribers.setdefault(queue_id, set()).add(subscription)
+        else:
+            self._by_queue_number.setdefault(queue_number, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        if subscription.queue_number is None:
+            subscribers = self._subscribers.get(subscription.queue_id)
+            if subscribers is None:
+                return
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.queue_id]
+                for key in [key for key in self._last_sent if key[0] == subscription.queue_id]:
+                    del self._last_sent[key]
+            return
+        subscribers = self._by_queue_number.get(subscription.queue_number)
+        if subscribers is None:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self._by_queue_number[subscription.queue_number]
+            self._last_sent_to.pop(subscription.queue_number, None)
+
+    @property
+    def subscriber_count(self) -> int:
+        return sum(len(s) for s in self._subscribers.values()) + sum(len(s) for s in self._by_queue_number.values())
+
+    def has_global_subscribers(self, queue_id: str) -> bool:
+        return bool(self._subscribers.get(queue_id))
+
+    def watched_queue_numbers(self):
+        """
+        購読されている予約番号の一覧
+        """
+        return list(self._by_queue_number)
+
+    def publish(self, queue_id: str, event: str, data, only_if_changed: bool = False) -> None:
+        """
+        キュー queue_id 全体の購読者にイベントを送る
+        """
+        subscribers = self._subscribers.get(queue_id)
+        if not subscribers:
+            return
+        message = format_sse(event, data)
+        if only_if_changed:
+            if self._last_sent.get((queue_id, event)) == message:
+                return
+            self._last_sent[(queue_id, event)] = message
+        for subscription in subscribers:
+            subscription.send(message)
+
+    def publish_to(self, queue_number: int, event: str, data, only_if_changed: bool = False) -> None:
+        """
+        指定した予約番号の購読者にイベントを送る
+        """
+        subscribers = self._by_queue_number.get(queue_number)
+        if not subscribers:
+            return
+        message = format_sse(event, data)
+        if only_if_changed:
+            if self._last_sent_to.get(queue_number) == message:
+                return
+            self._last_sent_to[queue_number] = message
+        for subscription in subscribers:
+            subscription.send(message)
+
+    def send_keepalive(self) -> None:
+        """
+        全購読者にキープアライブを送る
+        """
+        for subscribers in list(self._subscribers.values()) + list(self._by_queue_number.values()):
+            for subscription in subscribers:
+                subscription.send(KEEPALIVE_MESSAGE)
@@ -1,18 +1,27 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, List
-from datetime import datetime, timezone
+from typing import Optional, List, Tuple
+from datetime import date, datetime, timedelta, timezone
 import os
-import math
+import time
 import asyncio
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from repository import create_repository, CapacityFull, InvalidTransition, ReservationNotFound
+from queue_state import today_start_utc, elapsed_minutes, parse_timestamp, compact_row
+from queues import DEFAULT_QUEUE_ID, QueueContext, QueueNotFound, QueueRegistry, parse_seat_names
+from events import EventBroker, format_sse
+from coordination import ChangeFeed, Lease, worker_id
+from metrics import CONTENT_TYPE, DELAY_BUCKETS, InstrumentedRepository, Registry, monitor_event_loop_lag
+from simulator import simulate
+from responses import FastJSONResponse, SelectiveGZipMiddleware
 
 # 環境変数の読み込み
 load_dotenv()
 
-app = FastAPI(title="予約管理API")
+# レスポンスは orjson でシリアライズする
+app = FastAPI(title="予約管理API", default_response_class=FastJSONResponse)
 
 # CORS設定（フロントエンドからのアクセスを許可）
 app.add_middleware(
@@ -21,62 +30,202 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],  # ページ送り・条件付き取得用
 )
 
-# Supabaseクライアントの初期化
-supabase_url = os.getenv("SUPABASE_URL")
-supabase_key = os.getenv("SUPABASE_KEY")
+# この大きさ（バイト）以上のレスポンスは、クライアントが対応していれば gzip で圧縮する
+# （予約一覧・待機中の一覧など。SSE は圧縮しない。0 の場合は圧縮しない）
+GZIP_MINIMUM_SIZE = int(os.getenv("GZIP_MINIMUM_SIZE", "1000"))
 
-if not supabase_url or not supabase_key:
-    raise ValueError("SUPABASE_URLとSUPABASE_KEYを.envファイルに設定してください")
+# 圧縮レベル（JSON は 1 でも 1/8 程度になり、9 の数分の1の CPU 時間で済む）
+GZIP_COMPRESS_LEVEL = 1
 
-supabase: Client = create_client(supabase_url, supabase_key)
+if GZIP_MINIMUM_SIZE > 0:
+    app.add_middleware(
+        SelectiveGZipMiddleware,
+        minimum_size=GZIP_MINIMUM_SIZE,
+        compresslevel=GZIP_COMPRESS_LEVEL,
+        excluded_paths=["/events"],
+    )
+
+# 予約データの保存先（supabase / sqlite）
+# sqlite は会場のネットワークが不安定な場合に、ローカルのファイル（SQLITE_PATH）に保存する
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "supabase")
+
+# 以下の3つはキュー（ブース）ごとに queues テーブルで設定でき、
+# 設定がないキューではこの値を使う
 
 # 体験時間の設定（分）
 EXPERIENCE_DURATION_MINUTES = 10
 
-# 同時に体験できる最大人数
-MAX_CONCURRENT_EXPERIENCES = 3
+# 同時に体験できる最大人数（＝席数）
+MAX_CONCURRENT_EXPERIENCES = int(os.getenv("MAX_CONCURRENT_EXPERIENCES", "3"))
+
+# 席名（カンマ区切り、省略時は A席, B席, ... を自動で付ける）
+SEAT_NAMES = [name.strip() for name in os.getenv("SEAT_NAMES", "").split(",") if name.strip()]
+
+# 予約一覧の1ページあたりの件数（デフォルト・上限）
+RESERVATIONS_PAGE_SIZE = 500
+RESERVATIONS_MAX_PAGE_SIZE = 1000
+
+# 一括登録・一括ステータス変更で1回に扱える最大件数
+BATCH_MAX_ITEMS = 100
+
+# 予約のステータス
+RESERVATION_STATUSES = ("waiting", "in_progress", "completed", "cancelled")
+
+# キューのスナップショットを保持する最大時間（秒）
+# このプロセス以外からの変更は、最大でこの時間だけ遅れて反映される
+QUEUE_CACHE_MAX_AGE_SECONDS = float(os.getenv("QUEUE_CACHE_MAX_AGE_SECONDS", "30"))
+
+# 体験時間の推定に使う直近の完了件数と、推定を使い始めるまでに必要な件数
+# 件数が足りない間は EXPERIENCE_DURATION_MINUTES（またはキューの設定）で待ち時間を計算する
+DURATION_ESTIMATE_WINDOW = int(os.getenv("DURATION_ESTIMATE_WINDOW", "50"))
+DURATION_ESTIMATE_MIN_SAMPLES = int(os.getenv("DURATION_ESTIMATE_MIN_SAMPLES", "5"))
+if DURATION_ESTIMATE_WINDOW < 1:
+    raise ValueError(f"DURATION_ESTIMATE_WINDOW は1以上を指定してください（{DURATION_ESTIMATE_WINDOW}）")
+
+# 予想待ち時間の幅（bands=true で返す分位点）
+WAIT_BAND_QUANTILES = (0.5, 0.9)
+
+# キューに変化がなくても待ち時間表を作り直す間隔（秒）
+# 体験中の残り時間は時間とともに減るため、一定間隔で再計算する
+SCHEDULE_REFRESH_SECONDS = float(os.getenv("SCHEDULE_REFRESH_SECONDS", "5"))
+if SCHEDULE_REFRESH_SECONDS <= 0:
+    raise ValueError(f"SCHEDULE_REFRESH_SECONDS は0より大きい値を指定してください（{SCHEDULE_REFRESH_SECONDS}）")
+
+# 自動完了チェックの間隔（秒）
+# 次に体験時間が終わる時刻まで待機するが、他のプロセスで開始されたセッションを
+# 取りこぼさないよう、最大でも AUTO_COMPLETE_MAX_INTERVAL_SECONDS ごとに確認する
+AUTO_COMPLETE_MIN_INTERVAL_SECONDS = float(os.getenv("AUTO_COMPLETE_MIN_INTERVAL_SECONDS", "1"))
+AUTO_COMPLETE_MAX_INTERVAL_SECONDS = float(os.getenv("AUTO_COMPLETE_MAX_INTERVAL_SECONDS", "30"))
+
+# 読み取り系エンドポイントを共有キャッシュ（リバースプロキシ）に保持させる時間（秒）
+# ブラウザには毎回 ETag で再検証させ、変更直後の再取得で古い内容が表示されないようにする
+READ_CACHE_SHARED_MAX_AGE_SECONDS = int(os.getenv("READ_CACHE_SHARED_MAX_AGE_SECONDS", "2"))
+
+# SSE で席の残り時間・待ち時間を配信する間隔（秒）
+EVENT_TICK_SECONDS = float(os.getenv("EVENT_TICK_SECONDS", "5"))
+
+# SSE のキープアライブ間隔（秒）
+EVENT_KEEPALIVE_SECONDS = float(os.getenv("EVENT_KEEPALIVE_SECONDS", "15"))
+
+# 自動完了の担当（リース）の有効期間（秒）
+# 複数のワーカー・サーバーで動かす場合、リースを持つ1つのプロセスだけが自動完了を行い、
+# そのプロセスが止まるとこの時間の後に他のプロセスが引き継ぐ
+LEADER_LEASE_SECONDS = int(os.getenv("LEADER_LEASE_SECONDS", "90"))
+
+# 他のワーカーによる変更を取り込む間隔（秒、0 で無効）
+CHANGE_POLL_SECONDS = float(os.getenv("CHANGE_POLL_SECONDS", "2"))
+
+# 変更の取得時に遡る時間（秒）。書き込みのコミットが updated_at より遅れても取りこぼさないようにする
+CHANGE_POLL_OVERLAP_SECONDS = 5
+
+# 1回に取り込む変更の上限（超えた場合はスナップショットを読み直す）
+CHANGE_POLL_LIMIT = 500
+
+# 終了した予約を履歴に移すかを確認する間隔（秒、0 で無効）
+# 日付が変わった後の最初の確認で、前日以前に完了・キャンセルになった予約を reservations_history に移す
+ARCHIVE_CHECK_SECONDS = float(os.getenv("ARCHIVE_CHECK_SECONDS", "600"))
+
+# 1回のトランザクションで履歴に移す件数
+ARCHIVE_BATCH_SIZE = 1000
+
+# 日ごとの完了件数（/history/daily）で期間を省略した場合の日数
+HISTORY_DAILY_DEFAULT_DAYS = 30
+
+# イベントループの遅延を測る間隔（秒）
+EVENT_LOOP_LAG_CHECK_SECONDS = 0.5
+
+# 同時に実行できるシミュレーションの数（CPU とメモリを使うため、超えた分は 429 を返す）
+SIMULATION_CONCURRENCY = int(os.getenv("SIMULATION_CONCURRENCY", "1"))
+
+# メトリクス（/metrics で Prometheus のテキスト形式で出力する）
+metrics = Registry()
+http_request_duration = metrics.histogram(
+    "http_request_duration_seconds", "APIリクエストの処理時間（秒）", ["method", "route", "status"]
+)
+db_call_duration = metrics.histogram(
+    "db_call_duration_seconds", "データベース呼び出しの所要時間（秒）", ["backend", "table", "operation"]
+)
+db_call_errors = metrics.counter(
+    "db_call_errors_total", "失敗したデータベース呼び出しの数", ["backend", "table", "operation"]
+)
+event_loop_lag = metrics.gauge("event_loop_lag_seconds", "直近のイベントループの遅延（秒）")
+event_loop_lag_histogram = metrics.histogram("event_loop_lag_distribution_seconds", "イベントループの遅延の分布（秒）")
+background_iteration_duration = metrics.histogram(
+    "background_iteration_duration_seconds", "バックグラウンド処理1回あたりの所要時間（秒）", ["task"]
+)
+auto_complete_delay = metrics.histogram(
+    "auto_complete_delay_seconds", "体験時間が終わってから自動完了されるまでの時間（秒）", buckets=DELAY_BUCKETS
+)
+auto_completed_total = metrics.counter("auto_completed_total", "自動完了したセッションの数")
+archived_total = metrics.counter("archived_reservations_total", "履歴に移した予約の数")
+
+# 予約データへのアクセス（呼び出しごとの回数と所要時間を記録する）
+repository = InstrumentedRepository(create_repository(STORAGE_BACKEND), db_call_duration, db_call_errors)
 
 # データモデル
 class ReservationCreate(BaseModel):
     name: str
+    queue_id: str = DEFAULT_QUEUE_ID  # キュー（ブース）
 
 class ReservationUpdate(BaseModel):
     status: str
 
+class ReservationBatchCreate(BaseModel):
+    names: List[str]  # 登録する名前（団体の人数分。この順に予約番号を振る）
+    queue_id: str = DEFAULT_QUEUE_ID  # キュー（ブース）
+
+class StatusChange(BaseModel):
+    queue_number: int
+    status: str
+
+class ReservationBatchUpdate(BaseModel):
+    changes: List[StatusChange]  # 変更する予約とステータス（同じ予約番号は1回まで）
+
 class Reservation(BaseModel):
     id: str
     queue_number: int
+    queue_id: str = DEFAULT_QUEUE_ID  # キュー（ブース）
     name: str
     status: str
     created_at: datetime
     started_at: Optional[datetime] = None
     completed_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    seat_number: Optional[int] = None  # 体験中の席番号（1始まり）
 
 class WaitInfo(BaseModel):
     queue_number: int
     position: int  # 待ち順位（何番目か）
     estimated_wait_minutes: int  # 予想待ち時間（分）
+    estimated_wait_minutes_p50: Optional[int] = None  # 予想待ち時間の中央値（bands=true の場合）
+    estimated_wait_minutes_p90: Optional[int] = None  # 9割の確率でこれ以内（bands=true の場合）
     current_status: str
 
 class ReservationWithWaitTime(BaseModel):
     id: str
     queue_number: int
+    queue_id: str = DEFAULT_QUEUE_ID  # キュー（ブース）
     name: str
     status: str
     created_at: datetime
     started_at: Optional[datetime] = None
     completed_at: Optional[datetime] = None
     estimated_wait_minutes: int  # 予想待ち時間（分）
+    estimated_wait_minutes_p50: Optional[int] = None  # 予想待ち時間の中央値（bands=true の場合）
+    estimated_wait_minutes_p90: Optional[int] = None  # 9割の確率でこれ以内（bands=true の場合）
 
 class Seat(BaseModel):
+    seat_number: int  # 席番号（1始まり）
     seat_name: str  # 席名（A席、B席、C席）
     name: str  # 利用者名
     remaining_minutes: float  # 残り時間（分）
     queue_number: int  # 予約番号
 
 class OvertimeSeat(BaseModel):
+    seat_number: int  # 席番号（1始まり）
     seat_name: str  # 席名（A席、B席、C席）
     name: str  # 利用者名
     overtime_minutes: float  # 超過時間（分）
@@ -88,66 +237,635 @@ class Stats(BaseModel):
     completed_count: int  # 完了した人数
     today_completed_count: int  # 今日完了した人数
     estimated_wait_minutes: int  # 現在の予想待ち時間（分）
+    estimated_wait_minutes_p50: Optional[int] = None  # 予想待ち時間の中央値（bands=true の場合）
+    estimated_wait_minutes_p90: Optional[int] = None  # 9割の確率でこれ以内（bands=true の場合）
+    seat_count: int  # 席数（同時に体験できる最大人数）
+    duration_minutes: int  # 体験時間（分、キューの設定。席の残り時間の基準）
     seats: List[Seat]  # 各席の情報
     overtime_seats: List[OvertimeSeat]  # 超過している席の情報
 
+class Dashboard(BaseModel):
+    stats: Stats  # 統計情報（/stats と同じ内容）
+    waiting: List[ReservationWithWaitTime]  # 待機中の予約一覧（待ち時間付き）
+
+class QueueInfo(BaseModel):
+    id: str  # キューID（queue_id）
+    name: str  # 表示名（ブース名）
+    capacity: int  # 席数
+    duration_minutes: int  # 体験時間（分）
+    seat_names: List[str]  # 席名（空の場合は A席, B席, ...）
+
+class QueueUpdate(BaseModel):
+    name: str
+    capacity: Optional[int] = None  # 省略時は MAX_CONCURRENT_EXPERIENCES
+    duration_minutes: Optional[int] = None  # 省略時は EXPERIENCE_DURATION_MINUTES
+    seat_names: Optional[List[str]] = None  # 省略時は SEAT_NAMES
+
+class StatusChangeResult(BaseModel):
+    queue_number: int
+    ok: bool  # 変更できたかどうか
+    reservation: Optional[Reservation] = None  # 変更後の予約（ok の場合）
+    error: Optional[str] = None  # 変更できなかった理由（ok でない場合）
+
+class DailyCompletions(BaseModel):
+    day: date  # 日付（UTC）
+    completed_count: int  # その日に完了した人数
+
+class SimulationRequest(BaseModel):
+    queue_id: str = DEFAULT_QUEUE_ID  # キュー（ブース）
+    seat_counts: Optional[List[int]] = None  # 試す席数（省略時は現在の席数）
+    duration_minutes: Optional[List[float]] = None  # 試す体験時間（分、省略時は実績からの推定値）
+    arrivals_per_hour: List[float] = [0]  # 試す1時間あたりの来場者数
+    horizon_minutes: float = 120  # シミュレーションする時間（分）
+    runs: int = 1000  # シナリオごとの試行回数
+    seed: Optional[int] = None  # 乱数のシード（指定すると同じ結果になる）
+    waiting_count: Optional[int] = None  # 待機人数（省略時は現在の待機人数）
+    in_progress_remaining_minutes: Optional[List[float]] = None  # 体験中の人の残り時間（分、省略時は現在の体験中の人）
+
+class Distribution(BaseModel):
+    mean: Optional[float] = None  # 平均（分）
+    p50: Optional[float] = None  # 中央値（分）
+    p90: Optional[float] = None  # 9割の試行でこれ以内（分）
+
+class ScenarioResult(BaseModel):
+    seat_count: int  # 席数
+    duration_minutes: float  # 1人あたりの体験時間（分）
+    arrivals_per_hour: float  # 1時間あたりの来場者数
+    queue_clear_minutes: Distribution  # 今並んでいる人が全員案内されるまでの時間
+    new_arrival_wait_minutes: Distribution  # 新しく来た人の待ち時間
+    queue_length_at_end: float  # シミュレーション終了時の待機人数（平均）
+    throughput_per_hour: float  # 1時間あたりの体験人数（平均）
+
+class SimulationResult(BaseModel):
+    waiting_count: int  # シミュレーションに使った待機人数
+    in_progress_remaining_minutes: List[float]  # シミュレーションに使った体験中の人の残り時間（分）
+    duration_samples: int  # ばらつきの再現に使った体験時間の実績の件数（0 の場合は対数正規分布）
+    scenarios: List[ScenarioResult]
+
 # バックグラウンドタスク用の変数
 background_task: Optional[asyncio.Task] = None
+event_task: Optional[asyncio.Task] = None
+lag_task: Optional[asyncio.Task] = None
+change_task: Optional[asyncio.Task] = None
+archive_task: Optional[asyncio.Task] = None
+
+# キューのスナップショットを読み込む
+async def load_queue_snapshot(queue_id: str) -> dict:
+    """
+    キューの設定と、待機中・体験中の予約、完了件数をデータベースから取得する
+    （互いに独立したクエリは並行して実行する）
+    """
+    today_start = today_start_utc()
+    active, counts, queue = await asyncio.gather(
+        repository.list_active(queue_id),
+        repository.count_completed(today_start.date(), queue_id),
+        repository.get_queue(queue_id),
+    )
+
+    return {
+        "active": active,
+        "completed_count": counts["completed_count"],
+        "today_completed_count": counts["today_completed_count"],
+        "today_start": today_start,
+        "queue": queue,
+    }
+
+# キュー（ブース）ごとのスナップショット・席の構成・待ち時間表
+# 読み取り系エンドポイントはこのスナップショットから応答する
+queues = QueueRegistry(
+    repository,
+    {
+        "capacity": MAX_CONCURRENT_EXPERIENCES,
+        "duration_minutes": EXPERIENCE_DURATION_MINUTES,
+        "seat_names": SEAT_NAMES,
+    },
+    load_queue_snapshot,
+    QUEUE_CACHE_MAX_AGE_SECONDS,
+    SCHEDULE_REFRESH_SECONDS,
+    DURATION_ESTIMATE_WINDOW,
+    DURATION_ESTIMATE_MIN_SAMPLES,
+)
+
+# SSE の配信先
+broker = EventBroker()
+
+# 複数ワーカー間の調整（自動完了の担当・変更の取り込み）
+WORKER_ID = worker_id()
+auto_complete_lease = Lease(repository, "auto_complete", WORKER_ID, LEADER_LEASE_SECONDS)
+change_feed = ChangeFeed(repository, queues, CHANGE_POLL_OVERLAP_SECONDS, CHANGE_POLL_LIMIT)
+
+# 実行中のシミュレーションの枠
+simulation_slots = asyncio.Semaphore(max(1, SIMULATION_CONCURRENCY))
+
+# キューの状態のメトリクス（出力時の値、キューごと）
+metrics.gauge(
+    "queue_waiting", "待機中の人数", ["queue_id"],
+    callback=lambda: {(c.queue_id,): len(c.state.waiting) for c in queues.loaded()},
+)
+metrics.gauge(
+    "queue_in_progress", "体験中の人数", ["queue_id"],
+    callback=lambda: {(c.queue_id,): len(c.state.in_progress) for c in queues.loaded()},
+)
+metrics.gauge(
+    "queue_snapshot_version", "キューのスナップショットの version", ["queue_id"],
+    callback=lambda: {(c.queue_id,): c.state.version for c in queues.loaded()},
+)
+metrics.gauge(
+    "queue_estimated_duration_minutes", "1人あたりの体験時間の推定値（分）", ["queue_id"],
+    callback=lambda: {(c.queue_id,): c.estimator.expected() for c in queues.loaded()},
+)
+metrics.gauge("sse_subscribers", "SSE の接続数", callback=lambda: broker.subscriber_count)
+metrics.gauge("auto_complete_leader", "このプロセスが自動完了の担当かどうか（1: 担当）", callback=lambda: int(auto_complete_lease.is_leader))
+
+# リクエストの処理時間を記録
+@app.middleware("http")
+async def record_request_duration(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # パスではなくルートのテンプレートで集計する（/reservations/{queue_number} など）
+        route = request.scope.get("route")
+        http_request_duration.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            route=route.path if route else "unmatched",
+            status=status,
+        )
+
+# キューの状態に対応する ETag
+def queue_etag(context: QueueContext, time_dependent: bool = True) -> str:
+    """
+    キューの version から弱い ETag を作る
+
+    version はプロセスごとの番号のため、プロセス（起動ごとに異なる WORKER_ID）も含める
+    （別のワーカーや再起動後のプロセスが、同じ ETag で異なる内容を返さないように）
+
+    time_dependent: 席の残り時間・待ち時間のように時間とともに変わる内容を含む場合は True。
+    体験中の人がいる間は、待ち時間表の再計算間隔ごとに ETag が変わる
+    """
+    state = context.state
+    if time_dependent and state.in_progress:
+        bucket = int(time.time() // SCHEDULE_REFRESH_SECONDS)
+        return f'W/"{WORKER_ID}-{context.queue_id}-{state.version}-{bucket}"'
+    return f'W/"{WORKER_ID}-{context.queue_id}-{state.version}"'
+
+# 条件付き GET の判定
+def not_modified_response(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """
+    If-None-Match が ETag と一致すれば 304 のレスポンスを返す。
+    一致しなければ response にキャッシュ用のヘッダーを付けて None を返す
+    """
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age=0, s-maxage={READ_CACHE_SHARED_MAX_AGE_SECONDS}",
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        if "*" in tags or etag in tags:
+            return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+# 検証を通さずに返すレスポンス
+def fast_response(content, response: Response) -> FastJSONResponse:
+    """
+    スナップショットから作った dict をそのままシリアライズして返す
+    （response_model による検証と jsonable_encoder を省く。ETag などのヘッダーは引き継ぐ）
+
+    content は response_model と同じ形にすること
+    """
+    return FastJSONResponse(content, headers=response.headers)
+
+# キュー（ブース）を取得
+async def get_queue_context(queue_id: str) -> QueueContext:
+    """
+    キューを取得し、スナップショットを最新にする（存在しない場合は 404）
+    """
+    try:
+        context = await queues.get(queue_id)
+    except QueueNotFound:
+        raise HTTPException(status_code=404, detail="キューが見つかりません")
+    await context.state.ensure_fresh()
+    return context
+
+# 予約を予約番号で取得
+async def find_reservation(queue_number: int) -> Tuple[QueueContext, dict]:
+    """
+    予約とそのキューを返す。
+    待機中・体験中ならスナップショットから、それ以外はデータベースから取得する
+    """
+    found = queues.find(queue_number)
+    if found is not None:
+        context = found[0]
+        await context.state.ensure_fresh()
+        reservation = context.state.get(queue_number)
+        if reservation is not None:
+            return context, reservation
+
+    reservation = await repository.get(queue_number)
+    if reservation is None:
+        # 前日以前に終了した予約は履歴に移っている
+        reservation = await repository.get_archived(queue_number)
+
+    if reservation is None:
+        raise HTTPException(status_code=404, detail="予約が見つかりません")
+
+    queues.remember(reservation)
+    return await get_queue_context(reservation["queue_id"]), reservation
+
+# 予想待ち時間の幅
+def wait_bands(context: QueueContext, index: Optional[int] = None, enabled: bool = True) -> dict:
+    """
+    待ち時間の分位点（WAIT_BAND_QUANTILES）ごとの表から、P50/P90 の予想待ち時間を引く
+
+    index: 待機中の何番目か（省略時は待機列の最後）
+    enabled: False の場合は値をすべて None にする（bands=true でない場合）
+    """
+    bands = {}
+    for q in WAIT_BAND_QUANTILES:
+        key = f"estimated_wait_minutes_p{int(q * 100)}"
+        if not enabled:
+            bands[key] = None
+            continue
+        schedule = context.scheduler.get(context.state, q)
+        if index is not None:
+            minutes = schedule.wait_minutes(index)
+        else:
+            minutes = schedule.last_wait_minutes()
+        bands[key] = minutes
+    return bands
+
+# 統計情報を作成
+def build_stats(context: QueueContext, bands: bool = False) -> dict:
+    """
+    スナップショットから統計情報（Stats と同じ形の dict）を作成する
+    """
+    queue_state = context.state
+    duration_minutes = context.duration_minutes
+
+    # 各ステータスの件数を取得
+    in_progress_reservations = queue_state.in_progress_list()
+
+    waiting_count = len(queue_state.waiting)
+    in_progress_count = len(in_progress_reservations)
+    completed_count = queue_state.completed_count
+    today_completed_count = queue_state.today_completed_count
+
+    now = datetime.now(timezone.utc)
+
+    # 各席の残り時間を計算（席番号順）
+    seats_info = []  # 各席の情報
+    overtime_seats_info = []  # 超過している席の情報
+
+    for seat_number, reservation in context.layout.occupancy(in_progress_reservations).items():
+        # 経過時間（分）。開始時刻が不明な場合は開始直後として扱う
+        elapsed = elapsed_minutes(reservation, now) or 0
+        # 残り時間（分）
+        remaining_minutes = max(0, duration_minutes - elapsed)
+
+        # 体験時間を超過しているかチェック
+        if elapsed > duration_minutes:
+            overtime_minutes = elapsed - duration_minutes
+            overtime_seats_info.append({
+                "seat_number": seat_number,
+                "seat_name": context.layout.name(seat_number),
+                "name": reservation.get("name") or "Unknown",
+                "overtime_minutes": round(float(overtime_minutes), 1),
+                "queue_number": reservation.get("queue_number") or 0,
+            })
+        else:
+            seats_info.append({
+                "seat_number": seat_number,
+                "seat_name": context.layout.name(seat_number),
+                "name": reservation.get("name") or "Unknown",
+                "remaining_minutes": round(float(remaining_minutes), 1),
+                "queue_number": reservation.get("queue_number") or 0,
+            })
+
+    # 待機列の最後の人（誰も待っていなければ今登録する人）の予想待ち時間
+    estimated_wait_minutes = context.scheduler.get(queue_state).last_wait_minutes()
+
+    return {
+        "waiting_count": waiting_count,
+        "in_progress_count": in_progress_count,
+        "completed_count": completed_count,
+        "today_completed_count": today_completed_count,
+        "estimated_wait_minutes": estimated_wait_minutes,
+        **wait_bands(context, enabled=bands),
+        "seat_count": context.capacity,
+        "duration_minutes": duration_minutes,
+        "seats": seats_info,
+        "overtime_seats": overtime_seats_info,
+    }
+
+# 待機中の予約一覧（待ち時間付き）を作成
+def build_waiting_with_wait_times(context: QueueContext, bands: bool = False) -> List[dict]:
+    """
+    スナップショットと待ち時間表から待機中の予約一覧（ReservationWithWaitTime と同じ形の dict）を作成する
+
+    スナップショットの行はタイムスタンプを datetime に変換済みのため、そのままシリアライズできる
+    """
+    # 待ち時間表から各待機中の予約の待ち時間を引く
+    schedule = context.scheduler.get(context.state)
+    no_bands = wait_bands(context, enabled=False)
+
+    result = []
+    for idx, reservation in enumerate(context.state.waiting_list()):
+        result.append({
+            "id": reservation["id"],
+            "queue_number": reservation["queue_number"],
+            "queue_id": reservation["queue_id"] or context.queue_id,
+            "name": reservation["name"],
+            "status": reservation["status"],
+            "created_at": reservation["created_at"],
+            "started_at": reservation["started_at"],
+            "completed_at": reservation["completed_at"],
+            "estimated_wait_minutes": schedule.wait_minutes(idx),
+            **(wait_bands(context, index=idx) if bands else no_bands),
+        })
+
+    return result
+
+# 待ち状況を作成
+def build_wait_info(context: QueueContext, queue_number: int, reservation: dict, bands: bool = False) -> dict:
+    """
+    待ち時間表から指定した予約の待ち状況（WaitInfo と同じ形の dict）を作成する
+    """
+    # 自分の順位（待機中の中での順位）と予想待ち時間を待ち時間表から引く
+    schedule = context.scheduler.get(context.state)
+    waiting_before_count = schedule.position_index(queue_number)
+
+    return {
+        "queue_number": queue_number,
+        "position": waiting_before_count + 1,
+        "estimated_wait_minutes": schedule.wait_minutes(waiting_before_count),
+        **wait_bands(context, index=waiting_before_count, enabled=bands),
+        "current_status": reservation["status"],
+    }
+
+# 待機中の各予約の待ち時間（予約番号 → 分）
+def build_wait_times(context: QueueContext) -> dict:
+    schedule = context.scheduler.get(context.state)
+    return {
+        str(queue_number): schedule.wait_minutes(idx)
+        for idx, queue_number in enumerate(schedule.waiting_numbers)
+    }
+
+# 接続中のクライアントに最新の状況を配信
+def publish_queue_snapshot(context: QueueContext) -> None:
+    """
+    統計情報・待ち時間・各予約の待ち状況を、前回から変化があった場合だけ配信する
+    """
+    if broker.has_global_subscribers(context.queue_id):
+        broker.publish(context.queue_id, "stats", build_stats(context), only_if_changed=True)
+        broker.publish(context.queue_id, "wait_times", build_wait_times(context), only_if_changed=True)
+
+    for queue_number in broker.watched_queue_numbers():
+        reservation = context.state.get(queue_number)
+        if reservation is None:
+            # 他のキューの予約、または完了・キャンセル済みの予約（状況が変わらない）
+            continue
+        broker.publish_to(queue_number, "wait_info", build_wait_info(context, queue_number, reservation), only_if_changed=True)
+
+# キューの変更を配信
+def notify_queue_changed(change: str, row: dict) -> None:
+    """
+    予約の作成・ステータス変更・自動完了を、その予約のキューの購読者に知らせる
+
+    change: "created" / "status_changed" / "auto_completed"
+    """
+    queue_id = row.get("queue_id") or DEFAULT_QUEUE_ID
+    broker.publish(queue_id, "reservation", {"change": change, "reservation": compact_row(row)})
+    publish_queue_changes(queue_id, [row])
+
+# 複数の予約の変更をまとめて配信
+def notify_queue_changes(change: str, rows: List[dict]) -> None:
+    """
+    一括登録・一括ステータス変更・自動完了で変わった予約を、キューごとに1回の
+    reservations イベントで知らせる（統計情報・待ち時間の配信もキューごとに1回）
+    """
+    rows_by_queue = {}
+    for row in rows:
+        rows_by_queue.setdefault(row.get("queue_id") or DEFAULT_QUEUE_ID, []).append(row)
+
+    for queue_id, queue_rows in rows_by_queue.items():
+        broker.publish(queue_id, "reservations", {
+            "change": change,
+            "reservations": [compact_row(row) for row in queue_rows],
+        })
+        publish_queue_changes(queue_id, queue_rows)
+
+# 予約の変更後の状況を配信
+def publish_queue_changes(queue_id: str, rows: List[dict]) -> None:
+    context = queues.get_loaded(queue_id)
+    if context is None:
+        # このプロセスで参照されていないキューには購読者もいない
+        return
+
+    # 完了・キャンセルになった予約の購読者には最終ステータスを送る
+    for row in rows:
+        if context.state.get(row["queue_number"]) is None:
+            wait_info = build_wait_info(context, row["queue_number"], row)
+            broker.publish_to(row["queue_number"], "wait_info", wait_info, only_if_changed=True)
+
+    publish_queue_snapshot(context)
+
+# 定期配信
+async def push_queue_updates():
+    """
+    席の残り時間や待ち時間の変化を定期的に配信し、
+    一定間隔でキープアライブを送る
+    """
+    elapsed_since_keepalive = 0.0
+    while True:
+        try:
+            await asyncio.sleep(EVENT_TICK_SECONDS)
+
+            if broker.subscriber_count == 0:
+                continue
+
+            started = time.perf_counter()
+            for context in queues.loaded():
+                await context.state.ensure_fresh()
+                publish_queue_snapshot(context)
+            background_iteration_duration.observe(time.perf_counter() - started, task="push_queue_updates")
+
+            elapsed_since_keepalive += EVENT_TICK_SECONDS
+            if elapsed_since_keepalive >= EVENT_KEEPALIVE_SECONDS:
+                broker.send_keepalive()
+                elapsed_since_keepalive = 0.0
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"イベント配信中にエラー: {e}")
+
+# 次に体験時間が終わるまでの秒数
+def seconds_until_next_expiry(now: datetime) -> float:
+    """
+    全キューの体験中のセッションのうち、最も早く体験時間が終わるものまでの秒数を返す
+    （AUTO_COMPLETE_MIN_INTERVAL_SECONDS 〜 AUTO_COMPLETE_MAX_INTERVAL_SECONDS の範囲に収める）
+    """
+    delay = AUTO_COMPLETE_MAX_INTERVAL_SECONDS
+    for context in queues.loaded():
+        for reservation in context.state.in_progress_list():
+            elapsed = elapsed_minutes(reservation, now)
+            if elapsed is None:
+                continue
+            remaining_seconds = (context.duration_minutes - elapsed) * 60
+            delay = min(delay, remaining_seconds)
+    return max(AUTO_COMPLETE_MIN_INTERVAL_SECONDS, delay)
+
+# 自動完了の遅れを記録
+def record_auto_complete_delay(row: dict) -> None:
+    """
+    体験時間が終わった時刻から、自動完了された時刻までの時間を記録する
+    """
+    elapsed = elapsed_minutes(row, parse_timestamp(row.get("completed_at")) or datetime.now(timezone.utc))
+    if elapsed is None:
+        return
+    context = queues.get_loaded(row.get("queue_id"))
+    duration_minutes = context.duration_minutes if context else EXPERIENCE_DURATION_MINUTES
+    auto_completed_total.inc()
+    auto_complete_delay.observe(max(0.0, (elapsed - duration_minutes) * 60))
 
 # 自動完了チェック関数
 async def auto_complete_expired_sessions():
     """
-    定期的に体験中のセッションをチェックし、
-    10分経過したものを自動的に完了にする
+    体験時間を過ぎたセッションを1回の UPDATE でまとめて完了にし、
+    次に体験時間が終わる時刻まで待機する
+
+    体験時間はキューごとの設定を使い、全キューをまとめて処理する。
+    複数のワーカーで動かしている場合は、リースを持つ1つだけが実行する
     """
     while True:
         try:
-            # 体験中の予約を取得
-            in_progress_response = supabase.table("reservations").select("*").eq("status", "in_progress").execute()
+            if not await auto_complete_lease.acquire():
+                await asyncio.sleep(LEADER_LEASE_SECONDS / 3)
+                continue
 
-            if in_progress_response.data:
-                now = datetime.now(timezone.utc)
+            started = time.perf_counter()
 
-                for reservation in in_progress_response.data:
-                    if reservation.get("started_at"):
-                        try:
-                            started_at_str = reservation["started_at"]
-                            if started_at_str.endswith('Z'):
-                                started_at_str = started_at_str[:-1] + '+00:00'
-                            started_at = datetime.fromisoformat(started_at_str)
+            # 既定のキューは常に監視する（他のキューは参照された時点で加わる）
+            await queues.get(DEFAULT_QUEUE_ID)
 
-                            # 経過時間（分）を計算
-                            elapsed_minutes = (now - started_at).total_seconds() / 60
+            # 期限切れのセッションを一括で完了にする（完了した行が返る）
+            completed = await repository.complete_expired(EXPERIENCE_DURATION_MINUTES)
 
-                            # 10分以上経過していたら自動完了
-                            if elapsed_minutes >= EXPERIENCE_DURATION_MINUTES:
-                                supabase.table("reservations").update({
-                                    "status": "completed",
-                                    "completed_at": now.isoformat()
-                                }).eq("queue_number", reservation["queue_number"]).execute()
+            for row in completed:
+                queues.apply(row)
+                record_auto_complete_delay(row)
+                print(f"自動完了: 予約番号 {row['queue_number']} ({row['name']}様)")
+            if completed:
+                notify_queue_changes("auto_completed", completed)
 
-                                print(f"自動完了: 予約番号 {reservation['queue_number']} ({reservation['name']}様) - 経過時間: {elapsed_minutes:.1f}分")
-                        except Exception as e:
-                            print(f"予約番号 {reservation.get('queue_number')} の処理中にエラー: {e}")
+            now = datetime.now(timezone.utc)
+            for context in queues.loaded():
+                await context.state.ensure_fresh()
 
-            # 30秒ごとにチェック
-            await asyncio.sleep(30)
+                # スナップショット上で期限切れなのに完了されなかった予約があれば、
+                # 他の操作で既に変更されているため読み直す
+                for reservation in context.state.in_progress_list():
+                    elapsed = elapsed_minutes(reservation, now)
+                    if elapsed is not None and elapsed >= context.duration_minutes:
+                        context.state.invalidate()
+                        await context.state.ensure_fresh()
+                        break
+
+            background_iteration_duration.observe(time.perf_counter() - started, task="auto_complete")
+
+            # 次に体験時間が終わる時刻まで待つ（リースの期限が切れる前に更新する）
+            await asyncio.sleep(min(seconds_until_next_expiry(now), LEADER_LEASE_SECONDS / 3))
 
         except Exception as e:
             print(f"自動完了チェック中にエラー: {e}")
-            await asyncio.sleep(30)
+            await asyncio.sleep(AUTO_COMPLETE_MAX_INTERVAL_SECONDS)
+
+# 他のワーカーによる変更の取り込み
+async def follow_changes():
+    """
+    他のワーカー（や Supabase 上での直接編集）による変更を定期的に取り込み、
+    スナップショットに反映して購読者に知らせる
+    """
+    while True:
+        try:
+            await asyncio.sleep(CHANGE_POLL_SECONDS)
+
+            started = time.perf_counter()
+            for row in await change_feed.poll():
+                # 作成直後の行は created_at と updated_at が同じ
+                change = "created" if row.get("created_at") == row.get("updated_at") else "status_changed"
+                notify_queue_changed(change, row)
+            background_iteration_duration.observe(time.perf_counter() - started, task="follow_changes")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"変更の取り込み中にエラー: {e}")
+
+# 終了した予約を履歴に移す
+async def archive_finished_reservations():
+    """
+    日付が変わったら、前日以前に完了・キャンセルになった予約を reservations_history に移す
+    （待機中・体験中の予約を引く reservations テーブルを、開催日数によらず小さく保つ）
+
+    自動完了の担当（リース）を持つプロセスだけが実行する。
+    完了件数の集計は変わらないため、スナップショットの読み直しは不要
+    """
+    archived_before: Optional[datetime] = None
+    while True:
+        try:
+            await asyncio.sleep(ARCHIVE_CHECK_SECONDS)
+
+            before = today_start_utc()
+            if before == archived_before or not auto_complete_lease.is_leader:
+                continue
+
+            started = time.perf_counter()
+            total = 0
+            # 大量にある場合もロックを長く持たないよう、分けて移す
+            while True:
+                moved = await repository.archive_finished(before, ARCHIVE_BATCH_SIZE)
+                total += moved
+                if moved < ARCHIVE_BATCH_SIZE:
+                    break
+            archived_before = before
+            background_iteration_duration.observe(time.perf_counter() - started, task="archive")
+
+            if total:
+                archived_total.inc(total)
+                # 予約一覧（/reservations）の ETag を変える
+                for context in queues.loaded():
+                    context.state.touch()
+                print(f"終了した予約 {total} 件を履歴に移しました")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"履歴への移動中にエラー: {e}")
 
 # 起動時にバックグラウンドタスクを開始
 @app.on_event("startup")
 async def startup_event():
-    global background_task
+    global background_task, event_task, lag_task, change_task, archive_task
+    await repository.connect()
     background_task = asyncio.create_task(auto_complete_expired_sessions())
     print("自動完了バックグラウンドタスクを開始しました")
+    event_task = asyncio.create_task(push_queue_updates())
+    lag_task = asyncio.create_task(
+        monitor_event_loop_lag(event_loop_lag, event_loop_lag_histogram, EVENT_LOOP_LAG_CHECK_SECONDS)
+    )
+    if CHANGE_POLL_SECONDS > 0:
+        change_task = asyncio.create_task(follow_changes())
+    if ARCHIVE_CHECK_SECONDS > 0:
+        archive_task = asyncio.create_task(archive_finished_reservations())
 
 # シャットダウン時にバックグラウンドタスクを停止
 @app.on_event("shutdown")
 async def shutdown_event():
-    global background_task
+    global background_task, event_task, lag_task, change_task, archive_task
     if background_task:
         background_task.cancel()
         try:
@@ -155,6 +873,19 @@ async def shutdown_event():
         except asyncio.CancelledError:
             pass
         print("自動完了バックグラウンドタスクを停止しました")
+    for task in (event_task, lag_task, change_task, archive_task):
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    try:
+        # 次のワーカーが期限切れを待たずに自動完了を引き継げるようにする
+        await auto_complete_lease.release()
+    except Exception as e:
+        print(f"リースの解放中にエラー: {e}")
+    await repository.close()
 
 # ルートエンドポイント
 @app.get("/")
@@ -165,162 +896,223 @@ def read_root():
 @app.post("/reservations", response_model=Reservation)
 async def create_reservation(reservation: ReservationCreate):
     """
-    新規予約を作成
+    新規予約を作成（queue_id で指定したキューに並ぶ）
     """
+    # 存在しないキューには予約できない
+    context = await get_queue_context(reservation.queue_id)
     try:
-        response = supabase.table("reservations").insert({
-            "name": reservation.name,
-            "status": "waiting"
-        }).execute()
-
-        if not response.data:
-            raise HTTPException(status_code=500, detail="予約の作成に失敗しました")
+        created = await repository.create(reservation.name, context.queue_id)
 
-        return response.data[0]
+        queues.apply(created)
+        notify_queue_changed("created", created)
+        return created
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# 全予約取得（管理者用）
-@app.get("/reservations", response_model=List[Reservation])
-async def get_all_reservations():
+# 一括登録（団体の受付）
+@app.post("/reservations/batch", response_model=List[Reservation])
+async def create_reservations(batch: ReservationBatchCreate):
     """
-    全予約を取得（管理者画面用）
+    複数の予約を1回の INSERT でまとめて作成し、names の順（予約番号順）に返す
+    （変更通知は最後に1回だけ送る）
     """
+    if not batch.names:
+        raise HTTPException(status_code=400, detail="名前を1件以上指定してください")
+    if len(batch.names) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"一度に登録できるのは{BATCH_MAX_ITEMS}件までです")
+    if any(not name.strip() for name in batch.names):
+        raise HTTPException(status_code=400, detail="名前が空の行があります")
+
+    context = await get_queue_context(batch.queue_id)
     try:
-        response = supabase.table("reservations").select("*").order("queue_number").execute()
-        return response.data
+        created = await repository.create_many(batch.names, context.queue_id)
+
+        for row in created:
+            queues.apply(row)
+        notify_queue_changes("created", created)
+        return created
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# 待ち状況取得
-@app.get("/reservations/{queue_number}/wait-info", response_model=WaitInfo)
-async def get_wait_info(queue_number: int):
+# 一括ステータス変更（管理者用）
+@app.patch("/reservations/batch", response_model=List[StatusChangeResult])
+async def update_reservation_statuses(batch: ReservationBatchUpdate):
     """
-    待ち番号から待ち状況を取得
+    複数の予約のステータスをまとめて変更し、1件ごとの結果を changes の順に返す
+
+    完了・キャンセルなどを先に行い、空いた席を同じ一括変更の体験開始に使う。
+    変更できなかった予約があっても他の予約は変更する（変更通知は最後に1回だけ送る）
     """
-    try:
-        # 指定された番号の予約を取得
-        reservation_response = supabase.table("reservations").select("*").eq("queue_number", queue_number).execute()
+    if not batch.changes:
+        raise HTTPException(status_code=400, detail="変更を1件以上指定してください")
+    if len(batch.changes) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"一度に変更できるのは{BATCH_MAX_ITEMS}件までです")
+    for change in batch.changes:
+        check_status(change.status)
+    queue_numbers = [change.queue_number for change in batch.changes]
+    if len(set(queue_numbers)) != len(queue_numbers):
+        raise HTTPException(status_code=400, detail="同じ予約番号が複数回含まれています")
 
-        if not reservation_response.data:
-            raise HTTPException(status_code=404, detail="予約が見つかりません")
+    try:
+        outcomes = await repository.update_statuses(
+            [(change.queue_number, change.status) for change in batch.changes],
+            MAX_CONCURRENT_EXPERIENCES,
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        reservation = reservation_response.data[0]
+    results = []
+    updated = []
+    for change, outcome in zip(batch.changes, outcomes):
+        if isinstance(outcome, Exception):
+            error = start_error(outcome)
+            results.append(StatusChangeResult(queue_number=change.queue_number, ok=False, error=error.detail))
+            continue
+        queues.apply(outcome)
+        updated.append(outcome)
+        results.append(StatusChangeResult(queue_number=change.queue_number, ok=True, reservation=outcome))
+
+    if updated:
+        notify_queue_changes("status_changed", updated)
+    return results
 
-        # 自分より前の待機中の人数を計算
-        waiting_before = supabase.table("reservations").select("*").lt("queue_number", queue_number).eq("status", "waiting").order("queue_number").execute()
-        waiting_before_count = len(waiting_before.data) if waiting_before.data else 0
+# 全予約取得（管理者用）
+@app.get("/reservations", response_model=List[Reservation])
+async def get_all_reservations(
+    request: Request,
+    response: Response,
+    cursor: Optional[int] = Query(None, description="この予約番号より後の予約を取得（前回のレスポンスの X-Next-Cursor）"),
+    limit: int = Query(RESERVATIONS_PAGE_SIZE, ge=1, le=RESERVATIONS_MAX_PAGE_SIZE),
+    status: Optional[str] = Query(None, description="ステータスで絞り込み"),
+    created_from: Optional[datetime] = Query(None, description="この日時以降に作成された予約"),
+    created_to: Optional[datetime] = Query(None, description="この日時より前に作成された予約"),
+    updated_since: Optional[datetime] = Query(None, description="この日時以降に変更された予約のみ（差分取得）"),
+    queue_id: str = Query(DEFAULT_QUEUE_ID, description="キュー（ブース）"),
+):
+    """
+    予約を予約番号順に取得（管理者画面用）
 
-        # 現在体験中の予約を取得
-        in_progress_response = supabase.table("reservations").select("*").eq("status", "in_progress").execute()
-        in_progress_count = len(in_progress_response.data) if in_progress_response.data else 0
+    前日以前に終了した予約は含まない（/history/reservations で取得する）。
+    続きがある場合は X-Next-Cursor ヘッダーに次の cursor を返す
+    """
+    context = await get_queue_context(queue_id)
+    try:
+        # このプロセスを経由した変更がなければ、データベースに問い合わせずに 304 を返す
+        cached = not_modified_response(request, response, queue_etag(context, time_dependent=False))
+        if cached:
+            return cached
+
+        # 1件多く取得して続きがあるかを判定する
+        rows = await repository.list(
+            cursor=cursor,
+            limit=limit + 1,
+            status=status,
+            created_from=created_from,
+            created_to=created_to,
+            updated_since=updated_since,
+            queue_id=context.queue_id,
+        )
 
-        # 自分の順位（待機中の中での順位）
-        position = waiting_before_count + 1
+        if len(rows) > limit:
+            rows = rows[:limit]
+            response.headers["X-Next-Cursor"] = str(rows[-1]["queue_number"])
 
-        # 予想待ち時間を計算（体験開始時刻を考慮）
-        now = datetime.now(timezone.utc)
+        return fast_response([compact_row(row) for row in rows], response)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        # 体験中の各予約の残り時間を計算
-        slot_available_times = []  # 各枠が空くまでの時間（分）
-
-        for res in (in_progress_response.data or []):
-            if res.get("started_at"):
-                try:
-                    started_at_str = res["started_at"]
-                    if started_at_str.endswith('Z'):
-                        started_at_str = started_at_str[:-1] + '+00:00'
-                    started_at = datetime.fromisoformat(started_at_str)
-                    # 経過時間（分）
-                    elapsed_minutes = (now - started_at).total_seconds() / 60
-                    # 残り時間（分）
-                    remaining_minutes = max(0, EXPERIENCE_DURATION_MINUTES - elapsed_minutes)
-                    slot_available_times.append(remaining_minutes)
-                except Exception:
-                    # パースエラーの場合は残り時間を最大値とする
-                    slot_available_times.append(EXPERIENCE_DURATION_MINUTES)
-
-        # 残り時間でソート（早く空く順）
-        slot_available_times.sort()
-
-        # 利用可能な枠の数
-        available_slots = MAX_CONCURRENT_EXPERIENCES - in_progress_count
-
-        # すぐに使える枠を追加
-        for _ in range(available_slots):
-            slot_available_times.insert(0, 0)
-
-        # 自分より前の人数 + 自分自身を割り当て
-        total_people = waiting_before_count + 1
-
-        if total_people == 0:
-            estimated_wait_minutes = 0
-        else:
-            # タイムラインを作成（最初の3枠）
-            timeline = slot_available_times[:MAX_CONCURRENT_EXPERIENCES].copy()
-            # timeline が MAX_CONCURRENT_EXPERIENCES より少ない場合は0で埋める
-            while len(timeline) < MAX_CONCURRENT_EXPERIENCES:
-                timeline.append(0)
-
-            for i in range(total_people):
-                # 一番早く空く枠を使用
-                earliest_available = min(timeline)
-                # この人の待ち時間
-                wait_time = earliest_available
-
-                # 自分の番の場合、待ち時間を記録
-                if i == total_people - 1:
-                    estimated_wait_minutes = int(math.ceil(wait_time))
-
-                # この枠が次に空く時刻を更新
-                timeline.remove(earliest_available)
-                timeline.append(earliest_available + EXPERIENCE_DURATION_MINUTES)
-
-        return WaitInfo(
-            queue_number=queue_number,
-            position=position,
-            estimated_wait_minutes=estimated_wait_minutes,
-            current_status=reservation["status"]
-        )
+# 待ち状況取得
+@app.get("/reservations/{queue_number}/wait-info", response_model=WaitInfo)
+async def get_wait_info(
+    queue_number: int,
+    request: Request,
+    response: Response,
+    bands: bool = Query(False, description="P50/P90 の予想待ち時間も返す"),
+):
+    """
+    待ち番号から待ち状況を取得
+    """
+    try:
+        # 一度参照した予約はキューが分かるため、データベースに問い合わせずに 304 を返せる
+        queue_id = queues.queue_id_of(queue_number)
+        if queue_id is not None:
+            context = await get_queue_context(queue_id)
+            cached = not_modified_response(request, response, queue_etag(context))
+            if cached:
+                return cached
+
+        # 指定された番号の予約を取得（待機中・体験中ならスナップショットから）
+        context, reservation = await find_reservation(queue_number)
+        if queue_id is None:
+            cached = not_modified_response(request, response, queue_etag(context))
+            if cached:
+                return cached
+
+        return fast_response(build_wait_info(context, queue_number, reservation, bands), response)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# 体験開始
+async def start_reservation(queue_number: int):
+    """
+    状態の確認・同時体験人数の上限チェック・席の割り当てを1つのトランザクションで行う
+    （競合して定員を超えることはない。上限はその予約のキューの席数）
+    """
+    context, _ = await find_reservation(queue_number)
+    try:
+        return await repository.start(queue_number, context.capacity)
+    except (CapacityFull, InvalidTransition, ReservationNotFound) as e:
+        raise start_error(e, context.capacity)
+
+# ステータスの確認
+def check_status(status: str) -> None:
+    """
+    RESERVATION_STATUSES 以外のステータスは 400 にする（単体・一括の変更で共通）
+    """
+    if status not in RESERVATION_STATUSES:
+        raise HTTPException(status_code=400, detail=f"ステータスは {', '.join(RESERVATION_STATUSES)} のいずれかを指定してください")
+
+# 体験開始できなかった理由
+def start_error(error: Exception, capacity: Optional[int] = None) -> HTTPException:
+    """
+    リポジトリの例外（CapacityFull / InvalidTransition / ReservationNotFound）を API のエラーにする
+    """
+    if isinstance(error, CapacityFull):
+        return HTTPException(
+            status_code=400,
+            detail=f"同時に体験できる人数は{capacity or error.capacity}人までです。現在{error.in_progress_count}人が体験中です。"
+        )
+    if isinstance(error, InvalidTransition):
+        return HTTPException(
+            status_code=400,
+            detail="体験を開始できるのは待機中の予約のみです"
+        )
+    return HTTPException(status_code=404, detail="予約が見つかりません")
+
 # 予約ステータス更新（管理者用）
 @app.patch("/reservations/{queue_number}", response_model=Reservation)
 async def update_reservation_status(queue_number: int, update: ReservationUpdate):
     """
     予約のステータスを更新（管理者画面用）
     """
+    check_status(update.status)
     try:
-        # ステータスを "in_progress" に変更する場合、同時体験人数の上限をチェック
         if update.status == "in_progress":
-            # 現在体験中の人数を取得
-            in_progress_response = supabase.table("reservations").select("*", count="exact").eq("status", "in_progress").execute()
-            current_in_progress = in_progress_response.count if in_progress_response.count is not None else 0
-
-            # 上限チェック
-            if current_in_progress >= MAX_CONCURRENT_EXPERIENCES:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"同時に体験できる人数は{MAX_CONCURRENT_EXPERIENCES}人までです。現在{current_in_progress}人が体験中です。"
-                )
-
-        update_data = {"status": update.status}
-
-        # ステータスに応じてタイムスタンプを更新（UTC で保存）
-        if update.status == "in_progress":
-            update_data["started_at"] = datetime.now(timezone.utc).isoformat()
-        elif update.status in ["completed", "cancelled"]:
-            update_data["completed_at"] = datetime.now(timezone.utc).isoformat()
-
-        response = supabase.table("reservations").update(update_data).eq("queue_number", queue_number).execute()
+            # 体験開始は、状態の確認・同時体験人数の上限チェック・席の割り当てを
+            # データベース側の1つのトランザクションで行う
+            updated = await start_reservation(queue_number)
+        else:
+            # 完了・キャンセル時は completed_at も記録される
+            updated = await repository.update_status(queue_number, update.status)
 
-        if not response.data:
+        if updated is None:
             raise HTTPException(status_code=404, detail="予約が見つかりません")
 
-        return response.data[0]
+        queues.apply(updated)
+        notify_queue_changed("status_changed", updated)
+        return updated
     except HTTPException:
         raise
     except Exception as e:
@@ -328,205 +1120,315 @@ async def update_reservation_status(queue_number: int, update: ReservationUpdate
 
 # 待機中の予約一覧取得
 @app.get("/reservations/waiting/list", response_model=List[Reservation])
-async def get_waiting_reservations():
+async def get_waiting_reservations(
+    request: Request,
+    response: Response,
+    queue_id: str = Query(DEFAULT_QUEUE_ID, description="キュー（ブース）"),
+):
     """
     待機中の予約一覧を取得
     """
+    context = await get_queue_context(queue_id)
     try:
-        response = supabase.table("reservations").select("*").eq("status", "waiting").order("queue_number").execute()
-        return response.data
+        cached = not_modified_response(request, response, queue_etag(context, time_dependent=False))
+        if cached:
+            return cached
+
+        return fast_response(context.state.waiting_list(), response)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # 待機中の予約一覧取得（待ち時間付き）
 @app.get("/reservations/waiting/with-wait-times", response_model=List[ReservationWithWaitTime])
-async def get_waiting_reservations_with_wait_times():
+async def get_waiting_reservations_with_wait_times(
+    request: Request,
+    response: Response,
+    queue_id: str = Query(DEFAULT_QUEUE_ID, description="キュー（ブース）"),
+    bands: bool = Query(False, description="P50/P90 の予想待ち時間も返す"),
+):
     """
     待機中の予約一覧を待ち時間情報付きで取得
     """
+    context = await get_queue_context(queue_id)
     try:
-        # 待機中の予約を取得
-        waiting_response = supabase.table("reservations").select("*").eq("status", "waiting").order("queue_number").execute()
-
-        # 現在体験中の予約を取得
-        in_progress_response = supabase.table("reservations").select("*").eq("status", "in_progress").execute()
-        in_progress_count = len(in_progress_response.data) if in_progress_response.data else 0
-
-        # 現在時刻
-        now = datetime.now(timezone.utc)
+        cached = not_modified_response(request, response, queue_etag(context))
+        if cached:
+            return cached
 
-        # 体験中の各予約の残り時間を計算
-        slot_available_times = []
-        for res in (in_progress_response.data or []):
-            if res.get("started_at"):
-                try:
-                    started_at_str = res["started_at"]
-                    if started_at_str.endswith('Z'):
-                        started_at_str = started_at_str[:-1] + '+00:00'
-                    started_at = datetime.fromisoformat(started_at_str)
-                    elapsed_minutes = (now - started_at).total_seconds() / 60
-                    remaining_minutes = max(0, EXPERIENCE_DURATION_MINUTES - elapsed_minutes)
-                    slot_available_times.append(remaining_minutes)
-                except Exception:
-                    slot_available_times.append(EXPERIENCE_DURATION_MINUTES)
-
-        # 残り時間でソート（早く空く順）
-        slot_available_times.sort()
-
-        # 利用可能な枠の数
-        available_slots = MAX_CONCURRENT_EXPERIENCES - in_progress_count
-
-        # すぐに使える枠を追加
-        for _ in range(available_slots):
-            slot_available_times.insert(0, 0)
-
-        # 各待機中の予約に待ち時間を計算
-        result = []
-        timeline = slot_available_times[:MAX_CONCURRENT_EXPERIENCES].copy()
-        while len(timeline) < MAX_CONCURRENT_EXPERIENCES:
-            timeline.append(0)
-
-        for idx, reservation in enumerate(waiting_response.data or []):
-            # 一番早く空く枠を使用
-            earliest_available = min(timeline)
-            wait_time = int(math.ceil(earliest_available))
-
-            # この枠が次に空く時刻を更新
-            timeline.remove(earliest_available)
-            timeline.append(earliest_available + EXPERIENCE_DURATION_MINUTES)
-
-            result.append(ReservationWithWaitTime(
-                id=reservation["id"],
-                queue_number=reservation["queue_number"],
-                name=reservation["name"],
-                status=reservation["status"],
-                created_at=reservation["created_at"],
-                started_at=reservation.get("started_at"),
-                completed_at=reservation.get("completed_at"),
-                estimated_wait_minutes=wait_time
-            ))
-
-        return result
+        return fast_response(build_waiting_with_wait_times(context, bands), response)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # 統計情報取得
 @app.get("/stats", response_model=Stats)
-async def get_stats():
+async def get_stats(
+    request: Request,
+    response: Response,
+    queue_id: str = Query(DEFAULT_QUEUE_ID, description="キュー（ブース）"),
+    bands: bool = Query(False, description="P50/P90 の予想待ち時間も返す"),
+):
     """
     現在の待機状況の統計情報を取得
     """
+    context = await get_queue_context(queue_id)
     try:
-        # 各ステータスの件数を取得
-        waiting_response = supabase.table("reservations").select("*").eq("status", "waiting").order("queue_number").execute()
-        in_progress_response = supabase.table("reservations").select("*").eq("status", "in_progress").execute()
-        completed_response = supabase.table("reservations").select("*", count="exact").eq("status", "completed").execute()
+        cached = not_modified_response(request, response, queue_etag(context))
+        if cached:
+            return cached
 
-        waiting_count = len(waiting_response.data) if waiting_response.data else 0
-        in_progress_count = len(in_progress_response.data) if in_progress_response.data else 0
-        completed_count = completed_response.count if completed_response.count is not None else 0
+        return fast_response(build_stats(context, bands), response)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        # 現在の予想待ち時間を計算（体験開始時刻を考慮）
-        now = datetime.now(timezone.utc)
+# トップ画面用の情報をまとめて取得
+@app.get("/dashboard", response_model=Dashboard)
+async def get_dashboard(
+    request: Request,
+    response: Response,
+    queue_id: str = Query(DEFAULT_QUEUE_ID, description="キュー（ブース）"),
+    bands: bool = Query(False, description="P50/P90 の予想待ち時間も返す"),
+):
+    """
+    統計情報と待機中の予約一覧（待ち時間付き）を同じスナップショットから取得
+    （/stats と /reservations/waiting/with-wait-times を1回で取得する）
+    """
+    context = await get_queue_context(queue_id)
+    try:
+        cached = not_modified_response(request, response, queue_etag(context))
+        if cached:
+            return cached
+
+        return fast_response({
+            "stats": build_stats(context, bands),
+            "waiting": build_waiting_with_wait_times(context, bands),
+        }, response)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        # 今日の開始時刻（UTC）
-        today_start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
-
-        # 今日完了した予約を取得
-        today_completed_response = supabase.table("reservations").select("*", count="exact").eq("status", "completed").gte("completed_at", today_start.isoformat()).execute()
-        today_completed_count = today_completed_response.count if today_completed_response.count is not None else 0
-
-        # 体験中の各予約の残り時間を計算
-        slot_available_times = []  # 各枠が空くまでの時間（分）
-        seats_info = []  # 各席の情報
-        overtime_seats_info = []  # 超過している席の情報
-        seat_names = ["A席", "B席", "C席"]
-
-        for idx, reservation in enumerate(in_progress_response.data or []):
-            remaining_minutes = EXPERIENCE_DURATION_MINUTES
-            elapsed_minutes = 0
-            if reservation.get("started_at"):
-                try:
-                    started_at_str = reservation["started_at"]
-                    if started_at_str.endswith('Z'):
-                        started_at_str = started_at_str[:-1] + '+00:00'
-                    started_at = datetime.fromisoformat(started_at_str)
-                    # 経過時間（分）
-                    elapsed_minutes = (now - started_at).total_seconds() / 60
-                    # 残り時間（分）
-                    remaining_minutes = max(0, EXPERIENCE_DURATION_MINUTES - elapsed_minutes)
-                except Exception:
-                    # パースエラーの場合は残り時間を最大値とする
-                    remaining_minutes = EXPERIENCE_DURATION_MINUTES
-
-            slot_available_times.append(remaining_minutes)
-
-            # 席の情報を追加
-            if idx < len(seat_names):
-                # 10分を超過しているかチェック
-                if elapsed_minutes > EXPERIENCE_DURATION_MINUTES:
-                    overtime_minutes = elapsed_minutes - EXPERIENCE_DURATION_MINUTES
-                    overtime_seats_info.append(OvertimeSeat(
-                        seat_name=seat_names[idx],
-                        name=reservation.get("name", "Unknown"),
-                        overtime_minutes=round(overtime_minutes, 1),
-                        queue_number=reservation.get("queue_number", 0)
-                    ))
-                else:
-                    seats_info.append(Seat(
-                        seat_name=seat_names[idx],
-                        name=reservation.get("name", "Unknown"),
-                        remaining_minutes=round(remaining_minutes, 1),
-                        queue_number=reservation.get("queue_number", 0)
-                    ))
-
-        # 残り時間でソート（早く空く順）
-        slot_available_times.sort()
-
-        # 利用可能な枠の数
-        available_slots = MAX_CONCURRENT_EXPERIENCES - in_progress_count
-
-        # すぐに使える枠を追加
-        for _ in range(available_slots):
-            slot_available_times.insert(0, 0)
-
-        # 待機中の人を順番に割り当てて、最後の人（または今登録する人）の待ち時間を計算
-        # タイムラインを作成
-        timeline = slot_available_times[:MAX_CONCURRENT_EXPERIENCES].copy()
-        while len(timeline) < MAX_CONCURRENT_EXPERIENCES:
-            timeline.append(0)
-
-        if waiting_count == 0:
-            # 待機中の人がいない場合、今登録する人の待ち時間
-            # = 次に空く枠までの時間
-            estimated_wait_minutes = int(math.ceil(min(timeline)))
-        else:
-            # 待機中の人がいる場合、最後の人の待ち時間を計算
-            for i in range(waiting_count):
-                # 一番早く空く枠を使用
-                earliest_available = min(timeline)
-                # この人の待ち時間
-                wait_time = earliest_available
-                # この枠が次に空く時刻を更新
-                timeline.remove(earliest_available)
-                timeline.append(earliest_available + EXPERIENCE_DURATION_MINUTES)
-
-                # 最後の人の待ち時間を記録
-                if i == waiting_count - 1:
-                    estimated_wait_minutes = int(math.ceil(wait_time))
-
-        return Stats(
-            waiting_count=waiting_count,
-            in_progress_count=in_progress_count,
-            completed_count=completed_count,
-            today_completed_count=today_completed_count,
-            estimated_wait_minutes=estimated_wait_minutes,
-            seats=seats_info,
-            overtime_seats=overtime_seats_info
+# 履歴に移した予約の取得
+@app.get("/history/reservations", response_model=List[Reservation])
+async def get_archived_reservations(
+    response: Response,
+    cursor: Optional[int] = Query(None, description="この予約番号より後の予約を取得（前回のレスポンスの X-Next-Cursor）"),
+    limit: int = Query(RESERVATIONS_PAGE_SIZE, ge=1, le=RESERVATIONS_MAX_PAGE_SIZE),
+    created_from: Optional[datetime] = Query(None, description="この日時以降に作成された予約"),
+    created_to: Optional[datetime] = Query(None, description="この日時より前に作成された予約"),
+    queue_id: str = Query(DEFAULT_QUEUE_ID, description="キュー（ブース）"),
+):
+    """
+    前日以前に完了・キャンセルになった予約を予約番号順に取得
+
+    続きがある場合は X-Next-Cursor ヘッダーに次の cursor を返す
+    """
+    context = await get_queue_context(queue_id)
+    try:
+        # 1件多く取得して続きがあるかを判定する
+        rows = await repository.list_archived(
+            cursor=cursor,
+            limit=limit + 1,
+            created_from=created_from,
+            created_to=created_to,
+            queue_id=context.queue_id,
+        )
+
+        if len(rows) > limit:
+            rows = rows[:limit]
+            response.headers["X-Next-Cursor"] = str(rows[-1]["queue_number"])
+
+        return rows
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# 日ごとの完了件数
+@app.get("/history/daily", response_model=List[DailyCompletions])
+async def get_daily_completions(
+    date_from: Optional[date] = Query(None, description="この日以降（省略時は30日前）"),
+    date_to: Optional[date] = Query(None, description="この日まで（省略時は今日）"),
+    queue_id: str = Query(DEFAULT_QUEUE_ID, description="キュー（ブース）"),
+):
+    """
+    日ごとの完了人数を日付順に取得（集計済みの件数から返し、予約を数え直さない）
+    """
+    context = await get_queue_context(queue_id)
+    date_to = date_to or today_start_utc().date()
+    date_from = date_from or date_to - timedelta(days=HISTORY_DAILY_DEFAULT_DAYS - 1)
+    try:
+        rows = await repository.daily_completions(context.queue_id, date_from, date_to)
+        return [DailyCompletions(day=row["day"], completed_count=row["count"]) for row in rows]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# 席数・体験時間・来場ペースを変えた場合のシミュレーション（管理者用）
+@app.post("/simulations", response_model=SimulationResult)
+async def run_simulation(request: SimulationRequest):
+    """
+    現在（または指定した）待ち行列の状況から、席数 × 体験時間 × 来場者数 の組み合わせごとに
+    待ち時間の分布と処理人数をモンテカルロ法で予測する
+    """
+    context = await get_queue_context(request.queue_id)
+    estimator = context.estimator
+
+    if request.waiting_count is not None:
+        waiting_count = request.waiting_count
+    else:
+        waiting_count = len(context.state.waiting)
+
+    if request.in_progress_remaining_minutes is not None:
+        in_progress_remaining = request.in_progress_remaining_minutes
+    else:
+        now = datetime.now(timezone.utc)
+        in_progress_remaining = []
+        for reservation in context.state.in_progress_list():
+            # 開始時刻が不明な場合は体験時間そのものを残り時間とする
+            elapsed = elapsed_minutes(reservation, now)
+            minutes = estimator.expected() if elapsed is None else estimator.remaining(elapsed)
+            in_progress_remaining.append(round(minutes, 1))
+
+    seat_counts = request.seat_counts or [context.capacity]
+    durations = request.duration_minutes or [round(estimator.expected(), 1)]
+    # 実績が十分にある場合は、実際の体験時間のばらつきを使う
+    samples = estimator.samples() if estimator.ready else []
+
+    # 枠が空いていない場合は待たせずに断る（スレッドとメモリが積み上がらないようにする）
+    if simulation_slots.locked():
+        raise HTTPException(
+            status_code=429, detail="シミュレーションを実行中です。しばらくしてから再度お試しください"
         )
+
+    try:
+        async with simulation_slots:
+            # 計算中もイベントループを止めないよう、別スレッドで実行する
+            scenarios = await asyncio.to_thread(
+                simulate,
+                waiting_count,
+                in_progress_remaining,
+                seat_counts,
+                durations,
+                request.arrivals_per_hour,
+                request.horizon_minutes,
+                request.runs,
+                samples,
+                request.seed,
+            )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return SimulationResult(
+        waiting_count=waiting_count,
+        in_progress_remaining_minutes=in_progress_remaining,
+        duration_samples=len(samples),
+        scenarios=scenarios,
+    )
+
+# キュー（ブース）の設定を API の形式にする
+def to_queue_info(context: QueueContext) -> QueueInfo:
+    return QueueInfo(
+        id=context.queue_id,
+        name=context.name,
+        capacity=context.capacity,
+        duration_minutes=context.duration_minutes,
+        seat_names=context.layout.names,
+    )
+
+# キュー（ブース）一覧取得
+@app.get("/queues", response_model=List[QueueInfo])
+async def get_queues():
+    """
+    キュー（ブース）の一覧と、それぞれの席数・体験時間を取得
+    """
+    try:
+        rows = await repository.list_queues()
+        ids = [row["id"] for row in rows]
+        if DEFAULT_QUEUE_ID not in ids:
+            ids.insert(0, DEFAULT_QUEUE_ID)
+
+        result = []
+        for queue_id in ids:
+            context = await queues.get(queue_id)
+            result.append(to_queue_info(context))
+        return result
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# キュー（ブース）の作成・設定変更（管理者用）
+@app.put("/queues/{queue_id}", response_model=QueueInfo)
+async def save_queue(queue_id: str, queue: QueueUpdate):
+    """
+    キュー（ブース）を作成、または席数・体験時間・席名を変更する
+    （省略した項目は環境変数の設定を使う）
+    """
+    if queue.capacity is not None and queue.capacity < 1:
+        raise HTTPException(status_code=400, detail="席数は1以上を指定してください")
+    if queue.duration_minutes is not None and queue.duration_minutes < 1:
+        raise HTTPException(status_code=400, detail="体験時間は1分以上を指定してください")
+    try:
+        saved = await repository.save_queue({
+            "id": queue_id,
+            "name": queue.name,
+            "capacity": queue.capacity,
+            "duration_minutes": queue.duration_minutes,
+            "seat_names": ",".join(parse_seat_names(queue.seat_names)) or None,
+        })
+
+        queues.configure(saved)
+        context = await queues.get(queue_id)
+        publish_queue_snapshot(context)
+        return to_queue_info(context)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# 変更通知の購読（Server-Sent Events）
+@app.get("/events")
+async def stream_events(
+    queue_number: Optional[int] = None,
+    queue_id: str = Query(DEFAULT_QUEUE_ID, description="キュー（ブース）"),
+):
+    """
+    キューの変更を Server-Sent Events で配信
+
+    queue_number を指定しない場合: queue_id のキューの reservation / stats / wait_times イベント（トップ画面・管理画面用）
+    queue_number を指定した場合: その予約の wait_info イベントのみ（待ち状況画面用）
+    """
+    # 接続直後に現在の状況を送る
+    if queue_number is None:
+        context = await get_queue_context(queue_id)
+        initial_messages = [
+            format_sse("stats", build_stats(context)),
+            format_sse("wait_times", build_wait_times(context)),
+        ]
+    else:
+        context, reservation = await find_reservation(queue_number)
+        initial_messages = [format_sse("wait_info", build_wait_info(context, queue_number, reservation))]
+
+    subscription = broker.subscribe(queue_number, context.queue_id)
+
+    async def event_stream():
+        try:
+            for message in initial_messages:
+                yield message
+            while True:
+                yield await subscription.next_message()
+        finally:
+            broker.unsubscribe(subscription)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # nginx などのリバースプロキシでバッファリングさせない
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+# メトリクス（Prometheus のテキスト形式）
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """
+    レイテンシ・データベース呼び出し・イベントループの遅延・キューの状態などのメトリクスを取得
+    """
+    return PlainTextResponse(metrics.render(), media_type=CONTENT_TYPE)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,208 @@
+import asyncio
+import math
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Prometheus のテキスト形式
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# レイテンシ用のバケット（秒）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 自動完了の遅れ用のバケット（秒）
+DELAY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Metric:
+    """
+    メトリクスの共通部分（名前・説明・ラベル）
+    """
+
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{format_labels(self.labelnames, key)} {format_value(value)}"
+            for key, value in sorted(self._values.items())
+        ]
+
+
+class Gauge(Metric):
+    """
+    現在の値。callback を指定した場合は出力のたびに呼び出して値を得る
+    （ラベルがある場合、callback は {ラベルの値のタプル: 値} を返す）
+    """
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), callback: Optional[Callable[[], float]] = None):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._callback = callback
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+    def samples(self) -> List[str]:
+        values = self._values
+        if self._callback is not None:
+            values = self._callback()
+            if not self.labelnames:
+                return [f"{self.name} {format_value(values)}"]
+        return [
+            f"{self.name}{format_labels(self.labelnames, key)} {format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # ラベルごとに [各バケットの件数..., 合計値, 件数]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[i] += 1
+                break
+        state[-2] += value
+        state[-1] += 1
+
+    def samples(self) -> List[str]:
+        lines = []
+        names = self.labelnames + ("le",)
+        for key, state in sorted(self._values.items()):
+            cumulative = 0
+            for i, bound in enumerate(self.buckets):
+                cumulative += state[i]
+                lines.append(f"{self.name}_bucket{format_labels(names, key + (format_value(bound),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{format_labels(names, key + ('+Inf',))} {state[-1]}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, key)} {format_value(state[-2])}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, key)} {state[-1]}")
+        return lines
+
+
+class Registry:
+    """
+    /metrics で出力するメトリクスの一覧
+    """
+
+    def __init__(self):
+        self._metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = (), callback: Optional[Callable[[], float]] = None) -> Gauge:
+        return self.register(Gauge(name, help, labelnames, callback))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+class InstrumentedRepository:
+    """
+    リポジトリの呼び出し（データベースへの往復）の回数と所要時間を記録するラッパー
+    """
+
+    def __init__(self, inner, histogram: Histogram, errors: Counter):
+        self._inner = inner
+        self._histogram = histogram
+        self._errors = errors
+
+    def __getattr__(self, name):
+        attr = getattr(self._inner, name)
+        if name in ("connect", "close") or not asyncio.iscoroutinefunction(attr):
+            return attr
+
+        labels = {
+            "backend": self._inner.backend,
+            "table": self._inner.OPERATION_TABLES.get(name, "reservations"),
+            "operation": name,
+        }
+
+        async def instrumented(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await attr(*args, **kwargs)
+            except Exception:
+                self._errors.inc(**labels)
+                raise
+            finally:
+                self._histogram.observe(time.perf_counter() - started, **labels)
+
+        return instrumented
+
+
+async def monitor_event_loop_lag(gauge: Gauge, histogram: Histogram, interval: float) -> None:
+    """
+    interval 秒の sleep が実際にどれだけ遅れて戻るかでイベントループの遅延を測る
+    （同期処理でループが止まっていると大きくなる）
+    """
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.perf_counter() - started - interval)
+        gauge.set(lag)
+        histogram.observe(lag)
@@ -0,0 +1,276 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from repository import RESERVATION_COLUMNS
+
+# キャッシュに保持するアクティブなステータス
+ACTIVE_STATUSES = ("waiting", "in_progress")
+
+# 反映済みの変更（予約番号 → updated_at）を覚えておく時間（秒）
+APPLIED_RETENTION_SECONDS = 300
+
+# スナップショットの行に持つカラム
+ROW_COLUMNS = tuple(RESERVATION_COLUMNS.split(","))
+
+# datetime に変換して持つカラム
+TIMESTAMP_COLUMNS = ("created_at", "started_at", "completed_at", "updated_at")
+
+
+def parse_timestamp(value) -> Optional[datetime]:
+    """
+    Supabase・SQLite から返されるタイムスタンプ（文字列）を datetime に変換する
+    （タイムスタンプの変換はすべてこの関数で行う）
+    """
+    if value is None or isinstance(value, datetime):
+        return value
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    return datetime.fromisoformat(value)
+
+
+def compact_row(row: dict) -> dict:
+    """
+    スナップショットに持つ形にする（ROW_COLUMNS のカラムだけを持ち、タイムスタンプは datetime）
+
+    タイムスタンプを取り込むときに一度だけ変換し、待ち時間の計算や
+    レスポンスのシリアライズのたびに文字列を解析しないようにする
+    """
+    compact = {column: row.get(column) for column in ROW_COLUMNS}
+    for column in TIMESTAMP_COLUMNS:
+        try:
+            compact[column] = parse_timestamp(compact[column])
+        except (TypeError, ValueError):
+            # 解析できない値はそのまま持つ
+            pass
+    return compact
+
+
+def is_newer(updated_at, latest) -> bool:
+    """
+    updated_at が latest（最後に反映した updated_at）より新しいかどうか（latest が None なら True）
+    """
+    if updated_at is None or latest is None:
+        return True
+    if isinstance(latest, datetime) and isinstance(updated_at, datetime):
+        return updated_at > latest
+    # 解析できなかった値は同じかどうかだけを比べる
+    return latest != updated_at
+
+
+def today_start_utc(now: Optional[datetime] = None) -> datetime:
+    """
+    今日の開始時刻（UTC）を返す
+    """
+    now = now or datetime.now(timezone.utc)
+    return now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def elapsed_minutes(reservation: dict, now: datetime) -> Optional[float]:
+    """
+    体験開始からの経過時間（分）を返す（開始時刻が不明な場合は None）
+    """
+    try:
+        started_at = parse_timestamp(reservation.get("started_at"))
+    except (TypeError, ValueError):
+        return None
+    if started_at is None:
+        return None
+    return (now - started_at).total_seconds() / 60
+
+
+class QueueState:
+    """
+    アクティブなキュー（待機中・体験中の予約）と完了件数を
+    プロセス内に保持するスナップショット
+
+    このプロセス経由の書き込みは apply() で即座に反映し、
+    それ以外（他プロセスや Supabase 上での直接編集）の変更は
+    max_age_seconds ごとの再読み込みで取り込む
+    """
+
+    def __init__(self, loader: Callable[[], Awaitable[dict]], max_age_seconds: float):
+        # loader はスナップショット用の dict を返すコルーチン関数
+        # {"active": [...], "completed_count": int, "today_completed_count": int}
+        self._loader = loader
+        self.max_age_seconds = max_age_seconds
+        self.waiting: Dict[int, dict] = {}
+        self.in_progress: Dict[int, dict] = {}
+        self.completed_count = 0
+        self.today_completed_count = 0
+        self.today_start: Optional[datetime] = None
+        self.loaded_at: Optional[float] = None
+        # 状態が変わるたびに増える番号（待ち時間表の再計算などに使う）
+        self.version = 0
+        # 反映済みの変更（同じ変更を二重に反映しないため）
+        self._applied: Dict[int, datetime] = {}
+        # 読み込み中に反映した変更（予約番号 → 行）。読み込み中でなければ None
+        # 読み込んだスナップショットがこれらの変更より古い場合に、読み込み後に反映し直す
+        self._pending: Optional[Dict[int, dict]] = None
+        self._lock = asyncio.Lock()
+
+    def is_stale(self) -> bool:
+        """
+        再読み込みが必要かどうか
+        """
+        if self.loaded_at is None:
+            return True
+        if time.monotonic() - self.loaded_at > self.max_age_seconds:
+            return True
+        # 日付が変わったら今日の完了件数を数え直す
+        return self.today_start != today_start_utc()
+
+    def touch(self) -> None:
+        """
+        内容（設定など）が変わったことにする（version を進めて ETag・待ち時間表を更新させる）
+        """
+        self.version += 1
+
+    def invalidate(self) -> None:
+        """
+        次回の参照時に再読み込みさせる
+        """
+        self.loaded_at = None
+
+    async def ensure_fresh(self) -> None:
+        """
+        スナップショットが古ければデータベースから読み直す
+        """
+        if not self.is_stale():
+            return
+        async with self._lock:
+            # ロック待ちの間に別のリクエストが読み込んでいれば何もしない
+            if not self.is_stale():
+                return
+            self._pending = {}
+            try:
+                snapshot = await self._loader()
+                self.load(snapshot, self._pending)
+            finally:
+                self._pending = None
+
+    def load(self, snapshot: dict, pending: Optional[Dict[int, dict]] = None) -> None:
+        """
+        データベースから取得したスナップショットで状態を置き換える
+
+        pending は読み込みを始めた後に apply() で反映した変更。スナップショットの取得と
+        行き違った変更が消えないよう、スナップショットより新しいものを反映し直す
+        """
+        waiting = {}
+        in_progress = {}
+        for row in snapshot.get("active") or []:
+            row = compact_row(row)
+            if row["status"] == "waiting":
+                waiting[row["queue_number"]] = row
+            elif row["status"] == "in_progress":
+                in_progress[row["queue_number"]] = row
+        completed_count = snapshot.get("completed_count") or 0
+        today_completed_count = snapshot.get("today_completed_count") or 0
+
+        # 内容が変わった場合だけ version を進める（ETag が無駄に変わらないように）
+        if (
+            waiting != self.waiting
+            or in_progress != self.in_progress
+            or completed_count != self.completed_count
+            or today_completed_count != self.today_completed_count
+        ):
+            self.version += 1
+
+        self.waiting = waiting
+        self.in_progress = in_progress
+        self.completed_count = completed_count
+        self.today_completed_count = today_completed_count
+        self.today_start = snapshot.get("today_start") or today_start_utc()
+        self.loaded_at = time.monotonic()
+        self._forget_old_applied()
+
+        for row in (pending or {}).values():
+            current = self.get(row["queue_number"])
+            if current is not None:
+                if not is_newer(row.get("updated_at"), current.get("updated_at")):
+                    continue
+            elif row["status"] not in ACTIVE_STATUSES:
+                # 完了・キャンセルが読み込んだ時点で既に反映されている
+                continue
+            self._update(row)
+
+    def _forget_old_applied(self) -> None:
+        threshold = datetime.now(timezone.utc).timestamp() - APPLIED_RETENTION_SECONDS
+        for queue_number, updated_at in list(self._applied.items()):
+            # 解析できなかった値（datetime でないもの）も捨てる
+            if not isinstance(updated_at, datetime) or updated_at.timestamp() < threshold:
+                del self._applied[queue_number]
+
+    def apply(self, row: dict) -> bool:
+        """
+        書き込み結果（insert / update で返された行）や、変更通知で受け取った行を反映する
+
+        反映済みの変更と、それより古い変更（updated_at が最後に反映した値以前の行）は無視する
+        （変更通知が書き込み結果より後に届いても、状態が戻ったり完了件数を二重に数えたりしないように）。
+        反映した場合は True を返す
+        """
+        row = compact_row(row)
+        queue_number = row["queue_number"]
+        updated_at = row.get("updated_at")
+        if updated_at is not None:
+            current = self.get(queue_number)
+            for latest in (self._applied.get(queue_number), current and current.get("updated_at")):
+                if not is_newer(updated_at, latest):
+                    return False
+            self._applied[queue_number] = updated_at
+
+        if self._pending is not None:
+            # 読み込み中のスナップショットに含まれていない可能性があるため、読み込み後にも反映する
+            self._pending[queue_number] = row
+
+        if self.loaded_at is None:
+            # まだ読み込んでいない場合は次回の読み込みに任せる
+            return False
+
+        return self._update(row)
+
+    def _update(self, row: dict) -> bool:
+        """
+        行（compact_row 済み）のステータスに合わせて待機中・体験中の一覧と完了件数を更新する
+        """
+        queue_number = row["queue_number"]
+        self.version += 1
+        was_active = queue_number in self.waiting or queue_number in self.in_progress
+        self.waiting.pop(queue_number, None)
+        self.in_progress.pop(queue_number, None)
+
+        status = row["status"]
+        if status == "waiting":
+            self.waiting[queue_number] = row
+        elif status == "in_progress":
+            self.in_progress[queue_number] = row
+        elif status == "completed":
+            if not was_active:
+                # 以前のステータスが分からないため、完了件数は数え直す
+                self.invalidate()
+                return True
+            self.completed_count += 1
+            completed_at = row["completed_at"]
+            if completed_at and completed_at >= self.today_start:
+                self.today_completed_count += 1
+        return True
+
+    def waiting_list(self) -> List[dict]:
+        """
+        待機中の予約を予約番号順で返す
+        """
+        return [self.waiting[n] for n in sorted(self.waiting)]
+
+    def in_progress_list(self) -> List[dict]:
+        """
+        体験中の予約を予約番号順で返す
+        """
+        return [self.in_progress[n] for n in sorted(self.in_progress)]
+
+    def get(self, queue_number: int) -> Optional[dict]:
+        """
+        アクティブな予約を予約番号で取得する（なければ None）
+        """
+        return self.waiting.get(queue_number) or self.in_progress.get(queue_number)
+
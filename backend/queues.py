@@ -0,0 +1,253 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from estimator import DurationEstimator
+from queue_state import QueueState
+from scheduler import Scheduler
+from seats import SeatLayout
+
+# queue_id を指定しない場合のキュー（ブースが1つの場合はこれだけを使う）
+DEFAULT_QUEUE_ID = "default"
+
+# 存在しなかったキューを覚えておく数（同じ queue_id で何度もデータベースに問い合わせないように）
+MISSING_QUEUE_CACHE_SIZE = 1000
+
+# 予約番号 → キューを覚えておく数（古いものから忘れる）
+QUEUE_ID_CACHE_SIZE = 10000
+
+
+class QueueNotFound(Exception):
+    """
+    指定したキュー（ブース）が存在しない
+    """
+
+
+def parse_seat_names(value) -> List[str]:
+    """
+    カンマ区切りの席名（または席名のリスト）をリストにする
+    """
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(",")
+    return [name.strip() for name in value if name and name.strip()]
+
+
+class QueueContext:
+    """
+    1つのキュー（ブース）の設定・スナップショット・体験時間の推定・待ち時間表
+    """
+
+    def __init__(
+        self,
+        queue_id: str,
+        config: Optional[dict],
+        defaults: dict,
+        loader: Callable[[str], Awaitable[dict]],
+        max_age_seconds: float,
+        refresh_seconds: float,
+        estimator_window: int,
+        estimator_min_samples: int,
+    ):
+        self.queue_id = queue_id
+        self.defaults = defaults
+        self.refresh_seconds = refresh_seconds
+        self.estimator_window = estimator_window
+        self.estimator_min_samples = estimator_min_samples
+        self._loader = loader
+        self.name = queue_id
+        self.duration_minutes = defaults["duration_minutes"]
+        self.layout = SeatLayout(defaults["capacity"], defaults["seat_names"])
+        self.estimator = self._create_estimator()
+        self.scheduler = Scheduler(self.layout, self.duration_minutes, refresh_seconds, self.estimator)
+        self.state = QueueState(self._load, max_age_seconds)
+        self.configure(config)
+
+    @property
+    def capacity(self) -> int:
+        return self.layout.count
+
+    def _create_estimator(self) -> DurationEstimator:
+        return DurationEstimator(self.duration_minutes, self.estimator_window, self.estimator_min_samples)
+
+    def configure(self, config: Optional[dict]) -> None:
+        """
+        queues テーブルの行で設定を更新する（値がない項目は環境変数の設定を使う）
+        """
+        config = config or {}
+        name = config.get("name") or self.queue_id
+        capacity = config.get("capacity") or self.defaults["capacity"]
+        duration_minutes = config.get("duration_minutes") or self.defaults["duration_minutes"]
+        seat_names = parse_seat_names(config.get("seat_names")) or self.defaults["seat_names"]
+
+        self.name = name
+        if (
+            capacity != self.layout.count
+            or duration_minutes != self.duration_minutes
+            or seat_names != self.layout.names
+        ):
+            if duration_minutes != self.duration_minutes:
+                # 体験時間の設定が変わったら、それまでの実績は使わない
+                self.duration_minutes = duration_minutes
+                self.estimator = self._create_estimator()
+            self.layout = SeatLayout(capacity, seat_names)
+            self.scheduler = Scheduler(self.layout, duration_minutes, self.refresh_seconds, self.estimator)
+            # 席数・体験時間が変わると統計情報・待ち時間も変わる
+            self.state.touch()
+
+    async def _load(self) -> dict:
+        snapshot = await self._loader(self.queue_id)
+        if "queue" in snapshot:
+            self.configure(snapshot["queue"])
+        return snapshot
+
+
+class QueueRegistry:
+    """
+    キュー（ブース）ごとの QueueContext
+
+    参照されたキューだけを作成し、設定は queues テーブルから読み込む。
+    既定のキュー（DEFAULT_QUEUE_ID）は queues テーブルに行がなくても環境変数の設定で動く
+    """
+
+    def __init__(
+        self,
+        repository,
+        defaults: dict,
+        loader: Callable[[str], Awaitable[dict]],
+        max_age_seconds: float,
+        refresh_seconds: float,
+        estimator_window: int,
+        estimator_min_samples: int,
+    ):
+        self.repository = repository
+        self.defaults = defaults
+        self._loader = loader
+        self.max_age_seconds = max_age_seconds
+        self.refresh_seconds = refresh_seconds
+        self.estimator_window = estimator_window
+        self.estimator_min_samples = estimator_min_samples
+        self._contexts: Dict[str, QueueContext] = {}
+        # 存在しなかったキュー → 確認した時刻（max_age_seconds の間は問い合わせずに QueueNotFound にする）
+        self._missing: "OrderedDict[str, float]" = OrderedDict()
+        # 予約番号 → キュー（一度参照した予約は、データベースに問い合わせずにキューが分かる）
+        self._queue_ids: "OrderedDict[int, str]" = OrderedDict()
+        self._lock = asyncio.Lock()
+
+    def _create(self, queue_id: str, config: Optional[dict]) -> QueueContext:
+        return QueueContext(
+            queue_id,
+            config,
+            self.defaults,
+            self._loader,
+            self.max_age_seconds,
+            self.refresh_seconds,
+            self.estimator_window,
+            self.estimator_min_samples,
+        )
+
+    async def get(self, queue_id: Optional[str] = None) -> QueueContext:
+        """
+        キューを返す（存在しない場合は QueueNotFound）
+        """
+        queue_id = queue_id or DEFAULT_QUEUE_ID
+        context = self._contexts.get(queue_id)
+        if context is not None:
+            return context
+        if self._is_missing(queue_id):
+            raise QueueNotFound(queue_id)
+
+        async with self._lock:
+            context = self._contexts.get(queue_id)
+            if context is not None:
+                return context
+            if self._is_missing(queue_id):
+                raise QueueNotFound(queue_id)
+            config = await self.repository.get_queue(queue_id)
+            if config is None and queue_id != DEFAULT_QUEUE_ID:
+                self._missing[queue_id] = time.monotonic()
+                while len(self._missing) > MISSING_QUEUE_CACHE_SIZE:
+                    self._missing.popitem(last=False)
+                raise QueueNotFound(queue_id)
+            context = self._contexts[queue_id] = self._create(queue_id, config)
+            return context
+
+    def _is_missing(self, queue_id: str) -> bool:
+        """
+        最近確認して存在しなかったキューかどうか（他のプロセスで作成された場合に備えて、時間が経てば確認し直す）
+        """
+        checked_at = self._missing.get(queue_id)
+        if checked_at is None:
+            return False
+        if time.monotonic() - checked_at > self.max_age_seconds:
+            del self._missing[queue_id]
+            return False
+        return True
+
+    def loaded(self) -> List[QueueContext]:
+        """
+        このプロセスで参照されたキューの一覧
+        """
+        return list(self._contexts.values())
+
+    def get_loaded(self, queue_id: Optional[str]) -> Optional[QueueContext]:
+        return self._contexts.get(queue_id or DEFAULT_QUEUE_ID)
+
+    def find(self, queue_number: int) -> Optional[Tuple[QueueContext, dict]]:
+        """
+        待機中・体験中の予約をスナップショットから探す
+        """
+        context = self.get_loaded(self._queue_ids.get(queue_number))
+        if context is not None:
+            reservation = context.state.get(queue_number)
+            if reservation is not None:
+                return context, reservation
+        for context in self._contexts.values():
+            reservation = context.state.get(queue_number)
+            if reservation is not None:
+                return context, reservation
+        return None
+
+    def remember(self, row: dict) -> None:
+        queue_number = row["queue_number"]
+        self._queue_ids[queue_number] = row.get("queue_id") or DEFAULT_QUEUE_ID
+        self._queue_ids.move_to_end(queue_number)
+        if len(self._queue_ids) > QUEUE_ID_CACHE_SIZE:
+            self._queue_ids.popitem(last=False)
+
+    def queue_id_of(self, queue_number: int) -> Optional[str]:
+        """
+        予約のキュー（このプロセスで参照したことがなければ None）
+        """
+        return self._queue_ids.get(queue_number)
+
+    def apply(self, row: dict) -> bool:
+        """
+        書き込み結果・変更通知の行を、その予約のキューのスナップショットに反映する
+        （参照されていないキューは次回の読み込みに任せる）
+
+        完了した予約の体験時間は、体験時間の推定に加える（同じ変更は一度だけ）
+        """
+        self.remember(row)
+        context = self.get_loaded(row.get("queue_id"))
+        if context is None:
+            return False
+        applied = context.state.apply(row)
+        if applied:
+            context.estimator.observe(row)
+        return applied
+
+    def invalidate(self) -> None:
+        for context in self._contexts.values():
+            context.state.invalidate()
+
+    def configure(self, config: dict) -> None:
+        """
+        queues テーブルの行（作成・変更後）を反映する
+        """
+        self._missing.pop(config["id"], None)
+        context = self._contexts.get(config["id"])
+        if context is not None:
+            context.configure(config)
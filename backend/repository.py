@@ -0,0 +1,235 @@
+import os
+from datetime import date, datetime, timezone
+from typing import Dict, List, Optional, Tuple, Union
+
+# 予約の取得時に選択するカラム
+RESERVATION_COLUMNS = "id,queue_number,queue_id,name,status,created_at,started_at,completed_at,updated_at,seat_number"
+
+# キュー（ブース）の取得時に選択するカラム
+QUEUE_COLUMNS = "id,name,capacity,duration_minutes,seat_names"
+
+
+class ReservationNotFound(Exception):
+    """
+    指定した予約番号の予約が存在しない
+    """
+
+
+class InvalidTransition(Exception):
+    """
+    現在のステータスからは変更できない（例: 待機中以外の予約の体験開始）
+    """
+
+    def __init__(self, status: str):
+        super().__init__(status)
+        self.status = status
+
+
+class CapacityFull(Exception):
+    """
+    空いている席がない
+    """
+
+    def __init__(self, in_progress_count: int, capacity: Optional[int] = None):
+        super().__init__(in_progress_count)
+        self.in_progress_count = in_progress_count
+        # 席数（一括更新の場合のみ。単体の体験開始では呼び出し側が知っている）
+        self.capacity = capacity
+
+
+def to_utc_iso(value: datetime) -> str:
+    """
+    datetime を UTC の ISO 8601 文字列にする（タイムゾーンなしは UTC とみなす）
+    """
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+
+class ReservationRepository:
+    """
+    reservations テーブルに対する操作
+
+    返す予約は Supabase（PostgREST）の JSON と同じ形の dict
+    （タイムスタンプは ISO 8601 文字列）
+    """
+
+    # メトリクスのラベルに使う保存先の名前
+    backend = ""
+    # reservations 以外のテーブルを参照する操作（メトリクスのラベル用）
+    OPERATION_TABLES: Dict[str, str] = {}
+
+    async def connect(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    async def list_active(self, queue_id: str) -> List[dict]:
+        """
+        キュー queue_id の待機中・体験中の予約を予約番号順に返す
+        """
+        raise NotImplementedError
+
+    async def count_completed(self, today: date, queue_id: str) -> dict:
+        """
+        キュー queue_id の完了件数を返す {"completed_count": int, "today_completed_count": int}
+        """
+        raise NotImplementedError
+
+    async def get(self, queue_number: int) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def list(
+        self,
+        cursor: Optional[int] = None,
+        limit: int = 500,
+        status: Optional[str] = None,
+        created_from: Optional[datetime] = None,
+        created_to: Optional[datetime] = None,
+        updated_since: Optional[datetime] = None,
+        queue_id: Optional[str] = None,
+    ) -> List[dict]:
+        """
+        予約番号が cursor より大きい予約を予約番号順に最大 limit 件返す
+        （queue_id を省略した場合は全キュー）
+        """
+        raise NotImplementedError
+
+    async def create(self, name: str, queue_id: str) -> dict:
+        raise NotImplementedError
+
+    async def create_many(self, names: List[str], queue_id: str) -> List[dict]:
+        """
+        複数の予約を1つの INSERT で作成し、names の順（予約番号順）に返す
+        """
+        raise NotImplementedError
+
+    async def start(self, queue_number: int, capacity: int) -> dict:
+        """
+        体験を開始する（状態の確認・空席の割り当て・更新を1つのトランザクションで行う）
+
+        capacity はその予約のキューの席数。席はキューごとに割り当てる
+
+        ReservationNotFound / InvalidTransition / CapacityFull を送出する
+        """
+        raise NotImplementedError
+
+    async def update_status(self, queue_number: int, status: str) -> Optional[dict]:
+        """
+        ステータスを更新する（完了・キャンセル時は completed_at も記録する）
+        """
+        raise NotImplementedError
+
+    async def update_statuses(
+        self, changes: List[Tuple[int, str]], default_capacity: int
+    ) -> List[Union[dict, Exception]]:
+        """
+        (予約番号, ステータス) の変更を順にまとめて行い、1件ごとの結果を changes の順に返す
+
+        成功した変更は更新後の予約、失敗した変更は ReservationNotFound / InvalidTransition /
+        CapacityFull（capacity 付き）を返す（失敗した変更があっても他の変更は行う）。
+        体験開始は start と同じく状態の確認と空席の割り当てを行い、席数はキューごとの設定
+        （設定がないキューは default_capacity）を使う。同じ予約番号を複数回含めてはいけない
+        """
+        raise NotImplementedError
+
+    async def complete_expired(self, duration_minutes: float) -> List[dict]:
+        """
+        体験時間を過ぎたセッションを全キューで一括で完了にし、完了した予約を返す
+
+        体験時間はキューごとの設定（queues.duration_minutes）を使い、
+        設定がないキューは duration_minutes を使う
+        """
+        raise NotImplementedError
+
+    async def archive_finished(self, before: datetime, limit: int) -> int:
+        """
+        before より前に完了・キャンセルになった予約を最大 limit 件、履歴（reservations_history）に移し、
+        移した件数を返す（完了件数の集計は変わらない）
+        """
+        raise NotImplementedError
+
+    async def get_archived(self, queue_number: int) -> Optional[dict]:
+        """
+        履歴に移した予約を返す
+        """
+        raise NotImplementedError
+
+    async def list_archived(
+        self,
+        cursor: Optional[int] = None,
+        limit: int = 500,
+        created_from: Optional[datetime] = None,
+        created_to: Optional[datetime] = None,
+        queue_id: Optional[str] = None,
+    ) -> List[dict]:
+        """
+        履歴に移した予約のうち、予約番号が cursor より大きいものを予約番号順に最大 limit 件返す
+        """
+        raise NotImplementedError
+
+    async def daily_completions(self, queue_id: str, day_from: date, day_to: date) -> List[dict]:
+        """
+        キュー queue_id の day_from 〜 day_to（両端を含む）の日ごとの完了件数を
+        日付順に返す [{"day": "YYYY-MM-DD", "count": int}]（履歴に移した予約を含む）
+        """
+        raise NotImplementedError
+
+    async def get_queue(self, queue_id: str) -> Optional[dict]:
+        """
+        キュー（ブース）の設定を返す（queues テーブルの行）
+        """
+        raise NotImplementedError
+
+    async def list_queues(self) -> List[dict]:
+        raise NotImplementedError
+
+    async def save_queue(self, queue: dict) -> dict:
+        """
+        キューを作成・更新する（queue は QUEUE_COLUMNS のカラムを持つ dict）
+        """
+        raise NotImplementedError
+
+    async def acquire_lease(self, name: str, holder: str, ttl_seconds: int) -> bool:
+        """
+        リース name を取得・更新する（取得できた場合は True）
+
+        誰も持っていないか、期限が切れているか、既に holder が持っている場合に取得できる
+        """
+        raise NotImplementedError
+
+    async def release_lease(self, name: str, holder: str) -> None:
+        """
+        holder が持っているリース name を手放す
+        """
+        raise NotImplementedError
+
+    async def change_token(self) -> Optional[int]:
+        """
+        他の接続による変更があると変わる値（安く取得できる場合のみ）
+
+        None の場合は変更の有無が分からないため、変更通知は毎回 updated_at で差分を取得する
+        """
+        return None
+
+
+def create_repository(backend: str) -> ReservationRepository:
+    """
+    設定（STORAGE_BACKEND）に応じたリポジトリを作成する
+    """
+    if backend == "supabase":
+        from supabase_repository import SupabaseRepository
+
+        supabase_url = os.getenv("SUPABASE_URL")
+        supabase_key = os.getenv("SUPABASE_KEY")
+        if not supabase_url or not supabase_key:
+            raise ValueError("SUPABASE_URLとSUPABASE_KEYを.envファイルに設定してください")
+        return SupabaseRepository(supabase_url, supabase_key)
+
+    if backend == "sqlite":
+        from sqlite_repository import SQLiteRepository
+
+        return SQLiteRepository(os.getenv("SQLITE_PATH", "reservations.db"))
+
+    raise ValueError(f"STORAGE_BACKEND は supabase または sqlite を指定してください（{backend}）")
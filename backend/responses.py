@@ -0,0 +1,52 @@
+from typing import Any, Iterable
+
+import orjson
+from fastapi.responses import ORJSONResponse
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# datetime は Pydantic と同じ形式（UTC は末尾 Z）で出力する
+ORJSON_OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+
+def dumps(data: Any) -> bytes:
+    """
+    JSON にシリアライズする（datetime はそのまま渡せる）
+    """
+    return orjson.dumps(data, option=ORJSON_OPTIONS)
+
+
+class FastJSONResponse(ORJSONResponse):
+    """
+    orjson でシリアライズするレスポンス
+
+    ハンドラーがこのレスポンスを直接返すと、FastAPI による response_model の検証と
+    jsonable_encoder を通らない（dict をそのままシリアライズする）
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class SelectiveGZipMiddleware(GZipMiddleware):
+    """
+    excluded_paths 以外のレスポンスを gzip で圧縮する
+
+    SSE（/events）を圧縮すると、圧縮用のバッファに溜まってイベントがすぐに届かなくなるため除く
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 500,
+        compresslevel: int = 9,
+        excluded_paths: Iterable[str] = (),
+    ):
+        super().__init__(app, minimum_size=minimum_size, compresslevel=compresslevel)
+        self.excluded_paths = frozenset(excluded_paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope["path"] in self.excluded_paths:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
@@ -0,0 +1,207 @@
+import heapq
+import math
+import time
+from bisect import bisect_left
+from datetime import datetime, timezone
+from statistics import NormalDist
+from typing import Callable, Dict, List, Optional
+
+from estimator import DurationEstimator
+from queue_state import QueueState, elapsed_minutes
+from seats import SeatLayout
+
+
+class Schedule:
+    """
+    待機中の全予約について、体験開始までの予想時間をまとめた表
+
+    starts[i] は待機中の i 番目（0始まり）の人が体験を開始するまでの時間（分）。
+    要素は待機人数 + 1 個あり、最後の要素（starts[待機人数]）は待機中の全員の後に
+    もう1人並んだ場合の時間で、index が待機人数と等しい場合に使う
+    （待機中の人がいないときの last_wait_minutes や、position_index が待機列の末尾を返す
+    待機中でない予約の待ち状況）
+    """
+
+    def __init__(self, computed_at: datetime, waiting_numbers: List[int], starts: List[float]):
+        self.computed_at = computed_at
+        self.waiting_numbers = waiting_numbers
+        self.starts = starts
+        self._index = {queue_number: i for i, queue_number in enumerate(waiting_numbers)}
+
+    def position_index(self, queue_number: int) -> int:
+        """
+        指定した予約番号より前にいる待機中の人数
+        """
+        index = self._index.get(queue_number)
+        if index is not None:
+            return index
+        # 待機中でない予約は、予約番号の位置から求める
+        return bisect_left(self.waiting_numbers, queue_number)
+
+    def wait_minutes(self, index: int) -> int:
+        """
+        待機中の index 番目の人の予想待ち時間（分、切り上げ）
+        """
+        return int(math.ceil(self.starts[index]))
+
+    def last_wait_minutes(self) -> int:
+        """
+        待機列の最後の人（誰も待っていなければ次に受付する人）の予想待ち時間
+        """
+        return self.wait_minutes(max(0, len(self.waiting_numbers) - 1))
+
+
+def build_schedule(
+    in_progress: List[dict],
+    waiting: List[dict],
+    layout: SeatLayout,
+    duration_minutes: float,
+    now: Optional[datetime] = None,
+    remaining: Optional[Callable[[float], float]] = None,
+) -> Schedule:
+    """
+    各席が空く時刻をもとに、待機中の人を順番に一番早く空く席へ割り当てる
+
+    duration_minutes は1人あたりの体験時間、remaining は体験中の人の残り時間を
+    経過時間から求める関数（省略時は duration_minutes - 経過時間）
+
+    席の空き時刻をヒープで管理するため、計算量は O(N log k)
+    （N: 待機人数、k: 席数）
+    """
+    now = now or datetime.now(timezone.utc)
+
+    # 各席が空くまでの時間（空席は 0）
+    timeline = layout.available_minutes(in_progress, duration_minutes, now, remaining)
+    heapq.heapify(timeline)
+
+    # 待機中の全員 + 列の末尾にもう1人 の分だけ割り当てる（Schedule の starts を参照）
+    starts = []
+    for _ in range(len(waiting) + 1):
+        earliest_available = timeline[0]
+        starts.append(earliest_available)
+        heapq.heapreplace(timeline, earliest_available + duration_minutes)
+
+    waiting_numbers = [reservation["queue_number"] for reservation in waiting]
+    return Schedule(now, waiting_numbers, starts)
+
+
+def build_band_schedule(
+    in_progress: List[dict],
+    waiting: List[dict],
+    layout: SeatLayout,
+    estimator: DurationEstimator,
+    q: float,
+    now: Optional[datetime] = None,
+) -> Schedule:
+    """
+    待機中の各人が体験を開始するまでの時間の分位点 q（0.9 なら P90）の表を作る
+
+    席の割り当ては平均の表（build_schedule）と同じで、開始までの時間は
+    「その席の体験中の人の残り時間 + その席で先に体験する n 人の体験時間」の和になる。
+    和の分布は正規分布で近似し、平均 + z_q × √(残り時間の分散 + n × 体験時間の分散) とする。
+    先に体験する人がいない場合（n = 0）は、体験中の人の残り時間の分位点そのものを使う
+    """
+    now = now or datetime.now(timezone.utc)
+    mean_duration = estimator.expected()
+    duration_variance = estimator.variance()
+    z = NormalDist().inv_cdf(q)
+
+    # 各席が空くまでの時間の (平均, 分散, 分位点 q)（空席は 0）
+    occupancy = layout.occupancy(in_progress)
+    seats = []
+    for seat_number in range(1, layout.count + 1):
+        reservation = occupancy.get(seat_number)
+        elapsed = None if reservation is None else elapsed_minutes(reservation, now)
+        if reservation is None:
+            seats.append((0.0, 0.0, 0.0))
+        elif elapsed is None:
+            # 開始時刻が不明な場合は体験時間そのものを残り時間とする
+            seats.append((mean_duration, duration_variance, estimator.expected(q)))
+        else:
+            seats.append((estimator.remaining(elapsed), estimator.variance(elapsed), estimator.remaining(elapsed, q)))
+
+    timeline = [(available, index) for index, (available, _, _) in enumerate(seats)]
+    heapq.heapify(timeline)
+    # 各席で、待機中の人が先に何人体験するか
+    sessions = [0] * len(seats)
+
+    # 待機中の全員 + 列の末尾にもう1人 の分だけ割り当てる（Schedule の starts を参照）
+    starts = []
+    for _ in range(len(waiting) + 1):
+        available, index = timeline[0]
+        _, variance, quantile_start = seats[index]
+        n = sessions[index]
+        if n == 0:
+            starts.append(quantile_start)
+        else:
+            starts.append(max(0.0, available + z * math.sqrt(variance + n * duration_variance)))
+        sessions[index] += 1
+        heapq.heapreplace(timeline, (available + mean_duration, index))
+
+    waiting_numbers = [reservation["queue_number"] for reservation in waiting]
+    return Schedule(now, waiting_numbers, starts)
+
+
+class Scheduler:
+    """
+    キューの状態が変わったとき（または refresh_seconds 経過したとき）だけ
+    予想開始時刻の表を作り直す
+
+    estimator を指定すると、体験時間は実際の体験時間からの推定値を使う
+    """
+
+    def __init__(
+        self,
+        layout: SeatLayout,
+        duration_minutes: float,
+        refresh_seconds: float,
+        estimator: Optional[DurationEstimator] = None,
+    ):
+        self.layout = layout
+        self.duration_minutes = duration_minutes
+        self.refresh_seconds = refresh_seconds
+        self.estimator = estimator
+        # 分位点（None は平均）ごとの表
+        self._schedules: Dict[Optional[float], Schedule] = {}
+        self._version: Optional[tuple] = None
+        self._built_at = 0.0
+
+    def get(self, state: QueueState, q: Optional[float] = None) -> Schedule:
+        """
+        現在のキューに対応する予想開始時刻の表を返す
+
+        q: 待ち時間の分位点（0.5 なら P50、0.9 なら P90 の予想）。省略すると平均で予想する
+        """
+        version = (state.version, self.estimator.version if self.estimator else None)
+        if self._version != version or time.monotonic() - self._built_at > self.refresh_seconds:
+            self._schedules = {}
+            self._version = version
+            self._built_at = time.monotonic()
+
+        schedule = self._schedules.get(q)
+        if schedule is None:
+            if q is not None and self.estimator is not None:
+                # 分位点は、待っている人数分の体験時間の和の分布から求める
+                schedule = build_band_schedule(
+                    state.in_progress_list(),
+                    state.waiting_list(),
+                    self.layout,
+                    self.estimator,
+                    q,
+                )
+            else:
+                duration_minutes = self.duration_minutes
+                remaining = None
+                if self.estimator is not None:
+                    estimator = self.estimator
+                    duration_minutes = estimator.expected()
+                    remaining = estimator.remaining
+                schedule = build_schedule(
+                    state.in_progress_list(),
+                    state.waiting_list(),
+                    self.layout,
+                    duration_minutes,
+                    remaining=remaining,
+                )
+            self._schedules[q] = schedule
+        return schedule
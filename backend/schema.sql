@@ -1,4 +1,5 @@
 -- 予約管理テーブル
+-- このファイルは何度実行してもよい（既にある表・インデックス・ポリシーは作り直すか、そのままにする）
 CREATE TABLE IF NOT EXISTS reservations (
     id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
     queue_number SERIAL UNIQUE NOT NULL,
@@ -9,21 +10,471 @@ CREATE TABLE IF NOT EXISTS reservations (
     completed_at TIMESTAMP WITH TIME ZONE
 );
 
+-- 最終更新日時（管理画面の差分取得用）
+ALTER TABLE reservations ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW();
+
+-- 更新時に updated_at を現在時刻にする
+CREATE OR REPLACE FUNCTION set_reservation_updated_at()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    NEW.updated_at = NOW();
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS reservations_set_updated_at ON reservations;
+CREATE TRIGGER reservations_set_updated_at
+    BEFORE UPDATE ON reservations
+    FOR EACH ROW EXECUTE FUNCTION set_reservation_updated_at();
+
+-- 体験中の席番号（体験開始時に start_reservation で 1 〜 定員 の番号を割り当てる）
+ALTER TABLE reservations ADD COLUMN IF NOT EXISTS seat_number INTEGER;
+
+-- キュー（ブース）。1つのAPIで複数のブースの待ち行列を扱う
+-- capacity（席数）・duration_minutes（体験時間）・seat_names（カンマ区切りの席名）が
+-- NULL の場合は、APIの環境変数の設定を使う
+CREATE TABLE IF NOT EXISTS queues (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    capacity INTEGER CHECK (capacity > 0),
+    duration_minutes INTEGER CHECK (duration_minutes > 0),
+    seat_names TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- 既定のキュー（queue_id を指定しない場合）
+INSERT INTO queues (id, name) VALUES ('default', 'default') ON CONFLICT (id) DO NOTHING;
+
+ALTER TABLE queues ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Allow public read access" ON queues;
+CREATE POLICY "Allow public read access" ON queues
+    FOR SELECT USING (true);
+
+-- 管理者のみ作成・更新可能（実運用では認証を追加）
+DROP POLICY IF EXISTS "Allow public insert access" ON queues;
+CREATE POLICY "Allow public insert access" ON queues
+    FOR INSERT WITH CHECK (true);
+
+DROP POLICY IF EXISTS "Allow public update access" ON queues;
+CREATE POLICY "Allow public update access" ON queues
+    FOR UPDATE USING (true);
+
+-- 予約のキュー（既存の予約は既定のキューに入る）
+ALTER TABLE reservations ADD COLUMN IF NOT EXISTS queue_id TEXT NOT NULL DEFAULT 'default' REFERENCES queues(id);
+
 -- インデックス作成（パフォーマンス向上）
 CREATE INDEX IF NOT EXISTS idx_reservations_status ON reservations(status);
 CREATE INDEX IF NOT EXISTS idx_reservations_created_at ON reservations(created_at);
+CREATE INDEX IF NOT EXISTS idx_reservations_updated_at ON reservations(updated_at);
+
+-- キューごとの待機中・体験中の一覧を、他のキューの行を読まずにインデックスだけで絞り込む
+CREATE INDEX IF NOT EXISTS idx_reservations_queue_status ON reservations(queue_id, status, queue_number);
+
+-- 同じキューの体験中の予約同士で席番号が重複しないようにする（定員を超えて開始できない）
+CREATE UNIQUE INDEX IF NOT EXISTS idx_reservations_in_progress_queue_seat ON reservations(queue_id, seat_number)
+    WHERE status = 'in_progress';
+
+-- 体験中のセッションを開始時刻順に引くための部分インデックス（自動完了用）
+CREATE INDEX IF NOT EXISTS idx_reservations_in_progress_started_at ON reservations(started_at)
+    WHERE status = 'in_progress';
 
 -- Row Level Security (RLS) を有効化
 ALTER TABLE reservations ENABLE ROW LEVEL SECURITY;
 
 -- 全ユーザーが読み取り可能（待ち状況を見るため）
+DROP POLICY IF EXISTS "Allow public read access" ON reservations;
 CREATE POLICY "Allow public read access" ON reservations
     FOR SELECT USING (true);
 
 -- 全ユーザーが新規予約を作成可能
+DROP POLICY IF EXISTS "Allow public insert access" ON reservations;
 CREATE POLICY "Allow public insert access" ON reservations
     FOR INSERT WITH CHECK (true);
 
 -- 管理者のみ更新・削除可能（実運用では認証を追加）
+DROP POLICY IF EXISTS "Allow public update access" ON reservations;
 CREATE POLICY "Allow public update access" ON reservations
     FOR UPDATE USING (true);
+
+-- 体験時間を過ぎたセッションを全キューで一括で完了にし、完了した行を返す（自動完了用）
+-- 体験時間はキューごとの設定を使い、設定がない場合は p_duration_minutes を使う
+CREATE OR REPLACE FUNCTION complete_expired_reservations(p_duration_minutes INTEGER)
+RETURNS SETOF reservations
+LANGUAGE sql
+AS $$
+    UPDATE reservations r
+    SET status = 'completed',
+        completed_at = NOW()
+    FROM queues q
+    WHERE q.id = r.queue_id
+      AND r.status = 'in_progress'
+      AND r.started_at <= NOW() - make_interval(mins => COALESCE(q.duration_minutes, p_duration_minutes))
+    RETURNING r.*;
+$$;
+
+-- 終了した予約の履歴
+-- 前日以前に完了・キャンセルになった予約は archive_finished_reservations で reservations から移し、
+-- 待機中・体験中の予約を引くテーブルを小さく保つ
+CREATE TABLE IF NOT EXISTS reservations_history (
+    id UUID PRIMARY KEY,
+    queue_number INTEGER UNIQUE NOT NULL,
+    queue_id TEXT NOT NULL DEFAULT 'default',
+    name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE,
+    started_at TIMESTAMP WITH TIME ZONE,
+    completed_at TIMESTAMP WITH TIME ZONE,
+    updated_at TIMESTAMP WITH TIME ZONE,
+    seat_number INTEGER,
+    archived_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_reservations_history_queue ON reservations_history(queue_id, queue_number);
+CREATE INDEX IF NOT EXISTS idx_reservations_history_created_at ON reservations_history(created_at);
+
+-- 移す対象（完了・キャンセル済みの予約）を終了日時順に引くための部分インデックス
+CREATE INDEX IF NOT EXISTS idx_reservations_finished_completed_at ON reservations(completed_at)
+    WHERE status IN ('completed', 'cancelled');
+
+ALTER TABLE reservations_history ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Allow public read access" ON reservations_history;
+CREATE POLICY "Allow public read access" ON reservations_history
+    FOR SELECT USING (true);
+
+-- キュー・ステータスごとの件数（トリガーで更新し、統計情報の取得時に全件を数えないようにする）
+-- 件数は履歴に移した予約を含めた累計
+CREATE TABLE IF NOT EXISTS reservation_status_counts (
+    queue_id TEXT NOT NULL DEFAULT 'default',
+    status TEXT NOT NULL,
+    count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (queue_id, status)
+);
+
+-- キュー・日ごとの完了件数（completed_at の UTC 日付で集計）
+CREATE TABLE IF NOT EXISTS reservation_daily_completions (
+    queue_id TEXT NOT NULL DEFAULT 'default',
+    day DATE NOT NULL,
+    count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (queue_id, day)
+);
+
+ALTER TABLE reservation_status_counts ENABLE ROW LEVEL SECURITY;
+ALTER TABLE reservation_daily_completions ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Allow public read access" ON reservation_status_counts;
+CREATE POLICY "Allow public read access" ON reservation_status_counts
+    FOR SELECT USING (true);
+
+DROP POLICY IF EXISTS "Allow public read access" ON reservation_daily_completions;
+CREATE POLICY "Allow public read access" ON reservation_daily_completions
+    FOR SELECT USING (true);
+
+-- 予約の追加・変更・削除に合わせて件数を更新する
+CREATE OR REPLACE FUNCTION update_reservation_counts()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+BEGIN
+    -- 履歴への移動（archive_finished_reservations）では件数を減らさない
+    IF TG_OP = 'DELETE' AND current_setting('reservations.archiving', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE reservation_status_counts
+        SET count = count - 1
+        WHERE queue_id = OLD.queue_id AND status = OLD.status;
+
+        IF OLD.status = 'completed' AND OLD.completed_at IS NOT NULL THEN
+            UPDATE reservation_daily_completions
+            SET count = count - 1
+            WHERE queue_id = OLD.queue_id AND day = (OLD.completed_at AT TIME ZONE 'UTC')::date;
+        END IF;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO reservation_status_counts (queue_id, status, count)
+        VALUES (NEW.queue_id, NEW.status, 1)
+        ON CONFLICT (queue_id, status) DO UPDATE SET count = reservation_status_counts.count + 1;
+
+        IF NEW.status = 'completed' AND NEW.completed_at IS NOT NULL THEN
+            INSERT INTO reservation_daily_completions (queue_id, day, count)
+            VALUES (NEW.queue_id, (NEW.completed_at AT TIME ZONE 'UTC')::date, 1)
+            ON CONFLICT (queue_id, day) DO UPDATE SET count = reservation_daily_completions.count + 1;
+        END IF;
+    END IF;
+
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS reservations_update_counts ON reservations;
+CREATE TRIGGER reservations_update_counts
+    AFTER INSERT OR UPDATE OF status, completed_at, queue_id OR DELETE ON reservations
+    FOR EACH ROW EXECUTE FUNCTION update_reservation_counts();
+
+-- 既存データ（履歴を含む）から件数を作成（既に件数がある場合は数え直す）
+DELETE FROM reservation_status_counts;
+INSERT INTO reservation_status_counts (queue_id, status, count)
+SELECT queue_id, status, COUNT(*)
+FROM (
+    SELECT queue_id, status FROM reservations
+    UNION ALL
+    SELECT queue_id, status FROM reservations_history
+) AS all_reservations
+GROUP BY queue_id, status;
+
+DELETE FROM reservation_daily_completions;
+INSERT INTO reservation_daily_completions (queue_id, day, count)
+SELECT queue_id, (completed_at AT TIME ZONE 'UTC')::date, COUNT(*)
+FROM (
+    SELECT queue_id, status, completed_at FROM reservations
+    UNION ALL
+    SELECT queue_id, status, completed_at FROM reservations_history
+) AS all_reservations
+WHERE status = 'completed' AND completed_at IS NOT NULL
+GROUP BY 1, 2;
+
+-- p_before より前に完了・キャンセルになった予約を最大 p_limit 件、履歴に移す（移した件数を返す）
+-- 件数の集計（reservation_status_counts・reservation_daily_completions）は変わらない
+CREATE OR REPLACE FUNCTION archive_finished_reservations(p_before TIMESTAMP WITH TIME ZONE, p_limit INTEGER)
+RETURNS INTEGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    v_count INTEGER;
+BEGIN
+    -- このトランザクションの間だけ、件数を更新するトリガーに削除を無視させる
+    PERFORM set_config('reservations.archiving', 'on', true);
+
+    WITH moved AS (
+        DELETE FROM reservations
+        WHERE queue_number IN (
+            SELECT queue_number FROM reservations
+            WHERE status IN ('completed', 'cancelled')
+              AND completed_at < p_before
+            ORDER BY completed_at
+            LIMIT p_limit
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING *
+    )
+    INSERT INTO reservations_history (
+        id, queue_number, queue_id, name, status,
+        created_at, started_at, completed_at, updated_at, seat_number
+    )
+    SELECT
+        id, queue_number, queue_id, name, status,
+        created_at, started_at, completed_at, updated_at, seat_number
+    FROM moved;
+
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+
+    PERFORM set_config('reservations.archiving', 'off', true);
+    RETURN v_count;
+END;
+$$;
+
+-- 統計情報用の件数を1行で返す（キューごと）
+CREATE OR REPLACE FUNCTION reservation_stats(p_today DATE, p_queue_id TEXT DEFAULT 'default')
+RETURNS TABLE (
+    waiting_count BIGINT,
+    in_progress_count BIGINT,
+    completed_count BIGINT,
+    today_completed_count BIGINT
+)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT
+        COALESCE(SUM(count) FILTER (WHERE status = 'waiting'), 0)::BIGINT,
+        COALESCE(SUM(count) FILTER (WHERE status = 'in_progress'), 0)::BIGINT,
+        COALESCE(SUM(count) FILTER (WHERE status = 'completed'), 0)::BIGINT,
+        COALESCE((
+            SELECT count FROM reservation_daily_completions
+            WHERE queue_id = p_queue_id AND day = p_today
+        ), 0)::BIGINT
+    FROM reservation_status_counts
+    WHERE queue_id = p_queue_id;
+$$;
+
+-- 体験を開始する（状態の確認・席の割り当て・更新を1つのトランザクションで行う）
+-- p_capacity はその予約のキューの席数。席数の確認と席の割り当てはキューごとに行う
+-- 待機中でない場合は invalid_transition、空席がない場合は capacity_full、
+-- 予約がない場合は reservation_not_found の例外を返す
+CREATE OR REPLACE FUNCTION start_reservation(p_queue_number INTEGER, p_capacity INTEGER)
+RETURNS SETOF reservations
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_status TEXT;
+    v_queue_id TEXT;
+    v_in_progress_count INTEGER;
+    v_seat INTEGER;
+BEGIN
+    -- 同じ予約への同時操作はここで待たせる
+    SELECT status, queue_id INTO v_status, v_queue_id
+    FROM reservations
+    WHERE queue_number = p_queue_number
+    FOR UPDATE;
+
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'reservation_not_found';
+    END IF;
+
+    IF v_status <> 'waiting' THEN
+        RAISE EXCEPTION 'invalid_transition' USING DETAIL = v_status;
+    END IF;
+
+    LOOP
+        SELECT COUNT(*) INTO v_in_progress_count
+        FROM reservations
+        WHERE queue_id = v_queue_id AND status = 'in_progress';
+
+        IF v_in_progress_count >= p_capacity THEN
+            RAISE EXCEPTION 'capacity_full' USING DETAIL = v_in_progress_count::TEXT;
+        END IF;
+
+        -- 空いている席のうち番号が最も小さいもの
+        SELECT seat INTO v_seat
+        FROM generate_series(1, p_capacity) AS seat
+        WHERE NOT EXISTS (
+            SELECT 1 FROM reservations
+            WHERE queue_id = v_queue_id AND status = 'in_progress' AND seat_number = seat
+        )
+        ORDER BY seat
+        LIMIT 1;
+
+        IF v_seat IS NULL THEN
+            RAISE EXCEPTION 'capacity_full' USING DETAIL = v_in_progress_count::TEXT;
+        END IF;
+
+        BEGIN
+            RETURN QUERY
+            UPDATE reservations
+            SET status = 'in_progress',
+                started_at = NOW(),
+                seat_number = v_seat
+            WHERE queue_number = p_queue_number
+            RETURNING *;
+            RETURN;
+        EXCEPTION WHEN unique_violation THEN
+            -- 別の開始操作が同じ席を先に確保した場合は、空席を探し直す
+        END;
+    END LOOP;
+END;
+$$;
+
+-- 複数の予約のステータスをまとめて変更する（受付端末からの一括操作用）
+-- p_changes は [{"queue_number": 1, "status": "completed"}, ...]。1件ごとの結果を返し、
+-- 失敗した変更（error_code が reservation_not_found / invalid_transition / capacity_full）があっても他の変更は行う。
+-- 完了・キャンセルなどを先に1つの UPDATE で行い、空いた席を同じ一括変更の体験開始に使う。
+-- 体験開始は start_reservation で行い、席数はキューの設定（設定がない場合は p_default_capacity）を使う
+CREATE OR REPLACE FUNCTION update_reservation_statuses(p_changes JSONB, p_default_capacity INTEGER)
+RETURNS TABLE(item_index INTEGER, error_code TEXT, error_detail TEXT, item_capacity INTEGER, row_data JSONB)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_change RECORD;
+    v_row reservations;
+BEGIN
+    RETURN QUERY
+    WITH changes AS (
+        SELECT (c.ordinality - 1)::INTEGER AS idx,
+               (c.value->>'queue_number')::INTEGER AS queue_number,
+               c.value->>'status' AS status
+        FROM jsonb_array_elements(p_changes) WITH ORDINALITY AS c(value, ordinality)
+        WHERE c.value->>'status' <> 'in_progress'
+    ),
+    updated AS (
+        UPDATE reservations r
+        SET status = changes.status,
+            completed_at = CASE WHEN changes.status IN ('completed', 'cancelled') THEN NOW() ELSE r.completed_at END
+        FROM changes
+        WHERE r.queue_number = changes.queue_number
+        RETURNING changes.idx, r.*
+    )
+    SELECT changes.idx,
+           CASE WHEN updated.idx IS NULL THEN 'reservation_not_found' END,
+           NULL::TEXT,
+           NULL::INTEGER,
+           CASE WHEN updated.idx IS NOT NULL THEN to_jsonb(updated) - 'idx' END
+    FROM changes
+    LEFT JOIN updated ON updated.idx = changes.idx;
+
+    FOR v_change IN
+        SELECT (c.ordinality - 1)::INTEGER AS idx,
+               (c.value->>'queue_number')::INTEGER AS queue_number
+        FROM jsonb_array_elements(p_changes) WITH ORDINALITY AS c(value, ordinality)
+        WHERE c.value->>'status' = 'in_progress'
+        ORDER BY c.ordinality
+    LOOP
+        item_index := v_change.idx;
+        item_capacity := NULL;
+        SELECT COALESCE(q.capacity, p_default_capacity) INTO item_capacity
+        FROM reservations r
+        LEFT JOIN queues q ON q.id = r.queue_id
+        WHERE r.queue_number = v_change.queue_number;
+
+        BEGIN
+            SELECT * INTO STRICT v_row FROM start_reservation(v_change.queue_number, COALESCE(item_capacity, p_default_capacity));
+            error_code := NULL;
+            error_detail := NULL;
+            row_data := to_jsonb(v_row);
+        EXCEPTION WHEN raise_exception OR no_data_found THEN
+            GET STACKED DIAGNOSTICS error_code = MESSAGE_TEXT, error_detail = PG_EXCEPTION_DETAIL;
+            row_data := NULL;
+        END;
+        RETURN NEXT;
+    END LOOP;
+END;
+$$;
+
+-- バックグラウンド処理の担当（リース）
+-- 複数のワーカー・サーバーで動かす場合に、自動完了などを1台だけが実行するようにする
+CREATE TABLE IF NOT EXISTS worker_leases (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+-- 直接の読み書きはさせず、下の関数からのみ操作する
+ALTER TABLE worker_leases ENABLE ROW LEVEL SECURITY;
+
+-- リースを取得・更新する（取得できた場合は TRUE）
+-- 誰も持っていないか、期限が切れているか、既に自分が持っている場合に取得できる
+CREATE OR REPLACE FUNCTION acquire_lease(p_name TEXT, p_holder TEXT, p_ttl_seconds INTEGER)
+RETURNS BOOLEAN
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    v_holder TEXT;
+BEGIN
+    INSERT INTO worker_leases (name, holder, expires_at)
+    VALUES (p_name, p_holder, NOW() + make_interval(secs => p_ttl_seconds))
+    ON CONFLICT (name) DO UPDATE
+    SET holder = EXCLUDED.holder,
+        expires_at = EXCLUDED.expires_at
+    WHERE worker_leases.holder = EXCLUDED.holder
+       OR worker_leases.expires_at < NOW()
+    RETURNING holder INTO v_holder;
+
+    RETURN v_holder IS NOT NULL;
+END;
+$$;
+
+-- リースを手放す（停止時。次のワーカーが期限切れを待たずに引き継げる）
+CREATE OR REPLACE FUNCTION release_lease(p_name TEXT, p_holder TEXT)
+RETURNS VOID
+LANGUAGE sql
+SECURITY DEFINER
+AS $$
+    DELETE FROM worker_leases WHERE name = p_name AND holder = p_holder;
+$$;
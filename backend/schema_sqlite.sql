@@ -0,0 +1,81 @@
+-- ローカル実行用（STORAGE_BACKEND=sqlite）の予約管理テーブル
+-- schema.sql の queues・reservations テーブルと同じカラムを持つ。起動時に自動で作成される
+
+-- キュー（ブース）ごとの設定（値が NULL の項目は環境変数の設定を使う）
+CREATE TABLE IF NOT EXISTS queues (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    capacity INTEGER CHECK (capacity > 0),
+    duration_minutes INTEGER CHECK (duration_minutes > 0),
+    seat_names TEXT,
+    created_at TEXT NOT NULL
+);
+
+INSERT OR IGNORE INTO queues (id, name, created_at) VALUES ('default', 'default', strftime('%Y-%m-%dT%H:%M:%fZ', 'now'));
+
+CREATE TABLE IF NOT EXISTS reservations (
+    queue_number INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    queue_id TEXT NOT NULL DEFAULT 'default',
+    name TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'waiting' CHECK (status IN ('waiting', 'in_progress', 'completed', 'cancelled')),
+    created_at TEXT NOT NULL,
+    started_at TEXT,
+    completed_at TEXT,
+    updated_at TEXT NOT NULL,
+    seat_number INTEGER
+);
+
+-- インデックス作成（パフォーマンス向上）
+CREATE INDEX IF NOT EXISTS idx_reservations_status ON reservations(status, queue_number);
+-- キューごとの一覧・件数はキューの中だけを引く
+CREATE INDEX IF NOT EXISTS idx_reservations_queue_status ON reservations(queue_id, status, queue_number);
+CREATE INDEX IF NOT EXISTS idx_reservations_queue_status_completed_at ON reservations(queue_id, status, completed_at);
+CREATE INDEX IF NOT EXISTS idx_reservations_created_at ON reservations(created_at);
+CREATE INDEX IF NOT EXISTS idx_reservations_updated_at ON reservations(updated_at);
+
+-- 同じキューの体験中の予約同士で席番号が重複しないようにする
+CREATE UNIQUE INDEX IF NOT EXISTS idx_reservations_in_progress_queue_seat ON reservations(queue_id, seat_number)
+    WHERE status = 'in_progress';
+
+-- 体験中のセッションを開始時刻順に引くための部分インデックス（自動完了用）
+CREATE INDEX IF NOT EXISTS idx_reservations_in_progress_started_at ON reservations(started_at)
+    WHERE status = 'in_progress';
+
+-- 終了した予約の履歴（前日以前に完了・キャンセルになった予約を reservations から移す）
+CREATE TABLE IF NOT EXISTS reservations_history (
+    queue_number INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    queue_id TEXT NOT NULL DEFAULT 'default',
+    name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    started_at TEXT,
+    completed_at TEXT,
+    updated_at TEXT NOT NULL,
+    seat_number INTEGER,
+    archived_at TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_reservations_history_queue ON reservations_history(queue_id, queue_number);
+CREATE INDEX IF NOT EXISTS idx_reservations_history_created_at ON reservations_history(created_at);
+
+-- 移す対象（完了・キャンセル済みの予約）を終了日時順に引くための部分インデックス
+CREATE INDEX IF NOT EXISTS idx_reservations_finished_completed_at ON reservations(completed_at)
+    WHERE status IN ('completed', 'cancelled');
+
+-- 履歴に移した予約の、キュー・日ごとの完了件数（completed_at の UTC 日付）
+-- 完了件数は reservations の件数とこの件数の合計になる
+CREATE TABLE IF NOT EXISTS archived_daily_completions (
+    queue_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (queue_id, day)
+);
+
+-- バックグラウンド処理の担当（リース）。同じファイルを使う複数のプロセスで1つだけが自動完了を行う
+CREATE TABLE IF NOT EXISTS worker_leases (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires_at TEXT NOT NULL
+);
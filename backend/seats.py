@@ -0,0 +1,95 @@
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from queue_state import elapsed_minutes
+
+
+def seat_label(seat_number: int) -> str:
+    """
+    席番号（1始まり）から席名を作る（A席, B席, ..., Z席, AA席, ...）
+    """
+    letters = ""
+    n = seat_number
+    while n > 0:
+        n, r = divmod(n - 1, 26)
+        letters = chr(ord("A") + r) + letters
+    return f"{letters}席"
+
+
+class SeatLayout:
+    """
+    席の構成（席数と席名）
+
+    体験中の予約は seat_number で席に紐づくため、
+    誰かの体験が終わっても他の人の席名は変わらない
+    """
+
+    def __init__(self, count: int, names: Optional[List[str]] = None):
+        self.count = count
+        self._names = names or []
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._names)
+
+    def name(self, seat_number: int) -> str:
+        """
+        席番号から席名を返す
+        """
+        if seat_number <= len(self._names):
+            return self._names[seat_number - 1]
+        return seat_label(seat_number)
+
+    def occupancy(self, in_progress: List[dict]) -> Dict[int, dict]:
+        """
+        席番号 → 体験中の予約 の対応を返す
+
+        席番号が割り当てられていない予約（席番号の導入前に開始したもの）は、
+        予約番号順に空いている席へ割り当てる。席数を超えた分も
+        席数より後ろの番号に割り当て、表示から漏れないようにする
+        """
+        seats: Dict[int, dict] = {}
+        unassigned = []
+        for reservation in in_progress:
+            seat_number = reservation.get("seat_number")
+            if seat_number and seat_number not in seats:
+                seats[seat_number] = reservation
+            else:
+                unassigned.append(reservation)
+
+        seat_number = 1
+        for reservation in sorted(unassigned, key=lambda r: r["queue_number"]):
+            while seat_number in seats:
+                seat_number += 1
+            seats[seat_number] = reservation
+
+        return dict(sorted(seats.items()))
+
+    def available_minutes(
+        self,
+        in_progress: List[dict],
+        duration_minutes: float,
+        now: datetime,
+        remaining: Optional[Callable[[float], float]] = None,
+    ) -> List[float]:
+        """
+        各席が空くまでの時間（分）を席番号順に返す（空席は 0）
+
+        remaining: 経過時間（分）から残り時間（分）を求める関数（省略時は duration_minutes - 経過時間）
+        """
+        occupancy = self.occupancy(in_progress)
+        result = []
+        for seat_number in range(1, self.count + 1):
+            reservation = occupancy.get(seat_number)
+            if reservation is None:
+                result.append(0)
+                continue
+            elapsed = elapsed_minutes(reservation, now)
+            if elapsed is None:
+                # 開始時刻が不明な場合は体験時間そのものを残り時間とする
+                result.append(duration_minutes)
+            elif remaining is not None:
+                result.append(remaining(elapsed))
+            else:
+                result.append(max(0, duration_minutes - elapsed))
+        return result
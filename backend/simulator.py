@@ -0,0 +1,287 @@
+"""
+待ち行列のシミュレーション（席数・体験時間・来場ペースを変えた場合の予測）
+
+現在（または指定した）待ち行列の状況から、席数・1人あたりの体験時間・1時間あたりの来場者数の
+組み合わせごとに、先着順で空いた席に案内する待ち行列を何千回もモンテカルロ法で再現し、
+待ち時間の分布と処理人数を返す。全シナリオ・全試行を1つの NumPy 配列にまとめ、
+1人ずつ案内する処理を全試行で同時に進める
+
+使い方:
+    python simulator.py --waiting 30 --in-progress 2,5,9 --seats 3,4 --durations 10,8 --arrivals 20,30
+    python simulator.py --waiting 30 --seats 3,4 --json
+"""
+import argparse
+import itertools
+import json
+import math
+import time
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+# 体験時間の実績がない場合に使う、体験時間のばらつき（標準偏差 / 平均）
+DEFAULT_DURATION_CV = 0.25
+
+# 1回のシミュレーションで扱う試行数（シナリオ数 × 試行回数）の上限
+MAX_SIMULATION_ROWS = 200_000
+
+# 1回のシミュレーションで扱う 人数 × 試行数 の上限（配列の大きさと計算時間を決める）
+# float32 の (人, 試行) の配列1つが約32MB になり、同時に持つのは3つ程度
+MAX_SIMULATION_CELLS = 8_000_000
+
+# 1人を案内するたびに席数回の演算を全試行に行うため、人数 × 席数 ×（試行数 + 1回の演算の
+# 固定の手間を試行数に換算したもの）で計算時間を抑える（この上限でおおむね0.5秒以内）
+MAX_SIMULATION_WORK = 150_000_000
+OPERATION_OVERHEAD_ROWS = 500
+
+# 入力の上限
+MAX_WAITING_COUNT = 2000
+MAX_SEAT_COUNT = 50
+MAX_ARRIVALS_PER_HOUR = 600
+MAX_HORIZON_MINUTES = 12 * 60
+
+
+def arrival_capacity(arrivals_per_hour: float, horizon_minutes: float) -> int:
+    """
+    horizon_minutes 分の間に来る人数として用意する人数（ほぼ確実に足りる数）
+    """
+    expected = arrivals_per_hour / 60 * horizon_minutes
+    if expected <= 0:
+        return 0
+    return int(math.ceil(expected + 5 * math.sqrt(expected) + 5))
+
+
+def validate(
+    waiting_count: int,
+    in_progress_remaining: Sequence[float],
+    seat_counts: Sequence[int],
+    durations: Sequence[float],
+    arrivals_per_hour: Sequence[float],
+    horizon_minutes: float,
+    runs: int,
+) -> None:
+    """
+    入力を確認する（不正な場合は ValueError）
+    """
+    if not 0 <= waiting_count <= MAX_WAITING_COUNT:
+        raise ValueError(f"待機人数は0〜{MAX_WAITING_COUNT}人で指定してください")
+    if len(in_progress_remaining) > MAX_SEAT_COUNT:
+        raise ValueError(f"体験中の人数は{MAX_SEAT_COUNT}人以下にしてください")
+    if any(r < 0 for r in in_progress_remaining):
+        raise ValueError("体験中の残り時間は0以上を指定してください")
+    if not seat_counts or any(not 1 <= c <= MAX_SEAT_COUNT for c in seat_counts):
+        raise ValueError(f"席数は1〜{MAX_SEAT_COUNT}で指定してください")
+    if not durations or any(d <= 0 for d in durations):
+        raise ValueError("体験時間は0より大きい値を指定してください")
+    if not arrivals_per_hour or any(not 0 <= a <= MAX_ARRIVALS_PER_HOUR for a in arrivals_per_hour):
+        raise ValueError(f"来場者数は0〜{MAX_ARRIVALS_PER_HOUR}人/時で指定してください")
+    if not 0 < horizon_minutes <= MAX_HORIZON_MINUTES:
+        raise ValueError(f"シミュレーションする時間は{MAX_HORIZON_MINUTES}分以下の正の値を指定してください")
+    if runs < 1:
+        raise ValueError("試行回数は1以上を指定してください")
+    scenario_count = len(seat_counts) * len(durations) * len(arrivals_per_hour)
+    rows = scenario_count * runs
+    if rows > MAX_SIMULATION_ROWS:
+        raise ValueError(f"シナリオ数 × 試行回数は {MAX_SIMULATION_ROWS} 以下にしてください")
+    customers = waiting_count + arrival_capacity(max(arrivals_per_hour), horizon_minutes)
+    if max(customers, max(seat_counts)) * rows > MAX_SIMULATION_CELLS:
+        raise ValueError(
+            f"人数（待機人数 + 時間内の来場者数）× シナリオ数 × 試行回数は {MAX_SIMULATION_CELLS} 以下にしてください"
+            "（試行回数を減らしてください）"
+        )
+    if customers * max(seat_counts) * (rows + OPERATION_OVERHEAD_ROWS) > MAX_SIMULATION_WORK:
+        raise ValueError(
+            "計算量が多すぎます（待機人数・シミュレーションする時間・来場者数・席数・試行回数を減らしてください）"
+        )
+
+
+def _summary(values: np.ndarray) -> dict:
+    if values.size == 0:
+        return {"mean": None, "p50": None, "p90": None}
+    p50, p90 = np.percentile(values, [50, 90])
+    return {
+        "mean": round(float(values.mean()), 1),
+        "p50": round(float(p50), 1),
+        "p90": round(float(p90), 1),
+    }
+
+
+def simulate(
+    waiting_count: int,
+    in_progress_remaining: Sequence[float],
+    seat_counts: Sequence[int],
+    durations: Sequence[float],
+    arrivals_per_hour: Sequence[float],
+    horizon_minutes: float,
+    runs: int,
+    duration_samples: Sequence[float] = (),
+    seed: Optional[int] = None,
+) -> List[dict]:
+    """
+    席数 × 体験時間 × 来場者数 の全ての組み合わせ（シナリオ）をシミュレーションする
+
+    waiting_count: 現在の待機人数（全員が今から並んでいるものとする）
+    in_progress_remaining: 体験中の人の残り時間（分）。席数が少ないシナリオでは早く終わる人から席に割り当てる
+    durations: 1人あたりの平均体験時間（分）。体験中の人の残り時間には影響しない
+    duration_samples: 実際の体験時間（分）。指定すると平均を durations に合わせて伸縮したものから
+        ばらつきを再現し、空の場合はばらつき DEFAULT_DURATION_CV の対数正規分布を使う
+
+    シナリオごとに、今並んでいる人が全員案内されるまでの時間・新しく来た人の待ち時間・
+    horizon_minutes 後の待機人数・1時間あたりの処理人数を返す
+    """
+    validate(waiting_count, in_progress_remaining, seat_counts, durations, arrivals_per_hour, horizon_minutes, runs)
+
+    rng = np.random.default_rng(seed)
+    scenarios = list(itertools.product(seat_counts, durations, arrivals_per_hour))
+    rows = len(scenarios) * runs
+
+    # 試行（行）ごとのシナリオの値
+    seats = np.repeat([s[0] for s in scenarios], runs)
+    mean_duration = np.repeat([float(s[1]) for s in scenarios], runs)
+    rate = np.repeat([s[2] / 60 for s in scenarios], runs)  # 1分あたり
+
+    # 各席が空く時刻（席数が少ないシナリオでは、使わない席を無限大にして割り当てない）
+    max_seats = max(seat_counts)
+    occupied = np.sort(np.asarray(in_progress_remaining, dtype=float))[:max_seats]
+    seat_free = np.zeros((rows, max_seats), dtype=np.float32)
+    seat_free[:, :len(occupied)] = occupied
+    seat_free[np.arange(max_seats)[None, :] >= seats[:, None]] = np.inf
+    # 体験中の人のうち、時間内に終わる人数（席に割り当てた人だけ）
+    finished_prefix = np.concatenate([[0], np.cumsum(occupied <= horizon_minutes)])
+    initial_completions = finished_prefix[np.minimum(seats, len(occupied))]
+
+    # 到着時刻（今並んでいる人は 0、新しく来る人はポアソン到着）
+    # 配列は (人, 試行) の順に持ち、1人分の処理で連続したメモリを読むようにする（すべて float32）
+    arrival_count = arrival_capacity(max(arrivals_per_hour), horizon_minutes)
+    with np.errstate(divide="ignore"):
+        gaps = rng.standard_exponential((arrival_count, rows), dtype=np.float32)
+        gaps /= rate[None, :].astype(np.float32)
+    new_arrivals = np.cumsum(gaps, axis=0)
+    del gaps
+    # どの試行でも時間外に来る人は結果に影響しない（先着順のため前の人の案内も変わらない）ので除く
+    arrival_count = int((new_arrivals.min(axis=1) <= horizon_minutes).sum()) if arrival_count else 0
+    arrival = np.concatenate(
+        [np.zeros((waiting_count, rows), dtype=np.float32), new_arrivals[:arrival_count]], axis=0
+    )
+    del new_arrivals
+    customers = arrival.shape[0]
+
+    # 体験時間
+    samples = np.asarray(duration_samples, dtype=float)
+    scale = mean_duration[None, :].astype(np.float32)
+    if samples.size >= 2 and samples.mean() > 0:
+        ratios = (samples / samples.mean()).astype(np.float32)
+        service = ratios[rng.integers(0, samples.size, size=(customers, rows))]
+    else:
+        sigma2 = math.log(1 + DEFAULT_DURATION_CV ** 2)
+        service = rng.standard_normal((customers, rows), dtype=np.float32)
+        service *= math.sqrt(sigma2)
+        service -= sigma2 / 2
+        np.exp(service, out=service)
+    service *= scale
+
+    # 先着順に、一番早く空く席へ案内する（全試行で同時に1人ずつ進める）
+    # 各試行の席が空く時刻を昇順に並べた (席, 試行) の配列で持ち、先頭の席に案内して
+    # 空く時刻を並び順の位置に差し込む（席の番号は結果に影響しないため、argmin や
+    # 添字での読み書きをせず、席数回の要素ごとの演算だけで済む）
+    free = np.ascontiguousarray(np.sort(seat_free, axis=1).T)
+    del seat_free
+    start = np.empty((customers, rows), dtype=np.float32)
+    ends = np.empty(rows, dtype=np.float32)
+    scratch = np.empty(rows, dtype=np.float32)
+    for k in range(customers):
+        np.maximum(arrival[k], free[0], out=start[k])
+        np.add(start[k], service[k], out=ends)
+        if max_seats == 1:
+            free[0] = ends
+            continue
+        # free[1:] に ends を差し込んだ結果を free に前から書き込む
+        np.minimum(ends, free[1], out=free[0])
+        for j in range(1, max_seats - 1):
+            np.maximum(free[j], ends, out=scratch)
+            np.minimum(scratch, free[j + 1], out=free[j])
+        np.maximum(free[max_seats - 1], ends, out=free[max_seats - 1])
+
+    # 集計（大きな配列は作り足さず、使い終わった配列を上書きして使う）
+    clear_all = start[waiting_count - 1].copy() if waiting_count else None
+    arrived = arrival <= horizon_minutes
+    queue_length = (arrived & (start > horizon_minutes)).sum(axis=0)
+    ends = np.add(service, start, out=service)
+    finished = (ends <= horizon_minutes) & arrived
+    throughput = (finished.sum(axis=0) + initial_completions) / horizon_minutes * 60
+    del service, ends, finished
+    waits = np.subtract(start, arrival, out=start)
+    del arrival
+
+    results = []
+    for i, (seat_count, duration, arrivals) in enumerate(scenarios):
+        block = slice(i * runs, (i + 1) * runs)
+        new_waits = waits[waiting_count:, block][arrived[waiting_count:, block]]
+        clear = clear_all[block] if waiting_count else np.empty(0)
+        results.append({
+            "seat_count": int(seat_count),
+            "duration_minutes": float(duration),
+            "arrivals_per_hour": float(arrivals),
+            "queue_clear_minutes": _summary(clear),
+            "new_arrival_wait_minutes": _summary(new_waits),
+            "queue_length_at_end": round(float(queue_length[block].mean()), 1),
+            "throughput_per_hour": round(float(throughput[block].mean()), 1),
+        })
+    return results
+
+
+def parse_list(value: str, cast):
+    return [cast(item) for item in value.split(",") if item.strip()]
+
+
+def print_report(results: List[dict], seconds: float) -> None:
+    print(f"{'席数':>4}{'体験(分)':>10}{'来場/時':>9}{'全員案内(分) 平均/P90':>24}"
+          f"{'新規の待ち(分) 平均/P90':>26}{'終了時の待機':>14}{'処理/時':>9}")
+    for r in results:
+        clear = r["queue_clear_minutes"]
+        wait = r["new_arrival_wait_minutes"]
+        print(f"{r['seat_count']:>4}{r['duration_minutes']:>10}{r['arrivals_per_hour']:>9}"
+              f"{str(clear['mean']) + ' / ' + str(clear['p90']):>24}"
+              f"{str(wait['mean']) + ' / ' + str(wait['p90']):>26}"
+              f"{r['queue_length_at_end']:>14}{r['throughput_per_hour']:>9}")
+    print()
+    print(f"計算時間: {seconds * 1000:.0f}ms")
+
+
+def main_cli(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="席数・体験時間・来場ペースを変えた場合の待ち行列のシミュレーション")
+    parser.add_argument("--waiting", type=int, default=0, help="現在の待機人数")
+    parser.add_argument("--in-progress", default="", help="体験中の人の残り時間（分、カンマ区切り）")
+    parser.add_argument("--seats", default="3", help="席数（カンマ区切りで複数指定）")
+    parser.add_argument("--durations", default="10", help="1人あたりの体験時間（分、カンマ区切り）")
+    parser.add_argument("--arrivals", default="0", help="1時間あたりの来場者数（カンマ区切り）")
+    parser.add_argument("--horizon", type=float, default=120, help="シミュレーションする時間（分）")
+    parser.add_argument("--runs", type=int, default=1000, help="シナリオごとの試行回数")
+    parser.add_argument("--seed", type=int, help="乱数のシード")
+    parser.add_argument("--json", action="store_true", help="結果を JSON で出力する")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    try:
+        results = simulate(
+            args.waiting,
+            parse_list(args.in_progress, float),
+            parse_list(args.seats, int),
+            parse_list(args.durations, float),
+            parse_list(args.arrivals, float),
+            args.horizon,
+            args.runs,
+            seed=args.seed,
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    seconds = time.perf_counter() - started
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print_report(results, seconds)
+
+
+if __name__ == "__main__":
+    main_cli()
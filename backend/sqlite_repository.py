@@ -0,0 +1,511 @@
+import asyncio
+import sqlite3
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+from queue_state import parse_timestamp
+from repository import (
+    QUEUE_COLUMNS,
+    RESERVATION_COLUMNS,
+    CapacityFull,
+    InvalidTransition,
+    ReservationNotFound,
+    ReservationRepository,
+    to_utc_iso,
+)
+
+SCHEMA_PATH = Path(__file__).with_name("schema_sqlite.sql")
+
+SELECT_RESERVATION = f"SELECT {RESERVATION_COLUMNS} FROM reservations"
+
+SELECT_QUEUE = f"SELECT {QUEUE_COLUMNS} FROM queues"
+
+SELECT_ARCHIVED = f"SELECT {RESERVATION_COLUMNS} FROM reservations_history"
+
+
+def now_iso() -> str:
+    return to_utc_iso(datetime.now(timezone.utc))
+
+
+class SQLiteRepository(ReservationRepository):
+    """
+    ローカルの SQLite ファイル上の reservations テーブル（会場のネットワークが不安定な場合用）
+
+    接続は1つだけ持ち、専用のスレッドで順番に実行する（イベントループを止めない）。
+    SQL は固定の文字列を使うため、sqlite3 モジュールのステートメントキャッシュで
+    コンパイル済みのものが再利用される
+    """
+
+    backend = "sqlite"
+    OPERATION_TABLES = {
+        "get_archived": "reservations_history",
+        "list_archived": "reservations_history",
+        "get_queue": "queues",
+        "list_queues": "queues",
+        "save_queue": "queues",
+        "acquire_lease": "worker_leases",
+        "release_lease": "worker_leases",
+    }
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def _connect(self) -> None:
+        conn = sqlite3.connect(
+            self.path,
+            check_same_thread=False,
+            isolation_level=None,  # トランザクションは BEGIN で明示的に開始する
+            cached_statements=256,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        # 他のプロセスが書き込み中の場合は待つ
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.executescript(SCHEMA_PATH.read_text(encoding="utf-8"))
+        self._conn = conn
+
+    async def connect(self) -> None:
+        await self._run(self._connect)
+
+    async def close(self) -> None:
+        if self._conn:
+            await self._run(self._conn.close)
+        self._executor.shutdown(wait=False)
+
+    def _fetch_all(self, sql: str, params=()) -> List[dict]:
+        return [dict(row) for row in self._conn.execute(sql, params).fetchall()]
+
+    def _fetch_one(self, sql: str, params=()) -> Optional[dict]:
+        row = self._conn.execute(sql, params).fetchone()
+        return dict(row) if row else None
+
+    async def list_active(self, queue_id: str) -> List[dict]:
+        return await self._run(
+            self._fetch_all,
+            f"{SELECT_RESERVATION} WHERE queue_id = ? AND status IN ('waiting', 'in_progress') ORDER BY queue_number",
+            (queue_id,),
+        )
+
+    def _count_completed(self, today: date, queue_id: str) -> dict:
+        today_start = to_utc_iso(datetime(today.year, today.month, today.day, tzinfo=timezone.utc))
+        row = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(completed_at >= ?), 0)"
+            " FROM reservations WHERE queue_id = ? AND status = 'completed'",
+            (today_start, queue_id),
+        ).fetchone()
+        # 履歴に移した予約は日ごとの件数で持っている
+        archived = self._conn.execute(
+            "SELECT COALESCE(SUM(count), 0), COALESCE(SUM(CASE WHEN day = ? THEN count ELSE 0 END), 0)"
+            " FROM archived_daily_completions WHERE queue_id = ?",
+            (today.isoformat(), queue_id),
+        ).fetchone()
+        return {"completed_count": row[0] + archived[0], "today_completed_count": row[1] + archived[1]}
+
+    async def count_completed(self, today: date, queue_id: str) -> dict:
+        return await self._run(self._count_completed, today, queue_id)
+
+    async def get(self, queue_number: int) -> Optional[dict]:
+        return await self._run(self._fetch_one, f"{SELECT_RESERVATION} WHERE queue_number = ?", (queue_number,))
+
+    async def list(
+        self,
+        cursor: Optional[int] = None,
+        limit: int = 500,
+        status: Optional[str] = None,
+        created_from: Optional[datetime] = None,
+        created_to: Optional[datetime] = None,
+        updated_since: Optional[datetime] = None,
+        queue_id: Optional[str] = None,
+    ) -> List[dict]:
+        conditions = []
+        params = []
+        if queue_id:
+            conditions.append("queue_id = ?")
+            params.append(queue_id)
+        if cursor is not None:
+            conditions.append("queue_number > ?")
+            params.append(cursor)
+        if status:
+            conditions.append("status = ?")
+            params.append(status)
+        if created_from:
+            conditions.append("created_at >= ?")
+            params.append(to_utc_iso(created_from))
+        if created_to:
+            conditions.append("created_at < ?")
+            params.append(to_utc_iso(created_to))
+        if updated_since:
+            conditions.append("updated_at >= ?")
+            params.append(to_utc_iso(updated_since))
+
+        sql = SELECT_RESERVATION
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY queue_number LIMIT ?"
+        params.append(limit)
+        return await self._run(self._fetch_all, sql, params)
+
+    def _create(self, name: str, queue_id: str) -> dict:
+        now = now_iso()
+        return self._fetch_one(
+            f"INSERT INTO reservations (id, queue_id, name, status, created_at, updated_at)"
+            f" VALUES (?, ?, ?, 'waiting', ?, ?) RETURNING {RESERVATION_COLUMNS}",
+            (str(uuid.uuid4()), queue_id, name, now, now),
+        )
+
+    async def create(self, name: str, queue_id: str) -> dict:
+        return await self._run(self._create, name, queue_id)
+
+    def _create_many(self, names: List[str], queue_id: str) -> List[dict]:
+        now = now_iso()
+        values = ",".join(["(?, ?, ?, 'waiting', ?, ?)"] * len(names))
+        params = []
+        for name in names:
+            params.extend((str(uuid.uuid4()), queue_id, name, now, now))
+        created = self._fetch_all(
+            f"INSERT INTO reservations (id, queue_id, name, status, created_at, updated_at)"
+            f" VALUES {values} RETURNING {RESERVATION_COLUMNS}",
+            params,
+        )
+        # RETURNING の順序は保証されないため、予約番号順（names の順）に並べ直す
+        return sorted(created, key=lambda row: row["queue_number"])
+
+    async def create_many(self, names: List[str], queue_id: str) -> List[dict]:
+        return await self._run(self._create_many, names, queue_id)
+
+    def _start(self, queue_number: int, capacity: int) -> dict:
+        conn = self._conn
+        # 書き込みロックを先に取り、状態の確認から更新までを他の書き込みと直列化する
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT status, queue_id FROM reservations WHERE queue_number = ?", (queue_number,)
+            ).fetchone()
+            if row is None:
+                raise ReservationNotFound()
+            if row["status"] != "waiting":
+                raise InvalidTransition(row["status"])
+
+            occupied = conn.execute(
+                "SELECT seat_number FROM reservations WHERE queue_id = ? AND status = 'in_progress'",
+                (row["queue_id"],),
+            ).fetchall()
+            if len(occupied) >= capacity:
+                raise CapacityFull(len(occupied))
+
+            used = {r["seat_number"] for r in occupied}
+            seat_number = next(n for n in range(1, capacity + 1) if n not in used)
+
+            now = now_iso()
+            reservation = self._fetch_one(
+                f"UPDATE reservations SET status = 'in_progress', started_at = ?, seat_number = ?, updated_at = ?"
+                f" WHERE queue_number = ? RETURNING {RESERVATION_COLUMNS}",
+                (now, seat_number, now, queue_number),
+            )
+            conn.execute("COMMIT")
+            return reservation
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    async def start(self, queue_number: int, capacity: int) -> dict:
+        return await self._run(self._start, queue_number, capacity)
+
+    def _update_status(self, queue_number: int, status: str) -> Optional[dict]:
+        now = now_iso()
+        if status in ["completed", "cancelled"]:
+            return self._fetch_one(
+                f"UPDATE reservations SET status = ?, completed_at = ?, updated_at = ?"
+                f" WHERE queue_number = ? RETURNING {RESERVATION_COLUMNS}",
+                (status, now, now, queue_number),
+            )
+        return self._fetch_one(
+            f"UPDATE reservations SET status = ?, updated_at = ?"
+            f" WHERE queue_number = ? RETURNING {RESERVATION_COLUMNS}",
+            (status, now, queue_number),
+        )
+
+    async def update_status(self, queue_number: int, status: str) -> Optional[dict]:
+        return await self._run(self._update_status, queue_number, status)
+
+    def _update_statuses(
+        self, changes: List[Tuple[int, str]], default_capacity: int
+    ) -> List[Union[dict, Exception]]:
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            numbers = [queue_number for queue_number, _ in changes]
+            placeholders = ",".join("?" * len(numbers))
+            current = {
+                row["queue_number"]: row for row in conn.execute(
+                    f"SELECT queue_number, status, queue_id FROM reservations WHERE queue_number IN ({placeholders})",
+                    numbers,
+                ).fetchall()
+            }
+
+            results: List[Union[dict, Exception]] = [ReservationNotFound() for _ in changes]
+            now = now_iso()
+
+            # 完了・キャンセルなどを先に1つの UPDATE で行い、空いた席を体験開始に使えるようにする
+            others = [
+                (i, queue_number, status) for i, (queue_number, status) in enumerate(changes)
+                if status != "in_progress" and queue_number in current
+            ]
+            if others:
+                values = ",".join(["(?, ?)"] * len(others))
+                params = [now, now]
+                for _, queue_number, status in others:
+                    params.extend((queue_number, status))
+                updated = {
+                    row["queue_number"]: row for row in self._fetch_all(
+                        f"UPDATE reservations SET status = v.column2,"
+                        f" completed_at = CASE WHEN v.column2 IN ('completed', 'cancelled') THEN ? ELSE completed_at END,"
+                        f" updated_at = ?"
+                        f" FROM (VALUES {values}) AS v WHERE reservations.queue_number = v.column1"
+                        f" RETURNING {RESERVATION_COLUMNS}",
+                        params,
+                    )
+                }
+                for i, queue_number, _ in others:
+                    results[i] = updated[queue_number]
+
+            # 体験開始は、キューごとの空席を順に割り当ててから1つの UPDATE で行う
+            starts = [
+                (i, queue_number) for i, (queue_number, status) in enumerate(changes)
+                if status == "in_progress" and queue_number in current
+            ]
+            if starts:
+                queue_ids = sorted({current[queue_number]["queue_id"] for _, queue_number in starts})
+                queue_placeholders = ",".join("?" * len(queue_ids))
+                capacities = {queue_id: default_capacity for queue_id in queue_ids}
+                for row in conn.execute(
+                    f"SELECT id, capacity FROM queues WHERE id IN ({queue_placeholders}) AND capacity IS NOT NULL",
+                    queue_ids,
+                ).fetchall():
+                    capacities[row["id"]] = row["capacity"]
+                occupied = {queue_id: set() for queue_id in queue_ids}
+                for row in conn.execute(
+                    f"SELECT queue_id, seat_number FROM reservations"
+                    f" WHERE status = 'in_progress' AND queue_id IN ({queue_placeholders})",
+                    queue_ids,
+                ).fetchall():
+                    occupied[row["queue_id"]].add(row["seat_number"])
+
+                seats = []
+                for i, queue_number in starts:
+                    row = current[queue_number]
+                    queue_id = row["queue_id"]
+                    capacity = capacities[queue_id]
+                    if row["status"] != "waiting":
+                        results[i] = InvalidTransition(row["status"])
+                        continue
+                    if len(occupied[queue_id]) >= capacity:
+                        results[i] = CapacityFull(len(occupied[queue_id]), capacity)
+                        continue
+                    seat_number = next(n for n in range(1, capacity + 1) if n not in occupied[queue_id])
+                    occupied[queue_id].add(seat_number)
+                    seats.append((i, queue_number, seat_number))
+
+                if seats:
+                    values = ",".join(["(?, ?)"] * len(seats))
+                    params = [now, now]
+                    for _, queue_number, seat_number in seats:
+                        params.extend((queue_number, seat_number))
+                    started = {
+                        row["queue_number"]: row for row in self._fetch_all(
+                            f"UPDATE reservations SET status = 'in_progress', started_at = ?, seat_number = v.column2,"
+                            f" updated_at = ?"
+                            f" FROM (VALUES {values}) AS v WHERE reservations.queue_number = v.column1"
+                            f" RETURNING {RESERVATION_COLUMNS}",
+                            params,
+                        )
+                    }
+                    for i, queue_number, _ in seats:
+                        results[i] = started[queue_number]
+
+            conn.execute("COMMIT")
+            return results
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    async def update_statuses(
+        self, changes: List[Tuple[int, str]], default_capacity: int
+    ) -> List[Union[dict, Exception]]:
+        return await self._run(self._update_statuses, changes, default_capacity)
+
+    def _complete_expired(self, duration_minutes: float) -> List[dict]:
+        conn = self._conn
+        now = datetime.now(timezone.utc)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # キューごとの体験時間で期限切れかどうかを判定する
+            candidates = conn.execute(
+                "SELECT r.queue_number, r.started_at, q.duration_minutes FROM reservations r"
+                " LEFT JOIN queues q ON q.id = r.queue_id"
+                " WHERE r.status = 'in_progress' AND r.started_at IS NOT NULL"
+            ).fetchall()
+            expired = [
+                row["queue_number"] for row in candidates
+                if parse_timestamp(row["started_at"])
+                <= now - timedelta(minutes=row["duration_minutes"] or duration_minutes)
+            ]
+            completed = []
+            if expired:
+                placeholders = ",".join("?" * len(expired))
+                completed = self._fetch_all(
+                    f"UPDATE reservations SET status = 'completed', completed_at = ?, updated_at = ?"
+                    f" WHERE queue_number IN ({placeholders}) RETURNING {RESERVATION_COLUMNS}",
+                    (to_utc_iso(now), to_utc_iso(now), *expired),
+                )
+            conn.execute("COMMIT")
+            return completed
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    async def complete_expired(self, duration_minutes: float) -> List[dict]:
+        return await self._run(self._complete_expired, duration_minutes)
+
+    def _archive_finished(self, before: datetime, limit: int) -> int:
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            numbers = [
+                row[0] for row in conn.execute(
+                    "SELECT queue_number FROM reservations"
+                    " WHERE status IN ('completed', 'cancelled') AND completed_at < ?"
+                    " ORDER BY completed_at LIMIT ?",
+                    (to_utc_iso(before), limit),
+                )
+            ]
+            if numbers:
+                placeholders = ",".join("?" * len(numbers))
+                conn.execute(
+                    f"INSERT INTO reservations_history ({RESERVATION_COLUMNS}, archived_at)"
+                    f" SELECT {RESERVATION_COLUMNS}, ? FROM reservations WHERE queue_number IN ({placeholders})",
+                    (now_iso(), *numbers),
+                )
+                # 完了件数は移した分を日ごとの件数に加える（completed_at の先頭10文字が UTC の日付）
+                conn.execute(
+                    "INSERT INTO archived_daily_completions (queue_id, day, count)"
+                    " SELECT queue_id, substr(completed_at, 1, 10), COUNT(*) FROM reservations"
+                    f" WHERE queue_number IN ({placeholders}) AND status = 'completed'"
+                    " GROUP BY 1, 2"
+                    " ON CONFLICT (queue_id, day) DO UPDATE SET count = count + excluded.count",
+                    numbers,
+                )
+                conn.execute(f"DELETE FROM reservations WHERE queue_number IN ({placeholders})", numbers)
+            conn.execute("COMMIT")
+            return len(numbers)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    async def archive_finished(self, before: datetime, limit: int) -> int:
+        return await self._run(self._archive_finished, before, limit)
+
+    async def get_archived(self, queue_number: int) -> Optional[dict]:
+        return await self._run(self._fetch_one, f"{SELECT_ARCHIVED} WHERE queue_number = ?", (queue_number,))
+
+    async def list_archived(
+        self,
+        cursor: Optional[int] = None,
+        limit: int = 500,
+        created_from: Optional[datetime] = None,
+        created_to: Optional[datetime] = None,
+        queue_id: Optional[str] = None,
+    ) -> List[dict]:
+        conditions = []
+        params = []
+        if queue_id:
+            conditions.append("queue_id = ?")
+            params.append(queue_id)
+        if cursor is not None:
+            conditions.append("queue_number > ?")
+            params.append(cursor)
+        if created_from:
+            conditions.append("created_at >= ?")
+            params.append(to_utc_iso(created_from))
+        if created_to:
+            conditions.append("created_at < ?")
+            params.append(to_utc_iso(created_to))
+
+        sql = SELECT_ARCHIVED
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY queue_number LIMIT ?"
+        params.append(limit)
+        return await self._run(self._fetch_all, sql, params)
+
+    async def daily_completions(self, queue_id: str, day_from: date, day_to: date) -> List[dict]:
+        # まだ移していない予約はインデックス (queue_id, status, completed_at) で日ごとに数える
+        range_from = to_utc_iso(datetime(day_from.year, day_from.month, day_from.day, tzinfo=timezone.utc))
+        range_to = to_utc_iso(datetime(day_to.year, day_to.month, day_to.day, tzinfo=timezone.utc) + timedelta(days=1))
+        return await self._run(
+            self._fetch_all,
+            "SELECT day, SUM(count) AS count FROM ("
+            " SELECT substr(completed_at, 1, 10) AS day, COUNT(*) AS count FROM reservations"
+            " WHERE queue_id = ? AND status = 'completed' AND completed_at >= ? AND completed_at < ?"
+            " GROUP BY 1"
+            " UNION ALL"
+            " SELECT day, count FROM archived_daily_completions"
+            " WHERE queue_id = ? AND day >= ? AND day <= ?"
+            ") GROUP BY day ORDER BY day",
+            (queue_id, range_from, range_to, queue_id, day_from.isoformat(), day_to.isoformat()),
+        )
+
+    async def get_queue(self, queue_id: str) -> Optional[dict]:
+        return await self._run(self._fetch_one, f"{SELECT_QUEUE} WHERE id = ?", (queue_id,))
+
+    async def list_queues(self) -> List[dict]:
+        return await self._run(self._fetch_all, f"{SELECT_QUEUE} ORDER BY id")
+
+    def _save_queue(self, queue: dict) -> dict:
+        return self._fetch_one(
+            "INSERT INTO queues (id, name, capacity, duration_minutes, seat_names, created_at) VALUES (?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (id) DO UPDATE SET name = excluded.name, capacity = excluded.capacity,"
+            " duration_minutes = excluded.duration_minutes, seat_names = excluded.seat_names"
+            f" RETURNING {QUEUE_COLUMNS}",
+            (queue["id"], queue["name"], queue.get("capacity"), queue.get("duration_minutes"),
+             queue.get("seat_names"), now_iso()),
+        )
+
+    async def save_queue(self, queue: dict) -> dict:
+        return await self._run(self._save_queue, queue)
+
+    def _acquire_lease(self, name: str, holder: str, ttl_seconds: int) -> bool:
+        now = datetime.now(timezone.utc)
+        row = self._conn.execute(
+            "INSERT INTO worker_leases (name, holder, expires_at) VALUES (?, ?, ?)"
+            " ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at"
+            " WHERE worker_leases.holder = excluded.holder OR worker_leases.expires_at < ?"
+            " RETURNING holder",
+            (name, holder, to_utc_iso(now + timedelta(seconds=ttl_seconds)), to_utc_iso(now)),
+        ).fetchone()
+        return row is not None
+
+    async def acquire_lease(self, name: str, holder: str, ttl_seconds: int) -> bool:
+        return await self._run(self._acquire_lease, name, holder, ttl_seconds)
+
+    async def release_lease(self, name: str, holder: str) -> None:
+        await self._run(
+            self._conn.execute, "DELETE FROM worker_leases WHERE name = ? AND holder = ?", (name, holder)
+        )
+
+    def _change_token(self) -> int:
+        # 他の接続（別のプロセス）がコミットするたびに変わる
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    async def change_token(self) -> Optional[int]:
+        return await self._run(self._change_token)
@@ -0,0 +1,260 @@
+from datetime import date, datetime, timezone
+from typing import List, Optional, Tuple, Union
+
+from postgrest.exceptions import APIError
+from supabase import AsyncClient, create_async_client
+
+from repository import (
+    QUEUE_COLUMNS,
+    RESERVATION_COLUMNS,
+    CapacityFull,
+    InvalidTransition,
+    ReservationNotFound,
+    ReservationRepository,
+    to_utc_iso,
+)
+
+
+class SupabaseRepository(ReservationRepository):
+    """
+    Supabase（PostgREST）上の reservations テーブル
+
+    schema.sql の関数（start_reservation など）を利用する
+    """
+
+    backend = "supabase"
+    OPERATION_TABLES = {
+        "count_completed": "reservation_status_counts",
+        "get_archived": "reservations_history",
+        "list_archived": "reservations_history",
+        "daily_completions": "reservation_daily_completions",
+        "get_queue": "queues",
+        "list_queues": "queues",
+        "save_queue": "queues",
+        "acquire_lease": "worker_leases",
+        "release_lease": "worker_leases",
+    }
+
+    def __init__(self, url: str, key: str):
+        self.url = url
+        self.key = key
+        # 非同期クライアントはイベントループ上で作成する必要があるため、connect() で初期化する
+        # （HTTP 接続はクライアント内でプールされ、全リクエストで共有される）
+        self.client: Optional[AsyncClient] = None
+
+    async def connect(self) -> None:
+        self.client = await create_async_client(self.url, self.key)
+
+    async def close(self) -> None:
+        if self.client:
+            # プールしている HTTP 接続を閉じる
+            await self.client.postgrest.aclose()
+
+    def _table(self):
+        return self.client.table("reservations")
+
+    async def list_active(self, queue_id: str) -> List[dict]:
+        response = await (
+            self._table().select(RESERVATION_COLUMNS)
+            .eq("queue_id", queue_id)
+            .in_("status", ["waiting", "in_progress"])
+            .order("queue_number")
+            .execute()
+        )
+        return response.data or []
+
+    async def count_completed(self, today: date, queue_id: str) -> dict:
+        # 完了件数はトリガーで集計済みの件数から1行で取得する
+        response = await self.client.rpc(
+            "reservation_stats",
+            {"p_today": today.isoformat(), "p_queue_id": queue_id}
+        ).execute()
+        counts = response.data[0] if response.data else {}
+        return {
+            "completed_count": counts.get("completed_count") or 0,
+            "today_completed_count": counts.get("today_completed_count") or 0,
+        }
+
+    async def get(self, queue_number: int) -> Optional[dict]:
+        response = await self._table().select(RESERVATION_COLUMNS).eq("queue_number", queue_number).execute()
+        return response.data[0] if response.data else None
+
+    async def list(
+        self,
+        cursor: Optional[int] = None,
+        limit: int = 500,
+        status: Optional[str] = None,
+        created_from: Optional[datetime] = None,
+        created_to: Optional[datetime] = None,
+        updated_since: Optional[datetime] = None,
+        queue_id: Optional[str] = None,
+    ) -> List[dict]:
+        query = self._table().select(RESERVATION_COLUMNS)
+        if queue_id:
+            query = query.eq("queue_id", queue_id)
+        if cursor is not None:
+            query = query.gt("queue_number", cursor)
+        if status:
+            query = query.eq("status", status)
+        if created_from:
+            query = query.gte("created_at", to_utc_iso(created_from))
+        if created_to:
+            query = query.lt("created_at", to_utc_iso(created_to))
+        if updated_since:
+            query = query.gte("updated_at", to_utc_iso(updated_since))
+
+        response = await query.order("queue_number").limit(limit).execute()
+        return response.data or []
+
+    async def create(self, name: str, queue_id: str) -> dict:
+        response = await self._table().insert({
+            "name": name,
+            "queue_id": queue_id,
+            "status": "waiting"
+        }).execute()
+
+        if not response.data:
+            raise RuntimeError("予約の作成に失敗しました")
+        return response.data[0]
+
+    async def create_many(self, names: List[str], queue_id: str) -> List[dict]:
+        # 複数行を1回のリクエスト（1つの INSERT）で作成する
+        response = await self._table().insert([
+            {"name": name, "queue_id": queue_id, "status": "waiting"} for name in names
+        ]).execute()
+
+        if len(response.data or []) != len(names):
+            raise RuntimeError("予約の作成に失敗しました")
+        return sorted(response.data, key=lambda row: row["queue_number"])
+
+    async def start(self, queue_number: int, capacity: int) -> dict:
+        try:
+            response = await self.client.rpc(
+                "start_reservation",
+                {"p_queue_number": queue_number, "p_capacity": capacity}
+            ).execute()
+        except APIError as e:
+            if e.message == "capacity_full":
+                raise CapacityFull(int(e.details or 0))
+            if e.message == "invalid_transition":
+                raise InvalidTransition(e.details or "")
+            if e.message == "reservation_not_found":
+                raise ReservationNotFound()
+            raise
+
+        if not response.data:
+            raise ReservationNotFound()
+        return response.data[0]
+
+    async def update_status(self, queue_number: int, status: str) -> Optional[dict]:
+        update_data = {"status": status}
+
+        # ステータスに応じてタイムスタンプを更新（UTC で保存）
+        if status in ["completed", "cancelled"]:
+            update_data["completed_at"] = datetime.now(timezone.utc).isoformat()
+
+        response = await self._table().update(update_data).eq("queue_number", queue_number).execute()
+        return response.data[0] if response.data else None
+
+    async def update_statuses(
+        self, changes: List[Tuple[int, str]], default_capacity: int
+    ) -> List[Union[dict, Exception]]:
+        response = await self.client.rpc(
+            "update_reservation_statuses",
+            {
+                "p_changes": [{"queue_number": queue_number, "status": status} for queue_number, status in changes],
+                "p_default_capacity": default_capacity,
+            }
+        ).execute()
+
+        results: List[Union[dict, Exception]] = [ReservationNotFound() for _ in changes]
+        for item in response.data or []:
+            error = item.get("error_code")
+            if error is None:
+                result = item["row_data"]
+            elif error == "capacity_full":
+                result = CapacityFull(int(item.get("error_detail") or 0), item.get("item_capacity"))
+            elif error == "invalid_transition":
+                result = InvalidTransition(item.get("error_detail") or "")
+            else:
+                result = ReservationNotFound()
+            results[item["item_index"]] = result
+        return results
+
+    async def complete_expired(self, duration_minutes: float) -> List[dict]:
+        response = await self.client.rpc(
+            "complete_expired_reservations",
+            {"p_duration_minutes": duration_minutes}
+        ).execute()
+        return response.data or []
+
+    async def archive_finished(self, before: datetime, limit: int) -> int:
+        response = await self.client.rpc(
+            "archive_finished_reservations",
+            {"p_before": to_utc_iso(before), "p_limit": limit}
+        ).execute()
+        return response.data or 0
+
+    async def get_archived(self, queue_number: int) -> Optional[dict]:
+        response = await (
+            self.client.table("reservations_history").select(RESERVATION_COLUMNS)
+            .eq("queue_number", queue_number)
+            .execute()
+        )
+        return response.data[0] if response.data else None
+
+    async def list_archived(
+        self,
+        cursor: Optional[int] = None,
+        limit: int = 500,
+        created_from: Optional[datetime] = None,
+        created_to: Optional[datetime] = None,
+        queue_id: Optional[str] = None,
+    ) -> List[dict]:
+        query = self.client.table("reservations_history").select(RESERVATION_COLUMNS)
+        if queue_id:
+            query = query.eq("queue_id", queue_id)
+        if cursor is not None:
+            query = query.gt("queue_number", cursor)
+        if created_from:
+            query = query.gte("created_at", to_utc_iso(created_from))
+        if created_to:
+            query = query.lt("created_at", to_utc_iso(created_to))
+
+        response = await query.order("queue_number").limit(limit).execute()
+        return response.data or []
+
+    async def daily_completions(self, queue_id: str, day_from: date, day_to: date) -> List[dict]:
+        response = await (
+            self.client.table("reservation_daily_completions").select("day,count")
+            .eq("queue_id", queue_id)
+            .gte("day", day_from.isoformat())
+            .lte("day", day_to.isoformat())
+            .order("day")
+            .execute()
+        )
+        return response.data or []
+
+    async def get_queue(self, queue_id: str) -> Optional[dict]:
+        response = await self.client.table("queues").select(QUEUE_COLUMNS).eq("id", queue_id).execute()
+        return response.data[0] if response.data else None
+
+    async def list_queues(self) -> List[dict]:
+        response = await self.client.table("queues").select(QUEUE_COLUMNS).order("id").execute()
+        return response.data or []
+
+    async def save_queue(self, queue: dict) -> dict:
+        response = await self.client.table("queues").upsert(queue).execute()
+        if not response.data:
+            raise RuntimeError("キューの保存に失敗しました")
+        return response.data[0]
+
+    async def acquire_lease(self, name: str, holder: str, ttl_seconds: int) -> bool:
+        response = await self.client.rpc(
+            "acquire_lease",
+            {"p_name": name, "p_holder": holder, "p_ttl_seconds": ttl_seconds}
+        ).execute()
+        return response.data is True
+
+    async def release_lease(self, name: str, holder: str) -> None:
+        await self.client.rpc("release_lease", {"p_name": name, "p_holder": holder}).execute()
@@ -0,0 +1,99 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from queue_state import QueueState
+
+NOW = datetime.now(timezone.utc).replace(microsecond=0)
+
+
+def row(queue_number: int, status: str, minutes: int, **values) -> dict:
+    return {
+        "id": f"id-{queue_number}",
+        "queue_number": queue_number,
+        "name": f"name-{queue_number}",
+        "status": status,
+        "created_at": NOW.isoformat(),
+        "updated_at": (NOW + timedelta(minutes=minutes)).isoformat(),
+        **values,
+    }
+
+
+def snapshot(*rows: dict, completed_count: int = 0) -> dict:
+    return {"active": list(rows), "completed_count": completed_count, "today_completed_count": completed_count}
+
+
+class SlowLoader:
+    """
+    呼ばれたときの snapshot を、release() されるまで返さないローダー（読み込み中の書き込みを再現する）
+    """
+
+    def __init__(self, snapshot: dict):
+        self.snapshot = snapshot
+        self.started = asyncio.Event()
+        self._released = asyncio.Event()
+
+    def release(self) -> None:
+        self._released.set()
+
+    async def __call__(self) -> dict:
+        result = self.snapshot
+        self.started.set()
+        await self._released.wait()
+        return result
+
+
+async def reload_during(state: QueueState, loader: SlowLoader, writes) -> None:
+    state.invalidate()
+    task = asyncio.create_task(state.ensure_fresh())
+    await loader.started.wait()
+    writes()
+    loader.release()
+    await task
+
+
+def test_create_during_reload_is_kept():
+    loader = SlowLoader(snapshot(row(1, "waiting", 0)))
+    state = QueueState(loader, max_age_seconds=30)
+    state.load(loader.snapshot)
+
+    created = row(2, "waiting", 1)
+    asyncio.run(reload_during(state, loader, lambda: state.apply(created)))
+
+    assert sorted(state.waiting) == [1, 2]
+    # 変更通知で同じ行が届いても二重に反映しない
+    assert state.apply(created) is False
+
+
+def test_status_change_during_reload_is_kept():
+    loader = SlowLoader(snapshot(row(1, "in_progress", 0, seat_number=1), completed_count=3))
+    state = QueueState(loader, max_age_seconds=30)
+    state.load(loader.snapshot)
+
+    completed = row(1, "completed", 1, completed_at=(NOW + timedelta(minutes=1)).isoformat())
+    asyncio.run(reload_during(state, loader, lambda: state.apply(completed)))
+
+    assert state.in_progress == {}
+    assert state.completed_count == 4
+    assert state.apply(completed) is False
+    assert state.completed_count == 4
+
+
+def test_snapshot_newer_than_write_wins():
+    # 読み込み中に反映した変更より、読み込んだスナップショットの方が新しい場合
+    loader = SlowLoader(snapshot(row(1, "in_progress", 5, seat_number=1)))
+    state = QueueState(loader, max_age_seconds=30)
+    state.load(snapshot(row(1, "waiting", 0)))
+
+    asyncio.run(reload_during(state, loader, lambda: state.apply(row(1, "waiting", 2))))
+
+    assert list(state.in_progress) == [1]
+    assert state.waiting == {}
+
+
+def test_older_row_is_ignored():
+    state = QueueState(None, max_age_seconds=30)
+    state.load(snapshot(row(1, "waiting", 0)))
+
+    assert state.apply(row(1, "in_progress", 2, seat_number=1)) is True
+    assert state.apply(row(1, "waiting", 1)) is False
+    assert list(state.in_progress) == [1]
@@ -1,8 +1,22 @@
 'use client';
 
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { useRouter } from 'next/navigation';
-import { Reservation, ReservationWithWaitTime } from '@/types/reservation';
+import {
+  Reservation,
+  ReservationWithWaitTime,
+  WaitTimes,
+  ReservationEvent,
+  ReservationsEvent,
+} from '@/types/reservation';
+import { mergeReservations, applyWaitingChanges } from '@/lib/reservations';
+
+// この画面で管理するキュー（ブース）
+const QUEUE_ID = process.env.NEXT_PUBLIC_QUEUE_ID || 'default';
+
+// 差分取得で前回の最新の更新日時より少し前から取り直す秒数
+// （同じ時刻に更新された予約や、サーバー間の時刻のずれで取りこぼさないように）
+const UPDATED_SINCE_OVERLAP_SECONDS = 5;
 
 export default function AdminPage() {
   const router = useRouter();
@@ -10,22 +24,49 @@ export default function AdminPage() {
   const [waitingWithTimes, setWaitingWithTimes] = useState<ReservationWithWaitTime[]>([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState('');
+  // 席数（同時に体験できる最大人数、サーバーの設定に従う）
+  const [seatCount, setSeatCount] = useState(3);
+  // 取得済みの予約の中で最も新しい更新日時（差分取得に使う）
+  const lastUpdatedAt = useRef<string | null>(null);
 
-  const fetchReservations = async () => {
-    try {
-      const [reservationsResponse, waitingTimesResponse] = await Promise.all([
-        fetch(`${process.env.NEXT_PUBLIC_API_URL}/reservations`),
-        fetch(`${process.env.NEXT_PUBLIC_API_URL}/reservations/waiting/with-wait-times`)
-      ]);
+  // 予約をページごとに取得（updatedSince を指定するとその日時以降に変更された予約のみ）
+  const fetchReservationPages = async (updatedSince: string | null) => {
+    const rows: Reservation[] = [];
+    let cursor: string | null = null;
+    do {
+      const params = new URLSearchParams({ limit: '500', queue_id: QUEUE_ID });
+      if (cursor) params.set('cursor', cursor);
+      if (updatedSince) params.set('updated_since', updatedSince);
 
-      if (!reservationsResponse.ok) {
+      const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/reservations?${params}`);
+      if (!response.ok) {
         throw new Error('予約情報の取得に失敗しました');
       }
+      rows.push(...(await response.json()));
+      cursor = response.headers.get('X-Next-Cursor');
+    } while (cursor);
+    return rows;
+  };
 
-      const data = await reservationsResponse.json();
-      // 降順（新しい順）にソート
-      const sortedData = data.sort((a: Reservation, b: Reservation) => b.queue_number - a.queue_number);
-      setReservations(sortedData);
+  const fetchReservations = async (full = false) => {
+    try {
+      const updatedSince =
+        full || !lastUpdatedAt.current
+          ? null
+          : new Date(new Date(lastUpdatedAt.current).getTime() - UPDATED_SINCE_OVERLAP_SECONDS * 1000).toISOString();
+      const [changed, waitingTimesResponse] = await Promise.all([
+        fetchReservationPages(updatedSince),
+        fetch(`${process.env.NEXT_PUBLIC_API_URL}/reservations/waiting/with-wait-times?queue_id=${QUEUE_ID}`)
+      ]);
+
+      // 変更された予約を反映
+      setReservations((prev) => mergeReservations(updatedSince ? prev : [], changed));
+
+      changed.forEach((r) => {
+        if (r.updated_at && (!lastUpdatedAt.current || new Date(r.updated_at) > new Date(lastUpdatedAt.current))) {
+          lastUpdatedAt.current = r.updated_at;
+        }
+      });
 
       // 待機中の予約の待ち時間情報を取得
       if (waitingTimesResponse.ok) {
@@ -41,12 +82,42 @@ export default function AdminPage() {
   };
 
   useEffect(() => {
-    fetchReservations();
+    fetchReservations(true);
+
+    // サーバーから配信された予約の変更をそのまま反映する
+    const applyChanges = (changed: Reservation[]) => {
+      setReservations((prev) => mergeReservations(prev, changed));
+      setWaitingWithTimes((prev) => applyWaitingChanges(prev, changed));
+    };
+    const events = new EventSource(`${process.env.NEXT_PUBLIC_API_URL}/events?queue_id=${QUEUE_ID}`);
+    events.addEventListener('reservation', (e) => {
+      applyChanges([(JSON.parse((e as MessageEvent).data) as ReservationEvent).reservation]);
+    });
+    events.addEventListener('reservations', (e) => {
+      applyChanges((JSON.parse((e as MessageEvent).data) as ReservationsEvent).reservations);
+    });
+    // 配信が間に合わなかった場合は全件を取り直す
+    events.addEventListener('resync', () => fetchReservations(true));
+    events.addEventListener('stats', (e) => {
+      setSeatCount(JSON.parse((e as MessageEvent).data).seat_count);
+    });
+    events.addEventListener('wait_times', (e) => {
+      const waitTimes: WaitTimes = JSON.parse((e as MessageEvent).data);
+      setWaitingWithTimes((prev) =>
+        prev.map((reservation) => ({
+          ...reservation,
+          estimated_wait_minutes: waitTimes[reservation.queue_number] ?? reservation.estimated_wait_minutes,
+        }))
+      );
+    });
 
-    // 10秒ごとに自動更新
-    const interval = setInterval(fetchReservations, 10000);
+    // 接続が切れていた場合に備えて60秒ごとにも更新
+    const interval = setInterval(() => fetchReservations(), 60000);
 
-    return () => clearInterval(interval);
+    return () => {
+      events.close();
+      clearInterval(interval);
+    };
   }, []);
 
   const updateStatus = async (queueNumber: number, newStatus: string) => {
@@ -111,8 +182,7 @@ export default function AdminPage() {
   const waitingReservations = waitingWithTimes;
 
   // 空いている席の数を計算
-  const MAX_CONCURRENT = 3;
-  const availableSeats = MAX_CONCURRENT - inProgressCount;
+  const availableSeats = seatCount - inProgressCount;
 
   // 次に案内すべき予約（空いている席の数だけ）
   const nextToCall = waitingReservations.slice(0, Math.max(0, availableSeats));
@@ -282,14 +352,14 @@ export default function AdminPage() {
             <div className="flex justify-between items-center">
               <h2 className="text-2xl font-bold text-slate-900">予約一覧</h2>
               <button
-                onClick={fetchReservations}
+                onClick={() => fetchReservations(true)}
                 className="bg-blue-600 hover:bg-blue-700 text-white font-bold py-3 px-5 rounded-lg transition text-base shadow-sm"
               >
                 更新
               </button>
             </div>
             <p className="text-sm text-slate-500 mt-2">
-              10秒ごとに自動更新されます
+              変更があると自動更新されます
             </p>
           </div>
 
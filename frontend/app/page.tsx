@@ -2,7 +2,19 @@
 
 import { useState, useEffect } from 'react';
 import { useRouter } from 'next/navigation';
-import { Stats, ReservationWithWaitTime } from '@/types/reservation';
+import {
+  Stats,
+  ReservationWithWaitTime,
+  WaitTimes,
+  Dashboard,
+  StatusChangeResult,
+  ReservationEvent,
+  ReservationsEvent,
+} from '@/types/reservation';
+import { applyWaitingChanges } from '@/lib/reservations';
+
+// このページで表示・受付するキュー（ブース）
+const QUEUE_ID = process.env.NEXT_PUBLIC_QUEUE_ID || 'default';
 
 export default function Home() {
   const [name, setName] = useState('');
@@ -40,43 +52,56 @@ export default function Home() {
     }
   };
 
-  // 統計情報を取得
-  const fetchStats = async () => {
+  // 統計情報と待機中のリスト（待ち時間付き）をまとめて取得
+  const fetchDashboard = async () => {
     try {
-      const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/stats`);
+      const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/dashboard?queue_id=${QUEUE_ID}`);
       if (response.ok) {
-        const data = await response.json();
-        setStats(data);
+        const data: Dashboard = await response.json();
+        setStats(data.stats);
+        setWaitingList(data.waiting);
       }
     } catch (err) {
-      console.error('統計情報の取得に失敗しました', err);
-    }
-  };
-
-  // 待機中のリストを取得（待ち時間付き）
-  const fetchWaitingList = async () => {
-    try {
-      const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/reservations/waiting/with-wait-times`);
-      if (response.ok) {
-        const data = await response.json();
-        setWaitingList(data);
-      }
-    } catch (err) {
-      console.error('待機リストの取得に失敗しました', err);
+      console.error('待ち状況の取得に失敗しました', err);
     }
   };
 
   useEffect(() => {
-    fetchStats();
-    fetchWaitingList();
+    fetchDashboard();
+
+    // サーバーからの変更通知で更新
+    const events = new EventSource(`${process.env.NEXT_PUBLIC_API_URL}/events?queue_id=${QUEUE_ID}`);
+    events.addEventListener('stats', (e) => {
+      setStats(JSON.parse((e as MessageEvent).data));
+    });
+    events.addEventListener('wait_times', (e) => {
+      const waitTimes: WaitTimes = JSON.parse((e as MessageEvent).data);
+      setWaitingList((prev) =>
+        prev.map((reservation) => ({
+          ...reservation,
+          estimated_wait_minutes: waitTimes[reservation.queue_number] ?? reservation.estimated_wait_minutes,
+        }))
+      );
+    });
+    // 予約の追加・ステータス変更は配信された行を反映する（統計情報は stats で届く）
+    events.addEventListener('reservation', (e) => {
+      const { reservation }: ReservationEvent = JSON.parse((e as MessageEvent).data);
+      setWaitingList((prev) => applyWaitingChanges(prev, [reservation]));
+    });
+    events.addEventListener('reservations', (e) => {
+      const { reservations }: ReservationsEvent = JSON.parse((e as MessageEvent).data);
+      setWaitingList((prev) => applyWaitingChanges(prev, reservations));
+    });
+    // 配信が間に合わなかった場合は取り直す
+    events.addEventListener('resync', fetchDashboard);
 
-    // 10秒ごとに自動更新
-    const interval = setInterval(() => {
-      fetchStats();
-      fetchWaitingList();
-    }, 10000);
+    // 接続が切れていた場合に備えて60秒ごとにも更新
+    const interval = setInterval(fetchDashboard, 60000);
 
-    return () => clearInterval(interval);
+    return () => {
+      events.close();
+      clearInterval(interval);
+    };
   }, []);
 
   // 現在時刻を1秒ごとに更新
@@ -140,8 +165,39 @@ export default function Home() {
       }
 
       // 更新後に再取得
-      fetchStats();
-      fetchWaitingList();
+      fetchDashboard();
+    } catch (err) {
+      alert('ステータスの更新に失敗しました');
+    }
+  };
+
+  // 超過している席をまとめて完了（1回のリクエストで変更する）
+  const completeAllOvertime = async (queueNumbers: number[]) => {
+    try {
+      const response = await fetch(
+        `${process.env.NEXT_PUBLIC_API_URL}/reservations/batch`,
+        {
+          method: 'PATCH',
+          headers: {
+            'Content-Type': 'application/json',
+          },
+          body: JSON.stringify({
+            changes: queueNumbers.map((queueNumber) => ({ queue_number: queueNumber, status: 'completed' })),
+          }),
+        }
+      );
+
+      if (!response.ok) {
+        throw new Error('ステータスの更新に失敗しました');
+      }
+
+      const results: StatusChangeResult[] = await response.json();
+      if (results.some((result) => !result.ok)) {
+        alert('一部の予約を完了にできませんでした');
+      }
+
+      // 更新後に再取得
+      fetchDashboard();
     } catch (err) {
       alert('ステータスの更新に失敗しました');
     }
@@ -164,7 +220,7 @@ export default function Home() {
         headers: {
           'Content-Type': 'application/json',
         },
-        body: JSON.stringify({ name: name.trim() }),
+        body: JSON.stringify({ name: name.trim(), queue_id: QUEUE_ID }),
       });
 
       if (!response.ok) {
@@ -204,7 +260,7 @@ export default function Home() {
                 </div>
                 <div className="space-y-3">
                   {stats.overtime_seats.map((seat) => (
-                    <div key={seat.seat_name} className="bg-white bg-opacity-60 rounded-xl p-5">
+                    <div key={seat.seat_number} className="bg-white bg-opacity-60 rounded-xl p-5">
                       <div className="flex justify-between items-center mb-3">
                         <div className="flex items-center gap-3">
                           <span className="text-xl font-bold text-slate-900">{seat.seat_name}</span>
@@ -223,6 +279,14 @@ export default function Home() {
                     </div>
                   ))}
                 </div>
+                {stats.overtime_seats.length > 1 && (
+                  <button
+                    onClick={() => completeAllOvertime(stats.overtime_seats.map((seat) => seat.queue_number))}
+                    className="w-full mt-3 bg-red-600 hover:bg-red-700 text-white font-bold py-3 px-4 rounded-lg text-lg transition shadow-sm"
+                  >
+                    すべて完了
+                  </button>
+                )}
                 <div className="mt-4 text-sm text-red-700 font-medium">
                   スタッフにお声がけください
                 </div>
@@ -267,9 +331,9 @@ export default function Home() {
                 <h3 className="text-base font-bold text-slate-700 mb-2">各席の状況</h3>
                 <div className="grid grid-cols-1 sm:grid-cols-2 lg:grid-cols-1 xl:grid-cols-2 gap-3">
                   {stats.seats.map((seat) => {
-                    const progress = (seat.remaining_minutes / 10) * 100;
+                    const progress = (seat.remaining_minutes / stats.duration_minutes) * 100;
                     return (
-                      <div key={seat.seat_name} className="bg-slate-50 border-2 border-slate-200 rounded-xl p-3">
+                      <div key={seat.seat_number} className="bg-slate-50 border-2 border-slate-200 rounded-xl p-3">
                         <div className="flex justify-between items-center mb-3">
                           <div className="flex items-center gap-3">
                             <span className="text-xl font-bold text-slate-900">{seat.seat_name}</span>
@@ -41,10 +41,22 @@ export default function WaitPage() {
   useEffect(() => {
     fetchWaitInfo();
 
-    // 30秒ごとに自動更新
-    const interval = setInterval(fetchWaitInfo, 30000);
-
-    return () => clearInterval(interval);
+    // 自分の予約の待ち状況が変わったときに通知を受け取る
+    const events = new EventSource(
+      `${process.env.NEXT_PUBLIC_API_URL}/events?queue_number=${queueNumber}`
+    );
+    events.addEventListener('wait_info', (e) => {
+      setWaitInfo(JSON.parse((e as MessageEvent).data));
+    });
+    events.addEventListener('resync', fetchWaitInfo);
+
+    // 接続が切れていた場合に備えて60秒ごとにも更新
+    const interval = setInterval(fetchWaitInfo, 60000);
+
+    return () => {
+      events.close();
+      clearInterval(interval);
+    };
   }, [queueNumber]);
 
   if (loading) {
@@ -0,0 +1,37 @@
+import { Reservation, ReservationWithWaitTime } from '@/types/reservation';
+
+// 取得済みの予約の方が新しい（updated_at が後）かどうか
+const isStale = (current: Reservation | undefined, changed: Reservation) =>
+  !!current?.updated_at && !!changed.updated_at && new Date(current.updated_at) > new Date(changed.updated_at);
+
+// 予約一覧に変更された予約を予約番号ごとに反映する（取得済みの方が新しい場合はそのまま）
+// 降順（新しい順）で返す
+export const mergeReservations = (prev: Reservation[], changed: Reservation[]) => {
+  const byQueueNumber = new Map<number, Reservation>();
+  prev.forEach((r) => byQueueNumber.set(r.queue_number, r));
+  changed.forEach((r) => {
+    if (!isStale(byQueueNumber.get(r.queue_number), r)) {
+      byQueueNumber.set(r.queue_number, r);
+    }
+  });
+  return Array.from(byQueueNumber.values()).sort((a, b) => b.queue_number - a.queue_number);
+};
+
+// 配信された予約の変更を待機中の一覧に反映する（待機中でなくなった予約は外す）
+// 待ち時間は続けて配信される wait_times で更新する。予約番号順で返す
+export const applyWaitingChanges = (prev: ReservationWithWaitTime[], changed: Reservation[]) => {
+  const byQueueNumber = new Map<number, ReservationWithWaitTime>();
+  prev.forEach((r) => byQueueNumber.set(r.queue_number, r));
+  changed.forEach((r) => {
+    const current = byQueueNumber.get(r.queue_number);
+    if (isStale(current, r)) {
+      return;
+    }
+    if (r.status === 'waiting') {
+      byQueueNumber.set(r.queue_number, { ...r, estimated_wait_minutes: current?.estimated_wait_minutes ?? 0 });
+    } else {
+      byQueueNumber.delete(r.queue_number);
+    }
+  });
+  return Array.from(byQueueNumber.values()).sort((a, b) => a.queue_number - b.queue_number);
+};
@@ -1,29 +1,38 @@
 export interface Reservation {
   id: string;
   queue_number: number;
+  queue_id?: string;
   name: string;
   status: 'waiting' | 'in_progress' | 'completed' | 'cancelled';
   created_at: string;
   started_at?: string;
   completed_at?: string;
+  updated_at?: string;
+  seat_number?: number;
 }
 
 export interface ReservationWithWaitTime extends Reservation {
   estimated_wait_minutes: number;
+  estimated_wait_minutes_p50?: number; // ?bands=true の場合のみ
+  estimated_wait_minutes_p90?: number;
 }
 
 export interface WaitInfo {
   queue_number: number;
   position: number;
   estimated_wait_minutes: number;
+  estimated_wait_minutes_p50?: number; // ?bands=true の場合のみ
+  estimated_wait_minutes_p90?: number;
   current_status: string;
 }
 
 export interface ReservationCreate {
   name: string;
+  queue_id?: string;
 }
 
 export interface Seat {
+  seat_number: number;
   seat_name: string;
   name: string;
   remaining_minutes: number;
@@ -31,6 +40,7 @@ export interface Seat {
 }
 
 export interface OvertimeSeat {
+  seat_number: number;
   seat_name: string;
   name: string;
   overtime_minutes: number;
@@ -43,6 +53,38 @@ export interface Stats {
   completed_count: number;
   today_completed_count: number;
   estimated_wait_minutes: number;
+  estimated_wait_minutes_p50?: number; // ?bands=true の場合のみ
+  estimated_wait_minutes_p90?: number;
+  seat_count: number;
+  duration_minutes: number; // 体験時間（分、キューの設定）
   seats: Seat[];
   overtime_seats: OvertimeSeat[];
 }
+
+export interface Dashboard {
+  stats: Stats;
+  waiting: ReservationWithWaitTime[];
+}
+
+// /events（Server-Sent Events）で配信されるイベント
+export interface ReservationEvent {
+  change: 'created' | 'status_changed' | 'auto_completed';
+  reservation: Reservation;
+}
+
+// 一括登録・一括ステータス変更・自動完了でまとめて配信されるイベント（reservations）
+export interface ReservationsEvent {
+  change: 'created' | 'status_changed' | 'auto_completed';
+  reservations: Reservation[];
+}
+
+// PATCH /reservations/batch の1件ごとの結果
+export interface StatusChangeResult {
+  queue_number: number;
+  ok: boolean;
+  reservation?: Reservation;
+  error?: string;
+}
+
+// 予約番号 → 予想待ち時間（分）
+export type WaitTimes = Record<string, number>;